@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Startup latency benchmark for DaemonContext.open()
+
+Every sample daemonizes a real subprocess and measures the wall time of
+each phase of DaemonContext.open(). The benchmark runs across a matrix of
+RLIMIT_NOFILE values, counts of open file descriptors and sizes of
+files_preserve, and writes the results as JSON, so that runs of different
+commits can be compared::
+
+    python -m benchmark.open_latency --output before.json
+    git checkout other-commit
+    python -m benchmark.open_latency --output after.json --compare before.json
+"""
+__author__ = 'schlitzer'
+
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PHASES = (
+    'environment',
+    'prevent_core',
+    'first_fork',
+    'second_fork',
+    'signals',
+    'close_filenos',
+    'redirect_streams',
+    'pidfile',
+    'total',
+)
+
+DEFAULT_NOFILE = (1024, 65536, 1048576)
+DEFAULT_OPEN_FDS = (0, 100, 1000)
+DEFAULT_PRESERVE = (0, 10, 100)
+
+
+def child(params):
+    """ Daemonize this process and report the phase timings
+
+    Runs in the benchmark subprocess. The phases are measured with the
+    startup_hook of DaemonContext. The results are written as JSON to
+    the pipe given in params['report_fd'], which is preserved through
+    close_filenos.
+
+    :param params: one point of the benchmark matrix
+    :type params: dict
+
+    :return: None
+    """
+    from pep3143daemon import DaemonContext, PidFile
+
+    nofile = params['nofile']
+    hard = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+    if hard == resource.RLIM_INFINITY or nofile < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (nofile, nofile))
+
+    report_fd = params['report_fd']
+    filenos = [os.open(os.devnull, os.O_RDONLY)
+               for _ in range(params['open_fds'])]
+    preserve = filenos[:params['preserve']] + [report_fd]
+
+    daemon = DaemonContext(
+        detach_process=True, files_preserve=preserve,
+        pidfile=PidFile(params['pidfile']),
+        working_directory=os.getcwd(), startup_hook=lambda event: None)
+    daemon.open()
+
+    phases = dict((event.phase, event.duration)
+                  for event in daemon.startup_report)
+    phases['total'] = daemon.startup_report.duration
+    report = dict(params, phases=phases)
+    os.write(report_fd, json.dumps(report).encode('utf-8'))
+    os.close(report_fd)
+
+
+def sample(params, directory, timeout=60):
+    """ Run one daemonized subprocess and collect its report
+
+    :param params: one point of the benchmark matrix
+    :type params: dict
+
+    :param directory: directory for the pidfile of the daemon
+    :type directory: str
+
+    :param timeout: seconds to wait for the report
+    :type timeout: int
+
+    :return: dict
+    """
+    read_fd, write_fd = os.pipe()
+    params = dict(params, report_fd=write_fd,
+                  pidfile=os.path.join(directory, 'bench.pid'))
+    try:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmark.open_latency',
+             '--child', json.dumps(params)],
+            pass_fds=(write_fd,))
+        os.close(write_fd)
+        process.wait(timeout)
+        data = b''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            chunk = os.read(read_fd, 65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        os.close(read_fd)
+    if not data:
+        raise RuntimeError('daemon sent no report for {0}'.format(params))
+    return json.loads(data.decode('utf-8'))
+
+
+def summarize(samples):
+    """ Aggregate the phase timings of repeated samples
+
+    :param samples: reports returned by sample()
+    :type samples: list
+
+    :return: dict, mapping phase name to min, median, mean and max
+    """
+    result = {}
+    for phase in PHASES:
+        values = sorted(item['phases'][phase] for item in samples
+                        if phase in item['phases'])
+        if not values:
+            continue
+        result[phase] = {
+            'min': values[0],
+            'median': values[len(values) // 2],
+            'mean': sum(values) / len(values),
+            'max': values[-1],
+        }
+    return result
+
+
+def matrix(nofile, open_fds, preserve):
+    """ Create the points of the benchmark matrix
+
+    Values of RLIMIT_NOFILE above the current hard limit cannot be set
+    without privileges and are left out. Preserving more files than are
+    open is not possible, so those points are left out too.
+
+    :return: list of dicts
+    """
+    hard = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+    result = []
+    for limit, fds, keep in itertools.product(nofile, open_fds, preserve):
+        if hard != resource.RLIM_INFINITY and limit > hard:
+            continue
+        if keep > fds or fds + 16 > limit:
+            continue
+        result.append({'nofile': limit, 'open_fds': fds, 'preserve': keep})
+    return result
+
+
+def run(points, repeat):
+    """ Run the benchmark matrix
+
+    :return: dict, ready to be written as JSON
+    """
+    results = []
+    directory = tempfile.mkdtemp(prefix='pep3143daemon-bench-')
+    try:
+        for point in points:
+            samples = [sample(point, directory) for _ in range(repeat)]
+            results.append(
+                dict(point, repeat=repeat, phases=summarize(samples)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+
+def git_commit():
+    """ Return the commit of the checkout the benchmark runs in
+
+    :return: str, or None outside of a git checkout
+    """
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def compare(old, new, stream=sys.stdout):
+    """ Print the median change of each phase between two result sets
+
+    :return: None
+    """
+    def key(item):
+        return item['nofile'], item['open_fds'], item['preserve']
+
+    previous = dict((key(item), item) for item in old['results'])
+    for item in new['results']:
+        before = previous.get(key(item))
+        if before is None:
+            continue
+        for phase in PHASES:
+            if phase not in item['phases'] or phase not in before['phases']:
+                continue
+            a = before['phases'][phase]['median']
+            b = item['phases'][phase]['median']
+            ratio = b / a if a else float('inf')
+            stream.write(
+                'nofile={0} open_fds={1} preserve={2} {3}: '
+                '{4:.6f}s -> {5:.6f}s ({6:.2f}x)\n'.format(
+                    item['nofile'], item['open_fds'], item['preserve'],
+                    phase, a, b, ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the startup latency of DaemonContext.open()')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--nofile', type=int, nargs='+',
+                        default=DEFAULT_NOFILE)
+    parser.add_argument('--open-fds', type=int, nargs='+',
+                        default=DEFAULT_OPEN_FDS)
+    parser.add_argument('--preserve', type=int, nargs='+',
+                        default=DEFAULT_PRESERVE)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='-',
+                        help='file to write the JSON results to')
+    parser.add_argument('--compare',
+                        help='JSON results of a previous run')
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(json.loads(args.child))
+        return
+
+    points = matrix(args.nofile, args.open_fds, args.preserve)
+    results = run(points, args.repeat)
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), results, sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
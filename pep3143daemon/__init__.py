@@ -9,11 +9,44 @@ License: MIT (see LICENSE for details)
 """
 
 
+from pep3143daemon.affinity import Topology
+from pep3143daemon.control import ControlSocket
 from pep3143daemon.daemon import DaemonContext, DaemonError
+from pep3143daemon.executors import ManagedExecutor
+from pep3143daemon.forkhooks import ForkRegistry
+from pep3143daemon.instrument import StartupEvent, StartupReport
+from pep3143daemon.logfile import LogFile
+from pep3143daemon.logwriter import LogWriter
+from pep3143daemon.metrics import MetricsExporter
 from pep3143daemon.pidfile import PidFile
+from pep3143daemon.prefork import PreforkPool
+from pep3143daemon.preload import Preload, PreloadManifest
+from pep3143daemon.profiler import SamplingProfiler
+from pep3143daemon.resources import ResourceProfile
+from pep3143daemon.shutdown import ShutdownCoordinator
+from pep3143daemon.signals import SignalDispatcher
+from pep3143daemon.statspage import StatsPage, StatsReader
 
 __all__ = [
+    "ControlSocket",
     "DaemonContext",
     "DaemonError",
+    "ForkRegistry",
+    "LogFile",
+    "LogWriter",
+    "ManagedExecutor",
+    "MetricsExporter",
     "PidFile",
+    "PreforkPool",
+    "Preload",
+    "PreloadManifest",
+    "ResourceProfile",
+    "SamplingProfiler",
+    "ShutdownCoordinator",
+    "SignalDispatcher",
+    "StartupEvent",
+    "StartupReport",
+    "StatsPage",
+    "StatsReader",
+    "Topology",
 ]
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""Run the command line interface with 'python -m pep3143daemon'"""
+__author__ = 'schlitzer'
+
+
+import sys
+
+from pep3143daemon.cli import main
+
+sys.exit(main())
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+CPU topology, and CPU affinity for a daemon and its workers.
+
+"""
+__author__ = 'schlitzer'
+
+
+import multiprocessing
+import os
+import re
+
+NODE_ROOT = '/sys/devices/system/node'
+
+WORKER_POLICIES = ('core-per-worker', 'node-local')
+
+
+class Topology(object):
+    """
+    The NUMA nodes of the machine, and the CPUs of each node.
+
+    Only CPUs this process may run on are included, so a daemon started
+    inside a cpuset, or with an affinity already set, stays within it.
+
+    :param nodes:
+        Mapping of node number to the sorted list of its CPUs.
+    :type nodes: dict
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    @classmethod
+    def read(cls, root=NODE_ROOT):
+        """ Read the topology from sysfs
+
+        Falls back to a single node with all allowed CPUs, if root is
+        missing, for example on non-NUMA kernels, or outside Linux.
+
+        :param root: sysfs directory of the NUMA nodes
+        :type root: str
+
+        :return: Topology
+        """
+        allowed = set(allowed_cpus())
+        nodes = {}
+        try:
+            entries = os.listdir(root)
+        except OSError:
+            entries = []
+        for entry in entries:
+            match = re.match(r'^node(\d+)$', entry)
+            if not match:
+                continue
+            try:
+                with open(os.path.join(root, entry, 'cpulist')) as cpulist:
+                    cpus = parse_cpulist(cpulist.read())
+            except (IOError, OSError, ValueError):
+                continue
+            cpus = sorted(allowed.intersection(cpus))
+            if cpus:
+                nodes[int(match.group(1))] = cpus
+        if not nodes:
+            nodes = {0: sorted(allowed)}
+        return cls(nodes)
+
+    @property
+    def cpus(self):
+        """ All CPUs, sorted
+
+        :return: list
+        """
+        result = []
+        for node in sorted(self.nodes):
+            result.extend(self.nodes[node])
+        return sorted(result)
+
+    def restrict(self, cpus):
+        """ The topology, limited to a set of CPUs
+
+        Falls back to a single node with these CPUs, if none of them is
+        part of a node.
+
+        :param cpus: CPU numbers
+        :type cpus: iterable
+
+        :return: Topology
+        """
+        cpus = set(cpus)
+        nodes = {}
+        for node, node_cpus in self.nodes.items():
+            node_cpus = sorted(cpus.intersection(node_cpus))
+            if node_cpus:
+                nodes[node] = node_cpus
+        if not nodes:
+            nodes = {0: sorted(cpus)}
+        return Topology(nodes)
+
+    def node_cpus(self, node):
+        """ The CPUs of a node
+
+        :param node: node number
+        :type node: int
+
+        :return: list
+        :raise: ValueError, if the node has no allowed CPUs
+        """
+        if node not in self.nodes:
+            raise ValueError('No CPUs available on NUMA node {0}'.format(node))
+        return list(self.nodes[node])
+
+    def resolve(self, spec):
+        """ Resolve a CPU affinity specification
+
+        :param spec:
+            Iterable of CPU numbers, "all", or "node:N", or "node:N,M"
+            for the CPUs of one or more NUMA nodes.
+        :type spec: iterable, str
+
+        :return: sorted list of CPU numbers
+        :raise: ValueError
+        """
+        if spec == 'all':
+            return self.cpus
+        if isinstance(spec, str):
+            if not spec.startswith('node:'):
+                raise ValueError('Unknown CPU affinity: {0}'.format(spec))
+            cpus = []
+            for node in parse_cpulist(spec[len('node:'):]):
+                cpus.extend(self.node_cpus(node))
+            return sorted(cpus)
+        cpus = sorted(set(int(cpu) for cpu in spec))
+        if not cpus:
+            raise ValueError('Empty CPU affinity')
+        return cpus
+
+    def worker_slices(self, policy, cpus_per_worker=1):
+        """ Split the CPUs into disjoint slices for worker processes
+
+        "core-per-worker" creates slices of cpus_per_worker CPUs, that
+        never span two nodes, and orders them round robin over the
+        nodes, so consecutive workers are spread over the nodes.
+        "node-local" creates one slice per node, with all its CPUs.
+        CPUs left over, because a node has fewer than cpus_per_worker
+        of them, are added to the last slice of their node.
+
+        :param policy: "core-per-worker" or "node-local"
+        :type policy: str
+
+        :param cpus_per_worker: size of a slice for "core-per-worker"
+        :type cpus_per_worker: int
+
+        :return: list of lists of CPU numbers
+        :raise: ValueError
+        """
+        if policy not in WORKER_POLICIES:
+            raise ValueError('Unknown worker CPU policy: {0}'.format(policy))
+        if policy == 'node-local':
+            return [list(self.nodes[node]) for node in sorted(self.nodes)]
+        if cpus_per_worker < 1:
+            raise ValueError('cpus_per_worker must be at least 1')
+        per_node = []
+        for node in sorted(self.nodes):
+            cpus = self.nodes[node]
+            slices = [cpus[index:index + cpus_per_worker] for index in
+                      range(0, len(cpus), cpus_per_worker)]
+            if len(slices) > 1 and len(slices[-1]) < cpus_per_worker:
+                slices[-2].extend(slices.pop())
+            per_node.append(slices)
+        result = []
+        for index in range(max(len(slices) for slices in per_node)):
+            for slices in per_node:
+                if index < len(slices):
+                    result.append(slices[index])
+        return result
+
+
+def parse_cpulist(text):
+    """ Parse a sysfs CPU list, like "0-3,8-11"
+
+    :param text: CPU list
+    :type text: str
+
+    :return: list of int
+    :raise: ValueError
+    """
+    result = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            result.extend(range(int(first), int(last) + 1))
+        else:
+            result.append(int(part))
+    return result
+
+
+def allowed_cpus():
+    """ The CPUs this process may run on
+
+    :return: sorted list of int
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def set_affinity(cpus):
+    """ Bind this process to a set of CPUs
+
+    Processes forked afterwards inherit the affinity.
+
+    :param cpus: CPU numbers
+    :type cpus: iterable
+
+    :return: None
+    :raise: OSError, ValueError
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        raise OSError('CPU affinity is not supported on this platform')
+    os.sched_setaffinity(0, cpus)
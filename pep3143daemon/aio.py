@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio support for a pep3143 daemon implementation.
+
+"""
+__author__ = 'schlitzer'
+
+
+import asyncio
+import signal
+
+from pep3143daemon.daemon import DaemonContext, DaemonError
+
+
+class AsyncDaemonContext(DaemonContext):
+    """ DaemonContext for asyncio based daemons
+
+    The process is daemonized first, then the event loop is created,
+    so it does not have to survive the forks. While the loop runs, the
+    callable entries of the signal_map are installed with
+    loop.add_signal_handler(). They are called in the loop, not at an
+    arbitrary point of the main thread, and may be coroutine functions,
+    which are then run as tasks. Entries mapped to None stay ignored.
+
+    terminate() does not raise SystemExit, it cancels the main coroutine.
+    When it returns, the remaining tasks are cancelled, and get
+    shutdown_timeout seconds to finish.
+
+    Python 3.7 or newer is needed, for asyncio.current_task() and
+    asyncio.all_tasks().
+
+    Usage::
+
+        daemon = AsyncDaemonContext(pidfile=PidFile('/run/server.pid'))
+        daemon.run(serve())
+
+    All arguments of DaemonContext are accepted, and:
+
+    :param use_uvloop:
+        Use the uvloop event loop. If None, uvloop is used when it is
+        installed. If True, DaemonError is raised when it is not.
+    :type use_uvloop: bool
+
+    :param shutdown_timeout:
+        Seconds the remaining tasks get to finish after cancellation.
+    :type shutdown_timeout: float
+    """
+    def __init__(self, use_uvloop=False, shutdown_timeout=10.0, **kwargs):
+        """ Initialize a new Instance
+
+        :raise: DaemonError
+        """
+        if not hasattr(asyncio, 'current_task'):
+            raise DaemonError('AsyncDaemonContext needs Python 3.7 or newer')
+        super(AsyncDaemonContext, self).__init__(**kwargs)
+        self.use_uvloop = use_uvloop
+        self.shutdown_timeout = shutdown_timeout
+        self.loop = None
+        self._main_task = None
+        self._signal_tasks = set()
+        self._saved_handlers = {}
+
+    def new_event_loop(self):
+        """ Create the event loop
+
+        :return: asyncio.AbstractEventLoop
+        :raise: DaemonError
+        """
+        if self.use_uvloop is not False:
+            try:
+                import uvloop
+            except ImportError:
+                if self.use_uvloop:
+                    raise DaemonError('uvloop is not installed')
+            else:
+                return uvloop.new_event_loop()
+        return asyncio.new_event_loop()
+
+    def run(self, main):
+        """ Daemonize, and run a coroutine in a new event loop
+
+        When main returns, raises or is cancelled, the remaining tasks
+        are cancelled, the event loop is closed, and then the daemon,
+        with close().
+
+        :param main: the coroutine to run
+        :type main: coroutine
+
+        :return: the result of main, or None if it was cancelled
+        :raise: DaemonError
+        """
+        try:
+            self.open()
+            self.loop = self.new_event_loop()
+        except BaseException:
+            main.close()
+            raise
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._install_loop_signal_handlers()
+            self._main_task = self.loop.create_task(main)
+            try:
+                return self.loop.run_until_complete(self._main_task)
+            except asyncio.CancelledError:
+                return None
+        finally:
+            try:
+                self.loop.run_until_complete(self._cancel_tasks())
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            finally:
+                try:
+                    self._remove_loop_signal_handlers()
+                    asyncio.set_event_loop(None)
+                    self.loop.close()
+                    self._main_task = None
+                finally:
+                    self.close()
+
+    def _install_loop_signal_handlers(self):
+        """ Route the callable signal_map entries through the loop
+
+        The handlers installed by open() are saved, to be restored when
+        the loop stops.
+
+        :return: None
+        """
+        self._saved_handlers = {}
+        for signal_number, handler in self._signal_handler_map.items():
+            if callable(handler):
+                self._saved_handlers[signal_number] = signal.getsignal(
+                    signal_number)
+                self.loop.add_signal_handler(
+                    signal_number, self._dispatch_signal, signal_number,
+                    handler)
+
+    def _remove_loop_signal_handlers(self):
+        """ Restore the signal handlers saved before the loop ran
+
+        :return: None
+        """
+        for signal_number, handler in self._saved_handlers.items():
+            self.loop.remove_signal_handler(signal_number)
+            if handler is not None:
+                signal.signal(signal_number, handler)
+        self._saved_handlers = {}
+
+    def _dispatch_signal(self, signal_number, handler):
+        """ Call a signal handler in the event loop
+
+        The loop only keeps weak references to tasks, so the tasks of
+        coroutine handlers are kept in _signal_tasks until they are done.
+
+        :return: None
+        """
+        result = handler(signal_number, None)
+        if asyncio.iscoroutine(result):
+            task = self.loop.create_task(result)
+            self._signal_tasks.add(task)
+            task.add_done_callback(self._signal_tasks.discard)
+
+    async def _cancel_tasks(self):
+        """ Cancel the remaining tasks, and wait for them to finish
+
+        Tasks still running after shutdown_timeout are abandoned.
+
+        :return: None
+        """
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks()
+                 if task is not current and not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+
+    def terminate(self, signal_number, stack_frame):
+        """ Terminate this process
+
+        If the event loop is running, the termination is announced like
+        DaemonContext.terminate() does, the shutdown coordinator gets
+        the request, if one is set, and the main coroutine is cancelled,
+        so run() shuts down and returns. Else, DaemonContext.terminate()
+        is called.
+
+        :return: None
+        :raise: SystemExit
+        """
+        if self._main_task is None:
+            super(AsyncDaemonContext, self).terminate(
+                signal_number, stack_frame)
+            return
+        self._request_termination(signal_number)
+        self._main_task.cancel()
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface, to start, stop, restart, reload and query a
+daemon, without writing an init script.
+
+Example::
+
+    pep3143daemon --pidfile /run/app.pid start app.server:main -- --port 80
+    pep3143daemon --pidfile /run/app.pid status
+    pep3143daemon --pidfile /run/app.pid stop
+
+With --stats-page, start keeps a StatsPage at that path, which the
+stats command prints as JSON::
+
+    pep3143daemon --stats-page /run/app.stats stats
+
+start maps the --reload-signal, SIGHUP by default, to
+DaemonContext.reopen_streams, so reload reopens the --stdout and
+--stderr files, after logrotate moved them. A target can install its
+own handler for it.
+
+The target is either a callable, given as module:attribute, a module
+that is run like 'python -m module', or the path to a script. The
+arguments after the target are passed to it in sys.argv.
+"""
+__author__ = 'schlitzer'
+
+
+import argparse
+import errno
+import importlib
+import json
+import os
+import runpy
+import signal
+import sys
+try:
+    from importlib.util import find_spec
+except ImportError:
+    from pkgutil import find_loader as find_spec
+
+from pep3143daemon.daemon import DaemonContext, DaemonError, \
+    default_signal_map
+from pep3143daemon.pidfile import PidFile
+from pep3143daemon.statspage import StatsPage, read_stats
+
+# exit codes of the status command, as used by LSB init scripts
+STATUS_RUNNING = 0
+STATUS_DEAD = 1
+STATUS_STOPPED = 3
+
+COMMANDS = ('start', 'stop', 'restart', 'reload', 'status', 'stats')
+
+
+def main(argv=None):
+    """ Entry point of the pep3143daemon command
+
+    :param argv: command line arguments, without the program name
+    :type argv: list
+
+    :return: int, exit status
+    """
+    options = parser().parse_args(argv)
+    try:
+        if options.pidfile is None and options.command != 'stats':
+            raise DaemonError('{0} requires --pidfile'.format(
+                options.command))
+        if options.command == 'start':
+            return start(options)
+        if options.command == 'stop':
+            return stop(options)
+        if options.command == 'restart':
+            result = stop(options)
+            if result:
+                return result
+            return start(options)
+        if options.command == 'reload':
+            return reload(options)
+        if options.command == 'stats':
+            return stats(options)
+        return status(options)
+    except DaemonError as err:
+        sys.stderr.write('{0}\n'.format(err))
+        return 1
+
+
+def parser():
+    """ Create the argument parser
+
+    The options follow the arguments of DaemonContext.
+
+    :return: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        prog='pep3143daemon',
+        description='Start, stop and control a PEP 3143 daemon.')
+    parser.add_argument(
+        '--pidfile', default=None,
+        help='pidfile, used to find the running daemon, needed by all '
+             'commands but stats')
+    parser.add_argument(
+        '--chroot-directory', default=None,
+        help='change the root directory to this directory')
+    parser.add_argument(
+        '--working-directory', default='/',
+        help='working directory of the daemon (default: /)')
+    parser.add_argument(
+        '--umask', default=0, type=octal,
+        help='octal file creation mask (default: 0)')
+    parser.add_argument(
+        '--uid', default=None, type=user_id,
+        help='user name or id to run as')
+    parser.add_argument(
+        '--gid', default=None, type=group_id,
+        help='group name or id to run as')
+    parser.add_argument(
+        '--allow-core', action='store_true',
+        help='do not prevent core dumps')
+    parser.add_argument(
+        '--foreground', action='store_true',
+        help='do not detach from the launching process')
+    parser.add_argument(
+        '--stdin', default=None,
+        help='file to read stdin from (default: /dev/null)')
+    parser.add_argument(
+        '--stdout', default=None,
+        help='file to append stdout to (default: /dev/null)')
+    parser.add_argument(
+        '--stderr', default=None,
+        help='file to append stderr to (default: /dev/null)')
+    parser.add_argument(
+        '--ready-timeout', default=60.0, type=float,
+        help='seconds start waits for the daemon to be ready (default: 60)')
+    parser.add_argument(
+        '--manual-ready', action='store_true',
+        help='pass the DaemonContext to the target callable, which '
+             'has to call its ready() method itself; without it, the '
+             'daemon is ready before the target is called')
+    parser.add_argument(
+        '--stop-timeout', default=10.0, type=float,
+        help='seconds stop waits after SIGTERM, before SIGKILL is sent '
+             '(default: 10)')
+    parser.add_argument(
+        '--reload-signal', default='SIGHUP', type=signal_number,
+        help='signal sent by reload, and mapped by start to reopening '
+             'the output files (default: SIGHUP)')
+    parser.add_argument(
+        '--stats-page', default=None,
+        help='memory-mapped stats file, kept by the daemon and read by '
+             'stats')
+    parser.add_argument(
+        'command', choices=COMMANDS,
+        help='what to do')
+    parser.add_argument(
+        'target', nargs='?', default=None,
+        help='module:callable, module or script to run, needed by '
+             'start and restart')
+    parser.add_argument(
+        'args', nargs=argparse.REMAINDER,
+        help='arguments passed to the target')
+    return parser
+
+
+def octal(value):
+    """ Parse an octal number
+
+    :param value: string to parse
+    :type value: str
+
+    :return: int
+    :raise: argparse.ArgumentTypeError
+    """
+    try:
+        return int(value, 8)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid octal number: {0}'.format(value))
+
+
+def user_id(value):
+    """ Parse a user name or id
+
+    :param value: name or numeric id
+    :type value: str
+
+    :return: int
+    :raise: argparse.ArgumentTypeError
+    """
+    if value.isdigit():
+        return int(value)
+    import pwd
+    try:
+        return pwd.getpwnam(value).pw_uid
+    except KeyError:
+        raise argparse.ArgumentTypeError('unknown user: {0}'.format(value))
+
+
+def group_id(value):
+    """ Parse a group name or id
+
+    :param value: name or numeric id
+    :type value: str
+
+    :return: int
+    :raise: argparse.ArgumentTypeError
+    """
+    if value.isdigit():
+        return int(value)
+    import grp
+    try:
+        return grp.getgrnam(value).gr_gid
+    except KeyError:
+        raise argparse.ArgumentTypeError('unknown group: {0}'.format(value))
+
+
+def signal_number(value):
+    """ Parse a signal name or number
+
+    :param value: name like SIGHUP or HUP, or a number
+    :type value: str
+
+    :return: int
+    :raise: argparse.ArgumentTypeError
+    """
+    if value.isdigit():
+        return int(value)
+    name = value.upper()
+    if not name.startswith('SIG'):
+        name = 'SIG' + name
+    number = getattr(signal, name, None)
+    if not isinstance(number, int):
+        raise argparse.ArgumentTypeError('unknown signal: {0}'.format(value))
+    return int(number)
+
+
+def load_target(target):
+    """ Resolve the target to run
+
+    module:attribute resolves to the callable, a path ending in .py,
+    or naming an existing file, runs the script, and anything else runs
+    the module as __main__. Callables are imported, and modules looked
+    up right away, relative to the current directory too, so mistakes
+    are reported before the daemon detaches.
+
+    :param target: target specification
+    :type target: str
+
+    :return: callable, taking no arguments
+    :raise: DaemonError
+    """
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    if ':' in target:
+        module_name, attribute = target.split(':', 1)
+        try:
+            obj = importlib.import_module(module_name)
+        except ImportError as err:
+            raise DaemonError('Unable to import {0}: {1}'.format(
+                module_name, err))
+        try:
+            for name in attribute.split('.'):
+                obj = getattr(obj, name)
+        except AttributeError:
+            raise DaemonError('{0} has no attribute {1}'.format(
+                module_name, attribute))
+        if not callable(obj):
+            raise DaemonError('{0} is not callable'.format(target))
+        return obj
+    if target.endswith('.py') or os.path.isfile(target):
+        path = os.path.abspath(target)
+        if not os.path.isfile(path):
+            raise DaemonError('No such script: {0}'.format(target))
+        return lambda: runpy.run_path(path, run_name='__main__')
+    try:
+        found = find_spec(target)
+    except ImportError as err:
+        raise DaemonError('Unable to import {0}: {1}'.format(target, err))
+    if found is None:
+        raise DaemonError('No module named {0}'.format(target))
+    return lambda: runpy.run_module(target, run_name='__main__',
+                                    alter_sys=True)
+
+
+def open_stream(path, mode):
+    """ Open a file for one of the standard streams
+
+    :param path: file name, or None
+    :type path: str
+
+    :param mode: file mode
+    :type mode: str
+
+    :return: file object, or None
+    :raise: DaemonError
+    """
+    if path is None:
+        return None
+    try:
+        return open(path, mode)
+    except (IOError, OSError) as err:
+        raise DaemonError('Unable to open {0}: {1}'.format(path, err))
+
+
+def start(options):
+    """ Start the daemon, and run the target in it
+
+    Unless the daemon runs in the foreground, the launching process
+    exits once the daemon reported its readiness, with status 0, or
+    with status 1 if the daemon failed to start.
+
+    Without --manual-ready, the daemon reports its readiness once it is
+    daemonized, right before the target is called, so ready only means
+    that the daemon is running, not that the target can serve yet.
+    With --manual-ready, the target reports it, by calling ready() on
+    the DaemonContext it is passed.
+
+    The reload signal is handled by reopening stdout and stderr, so
+    reload does not kill the daemon with the default action of the
+    signal.
+
+    :param options: parsed command line
+    :type options: argparse.Namespace
+
+    :return: int, exit status
+    :raise: DaemonError
+    """
+    if options.target is None:
+        raise DaemonError('{0} requires a target'.format(options.command))
+    pidfile = PidFile(os.path.abspath(options.pidfile))
+    if pidfile.is_locked():
+        sys.stdout.write('Already running (pid {0})\n'.format(
+            pidfile.read_pid()))
+        return 0
+    if options.manual_ready and ':' not in options.target:
+        raise DaemonError('--manual-ready requires a module:callable target')
+    if options.reload_signal == signal.SIGTERM:
+        raise DaemonError('--reload-signal can not be SIGTERM')
+    signal_map = default_signal_map()
+    signal_map[options.reload_signal] = 'reopen_streams'
+    target = load_target(options.target)
+    argv = [options.target] + list(options.args)
+    if argv[1:2] == ['--']:
+        del argv[1]
+    daemon = DaemonContext(
+        chroot_directory=options.chroot_directory,
+        working_directory=options.working_directory,
+        umask=options.umask,
+        uid=options.uid,
+        gid=options.gid,
+        prevent_core=not options.allow_core,
+        detach_process=not options.foreground,
+        pidfile=pidfile,
+        stdin=open_stream(options.stdin, 'r'),
+        stdout=open_stream(options.stdout, 'a'),
+        stderr=open_stream(options.stderr, 'a'),
+        signal_map=signal_map,
+        wait_ready=True,
+        ready_timeout=options.ready_timeout,
+        stats_page=(StatsPage(os.path.abspath(options.stats_page))
+                    if options.stats_page else None))
+    daemon.open()
+    sys.argv[:] = argv
+    if options.manual_ready:
+        try:
+            target(daemon)
+        except BaseException as err:
+            daemon.fail(str(err) or repr(err))
+            raise
+        return 0
+    daemon.ready()
+    target()
+    return 0
+
+
+def stop(options):
+    """ Stop the daemon
+
+    SIGTERM is sent, and if the daemon did not exit after stop_timeout
+    seconds, SIGKILL. Waiting ends the moment the daemon exits.
+
+    :param options: parsed command line
+    :type options: argparse.Namespace
+
+    :return: int, exit status
+    :raise: DaemonError
+    """
+    pidfile = PidFile(os.path.abspath(options.pidfile))
+    pid = pidfile.read_pid()
+    if pid is None or not pidfile.is_locked():
+        sys.stdout.write('Not running\n')
+        return 0
+    if not send_signal(pid, signal.SIGTERM):
+        return 0
+    if pidfile.wait_for_exit(options.stop_timeout):
+        return 0
+    sys.stderr.write('Daemon (pid {0}) did not stop after {1} seconds, '
+                     'sending SIGKILL\n'.format(pid, options.stop_timeout))
+    if send_signal(pid, signal.SIGKILL) and not pidfile.wait_for_exit(
+            options.stop_timeout):
+        raise DaemonError('Unable to stop daemon (pid {0})'.format(pid))
+    # a killed daemon can not remove its pidfile anymore
+    try:
+        os.remove(os.path.abspath(options.pidfile))
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    return 0
+
+
+def reload(options):
+    """ Send the reload signal to the daemon
+
+    :param options: parsed command line
+    :type options: argparse.Namespace
+
+    :return: int, exit status
+    :raise: DaemonError
+    """
+    pidfile = PidFile(os.path.abspath(options.pidfile))
+    pid = pidfile.read_pid()
+    if pid is None or not pidfile.is_locked():
+        raise DaemonError('Not running')
+    if not send_signal(pid, options.reload_signal):
+        raise DaemonError('Not running')
+    return 0
+
+
+def status(options):
+    """ Report if the daemon is running
+
+    The exit status follows the LSB conventions for init scripts.
+
+    :param options: parsed command line
+    :type options: argparse.Namespace
+
+    :return: int, STATUS_RUNNING, STATUS_DEAD or STATUS_STOPPED
+    """
+    pidfile = PidFile(os.path.abspath(options.pidfile))
+    pid = pidfile.read_pid()
+    if pidfile.is_locked():
+        sys.stdout.write('Running (pid {0})\n'.format(pid))
+        return STATUS_RUNNING
+    if os.path.exists(options.pidfile):
+        sys.stdout.write('Not running, but pidfile {0} exists\n'.format(
+            options.pidfile))
+        return STATUS_DEAD
+    sys.stdout.write('Not running\n')
+    return STATUS_STOPPED
+
+
+def stats(options):
+    """ Print the stats page of the daemon as JSON
+
+    :param options: parsed command line
+    :type options: argparse.Namespace
+
+    :return: int, exit status
+    :raise: DaemonError
+    """
+    if options.stats_page is None:
+        raise DaemonError('stats requires --stats-page')
+    result = read_stats(os.path.abspath(options.stats_page))
+    sys.stdout.write(json.dumps(result, indent=2, sort_keys=True) + '\n')
+    return 0
+
+
+def send_signal(pid, signal_number):
+    """ Send a signal to the daemon
+
+    :param pid: process id of the daemon
+    :type pid: int
+
+    :param signal_number: signal to send
+    :type signal_number: int
+
+    :return: bool, False if the process does not exist anymore
+    :raise: DaemonError
+    """
+    try:
+        os.kill(pid, signal_number)
+    except OSError as err:
+        if err.errno == errno.ESRCH:
+            return False
+        raise DaemonError('Unable to signal pid {0}: {1}'.format(pid, err))
+    return True
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Local control socket, exposing the internals of a running daemon.
+
+"""
+__author__ = 'schlitzer'
+
+
+import errno
+import json
+import os
+import resource
+import signal
+import socket
+import threading
+import traceback
+
+from pep3143daemon.daemon import DaemonError, open_filenos
+from pep3143daemon.instrument import monotonic
+from pep3143daemon.preload import memory_usage
+
+
+class ControlSocket(object):
+    """
+    Unix domain socket to inspect and control a detached daemon.
+
+    Passed as control_socket to DaemonContext, the socket is bound by
+    open() before the chroot and the uid and gid change, its mode set,
+    and its owner changed to the uid and gid of the daemon. It survives
+    close_filenos, and is served by a thread started at the end of
+    open(). close() removes it, unless the daemon is chrooted, then
+    the socket file is left behind.
+
+    The protocol is line based: the client sends a command, optionally
+    followed by arguments separated by spaces, and receives one line of
+    JSON, {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+    A connection can send any number of commands. For example::
+
+        $ echo stats | socat - UNIX-CONNECT:/run/server.ctl
+
+    Commands:
+
+    * help: the list of commands
+    * stats: all of the below, and the executor statistics
+    * uptime: seconds since open()
+    * fds: number of open file descriptors
+    * memory: rss, pss, shared and private memory, in bytes
+    * threads: name, ident and daemon flag of every thread
+    * reload: send reload_signal to the daemon
+    * drain: send drain_signal to the daemon, which requests the
+      shutdown, if the DaemonContext has a ShutdownCoordinator
+
+    The signals are handled by the signal_map of the DaemonContext, in
+    the main thread, so reload and drain act exactly like their signals.
+    They are refused, unless the signal_map has a handler for their
+    signal; the default signal_map has none for SIGHUP, whose default
+    action would kill the daemon.
+
+    :param path:
+        Path of the socket.
+    :type path: str
+
+    :param mode:
+        Permissions of the socket file. Everybody allowed to connect may
+        send reload and drain.
+    :type mode: int
+
+    :param commands:
+        Additional commands, mapping a name to a callable, which is
+        called with the DaemonContext and the list of arguments, and
+        returns a JSON serializable result.
+    :type commands: dict
+
+    :param reload_signal:
+        Signal sent by the reload command.
+    :type reload_signal: int
+
+    :param drain_signal:
+        Signal sent by the drain command.
+    :type drain_signal: int
+
+    :param timeout:
+        Seconds a client may stay idle, before it is disconnected.
+    :type timeout: float
+    """
+
+    def __init__(self, path, mode=0o600, commands=None,
+                 reload_signal=signal.SIGHUP, drain_signal=signal.SIGTERM,
+                 timeout=5.0):
+        """
+        Create a new instance
+        """
+        self.path = path
+        self.mode = mode
+        self.commands = {
+            'help': self.help,
+            'stats': self.stats,
+            'uptime': self.uptime,
+            'fds': self.fds,
+            'memory': self.memory,
+            'threads': self.threads,
+            'reload': self.reload,
+            'drain': self.drain,
+        }
+        self.commands.update(commands or {})
+        self.reload_signal = reload_signal
+        self.drain_signal = drain_signal
+        self.timeout = timeout
+        self.sock = None
+        self.started = None
+        self._inode = None
+        self._daemon = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def fileno(self):
+        """ Descriptor of the listening socket
+
+        :return: int
+        """
+        return self.sock.fileno()
+
+    def bind(self, uid=None, gid=None):
+        """ Create the listening socket
+
+        A stale socket file at path is removed first.
+
+        :param uid: owner of the socket file, or None to keep it
+        :type uid: int
+
+        :param gid: group of the socket file, or None to keep it
+        :type gid: int
+
+        :return: None
+        :raise: DaemonError
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                os.unlink(self.path)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+            sock.bind(self.path)
+            stat = os.stat(self.path)
+            self._inode = (stat.st_dev, stat.st_ino)
+            os.chmod(self.path, self.mode)
+            if (uid, gid) != (os.getuid(), os.getgid()):
+                os.chown(self.path, -1 if uid is None else uid,
+                         -1 if gid is None else gid)
+            sock.listen(8)
+        except (OSError, socket.error) as err:
+            sock.close()
+            raise DaemonError('Could not create control socket {0}: {1}'
+                              .format(self.path, err))
+        self.sock = sock
+
+    def start(self, daemon):
+        """ Serve the socket in a thread
+
+        Forked children, like the workers of a PreforkPool, close their
+        copy of the socket, through the fork_registry of the daemon.
+
+        :param daemon: the daemon to inspect
+        :type daemon: pep3143daemon.DaemonContext
+
+        :return: None
+        """
+        self._daemon = daemon
+        self.started = monotonic()
+        daemon.fork_registry.register(after_in_child=self._after_fork)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._serve, name='control-socket')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """ Stop serving, close and remove the socket
+
+        The socket file is only removed if it is still the one created
+        by bind(), and not the one of a process started by reexec().
+
+        :return: None
+        """
+        self._stop.set()
+        if self._daemon is not None:
+            self._daemon.fork_registry.unregister(self._after_fork)
+        if self.sock is None:
+            return
+        sock, self.sock = self.sock, None
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, socket.error):
+            pass
+        sock.close()
+        if self._thread is not None:
+            self._thread.join(self.timeout)
+            self._thread = None
+        try:
+            stat = os.stat(self.path)
+            if (stat.st_dev, stat.st_ino) == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _after_fork(self):
+        """ Close the socket in a forked child, keeping the socket file
+
+        :return: None
+        """
+        self._stop.set()
+        self._thread = None
+        if self.sock is not None:
+            sock, self.sock = self.sock, None
+            sock.close()
+
+    def _serve(self):
+        """ Accept clients, and answer their commands, one at a time
+
+        :return: None
+        """
+        while not self._stop.is_set():
+            sock = self.sock
+            if sock is None:
+                return
+            try:
+                client, _ = sock.accept()
+            except (OSError, socket.error):
+                self._stop.wait(0.1)
+                continue
+            try:
+                self._handle_client(client)
+            except (OSError, socket.error):
+                pass
+            finally:
+                client.close()
+
+    def _handle_client(self, client):
+        """ Answer the commands of a client, until it disconnects
+
+        :return: None
+        """
+        client.settimeout(self.timeout)
+        stream = client.makefile('rwb')
+        try:
+            for line in stream:
+                line = line.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                stream.write(self.handle(line).encode('utf-8') + b'\n')
+                stream.flush()
+        except socket.timeout:
+            pass
+        finally:
+            stream.close()
+
+    def handle(self, line):
+        """ Run a command line, and return the JSON response
+
+        :param line: command, followed by its arguments
+        :type line: str
+
+        :return: str
+        """
+        args = line.split()
+        command = self.commands.get(args[0]) if args else None
+        if command is None:
+            response = {'ok': False, 'error': 'Unknown command: {0}'
+                        .format(line)}
+        else:
+            try:
+                response = {'ok': True,
+                            'result': command(self._daemon, args[1:])}
+            except DaemonError as err:
+                response = {'ok': False, 'error': str(err)}
+            except Exception as err:
+                traceback.print_exc()
+                response = {'ok': False, 'error': str(err) or repr(err)}
+        return json.dumps(response, sort_keys=True, default=str)
+
+    def help(self, daemon, args):
+        """ The list of commands
+
+        :return: list
+        """
+        return sorted(self.commands)
+
+    def stats(self, daemon, args):
+        """ Everything at once
+
+        :return: dict
+        """
+        result = {
+            'pid': os.getpid(),
+            'uptime': self.uptime(daemon, args),
+            'fds': self.fds(daemon, args),
+            'memory': self.memory(daemon, args),
+            'threads': len(self.threads(daemon, args)),
+        }
+        if daemon is not None:
+            result['executors'] = daemon.executor_stats()
+            if daemon.startup_report is not None:
+                result['startup'] = daemon.startup_report.duration
+        return result
+
+    def uptime(self, daemon, args):
+        """ Seconds since the daemon started serving the socket
+
+        :return: float
+        """
+        if self.started is None:
+            return 0.0
+        return monotonic() - self.started
+
+    def fds(self, daemon, args):
+        """ Number of open file descriptors
+
+        :return: int, or None if they cannot be listed
+        """
+        filenos = open_filenos()
+        return None if filenos is None else len(filenos)
+
+    def memory(self, daemon, args):
+        """ Memory of the daemon, in bytes
+
+        Falls back to the peak RSS, where /proc is not available.
+
+        :return: dict
+        """
+        try:
+            return memory_usage()
+        except (IOError, OSError):
+            return {'max_rss': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+    def threads(self, daemon, args):
+        """ The threads of the daemon
+
+        :return: list of dicts
+        """
+        return [{'name': thread.name, 'ident': thread.ident,
+                 'daemon': thread.daemon}
+                for thread in threading.enumerate()]
+
+    def reload(self, daemon, args):
+        """ Send reload_signal to the daemon
+
+        :return: int, the signal number
+        :raise: DaemonError, if the signal_map does not handle it
+        """
+        return self._send(daemon, self.reload_signal)
+
+    def drain(self, daemon, args):
+        """ Send drain_signal to the daemon
+
+        :return: int, the signal number
+        :raise: DaemonError, if the signal_map does not handle it
+        """
+        return self._send(daemon, self.drain_signal)
+
+    def _send(self, daemon, signal_number):
+        """ Send a signal to the daemon, if its signal_map handles it
+
+        :return: int, the signal number
+        :raise: DaemonError
+        """
+        if daemon is None or not callable(
+                daemon._signal_handler_map.get(signal_number)):
+            raise DaemonError('Signal {0} has no handler in the signal_map'
+                              .format(int(signal_number)))
+        os.kill(os.getpid(), signal_number)
+        return int(signal_number)
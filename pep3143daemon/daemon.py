@@ -3,12 +3,25 @@
 __author__ = 'schlitzer'
 
 
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
 import errno
 import os
 import resource
+import select
 import signal
 import socket
 import sys
+import threading
+
+from pep3143daemon import affinity
+from pep3143daemon import forkhooks
+from pep3143daemon import reexec as _reexec
+from pep3143daemon import systemd
+from pep3143daemon.instrument import StartupReport, monotonic
+from pep3143daemon.signals import SignalDispatcher
 
 # PY2 / PY3 gap
 PY3 = sys.version_info[0] == 3
@@ -88,25 +101,169 @@ class DaemonContext(object):
 
     :param stdout:
         Redirect stdout to this file, if None, redirect to /dev/null.
+        Pass a LogWriter, to keep slow log files from blocking the
+        daemon.
     :type stdout: file object.
 
     :param stderr:
         Redirect stderr to this file, if None, redirect to /dev/null.
+        Pass a LogWriter, to keep slow log files from blocking the
+        daemon.
     :type stderr: file object.
 
     :param signal_map:
         Mapping from operating system signal to callback actions.
     :type signal_map: instance of dict
+
+    :param startup_hook:
+        Callable that is called with a StartupEvent after every step
+        of open(). If set, the events are also collected in the
+        startup_report attribute. If None, open() is not measured.
+        The steps of close() are always measured, and collected in the
+        shutdown_report attribute, and passed to this callable as well.
+    :type startup_hook: callable
+
+    :param socket_activation:
+        Accept sockets passed by systemd socket activation. They are
+        detected when the instance is created, preserved while
+        daemonizing, and available in the listen_fds and listen_sockets
+        attributes, by name. The environment is left alone until open()
+        removes LISTEN_PID, LISTEN_FDS and LISTEN_FDNAMES, so they are
+        not inherited by child processes.
+    :type socket_activation: bool
+
+    :param notify:
+        Use the systemd notification protocol, if NOTIFY_SOCKET is set.
+        The socket is connected when the instance is created, and
+        preserved while daemonizing. After the forks, MAINPID is sent,
+        and the watchdog pinger is started if WATCHDOG_USEC is set.
+        The client is available in the notifier attribute.
+    :type notify: bool
+
+    :param wait_ready:
+        If True, and the process detaches, the launching process does
+        not exit right after the first fork. It waits until the daemon
+        calls ready() or fail(), or exits, and then exits with status
+        0 if the daemon is ready, or prints the error and exits with
+        status 1. Errors raised by open() are reported automatically.
+    :type wait_ready: bool
+
+    :param ready_timeout:
+        Seconds the launching process waits for the daemon, if
+        wait_ready is True. If None, it waits forever.
+    :type ready_timeout: float
+
+    :param reexec_timeout:
+        Seconds reexec() waits for the new process to become ready.
+    :type reexec_timeout: float
+
+    :param signal_dispatch:
+        If None, the signal_map handlers are installed as regular signal
+        handlers. Else the signals are only recorded, and the handlers
+        are run at safe points by a SignalDispatcher, available in the
+        signal_dispatcher attribute: "thread" runs them in a dispatcher
+        thread, "selector" when the application finds the dispatcher's
+        fileno() readable and calls dispatch_pending(), and "manual"
+        only on dispatch_pending() calls. In "thread" mode, open()
+        blocks the signals first, so every thread started by open()
+        inherits the mask; threads started before open() do not.
+    :type signal_dispatch: str
+
+    :param resource_profile:
+        Resource limits and scheduling settings, applied by open()
+        before the chroot and the uid and gid change, except for
+        RLIMIT_NPROC, which is applied after the forks.
+    :type resource_profile: pep3143daemon.ResourceProfile
+
+    :param cpu_affinity:
+        CPUs the daemon, and every process it forks, may run on, set
+        after the forks. An iterable of CPU numbers, "all", or "node:N"
+        for the CPUs of NUMA node N, read from /sys/devices/system/node
+        by open() before the chroot, see read_topology(). If None, the
+        affinity is not changed.
+    :type cpu_affinity: iterable, str
+
+    :param preload_manifest:
+        Modules, encodings and files loaded by open() before the chroot,
+        so they stay available inside of chroot_directory.
+    :type preload_manifest: pep3143daemon.PreloadManifest
+
+    :param fork_registry:
+        Registry of callbacks run around the forks of open(), of a
+        PreforkPool, and, on Python 3.7 and later, every other fork.
+        Defaults to the process wide pep3143daemon.forkhooks.fork_registry.
+    :type fork_registry: pep3143daemon.ForkRegistry
+
+    :param shutdown:
+        Coordinator of a graceful shutdown. If set, terminate() only
+        requests the shutdown, and close() stops the listeners, drains
+        and escalates to a hard stop, before the pidfile is released.
+    :type shutdown: pep3143daemon.ShutdownCoordinator
+
+    :param executors:
+        Named executor pools owned by the daemon, mapping a name to
+        the number of workers, or to a dict of ManagedExecutor
+        arguments, like {'max_workers': 4, 'kind': 'process'}. The
+        pools are created on first use, and shut down by close(),
+        within the deadline of the shutdown coordinator, if one is set.
+    :type executors: dict
+
+    :param control_socket:
+        Unix domain socket to inspect and control the daemon, created
+        by open() before the chroot and the uid and gid change, and
+        served after the forks.
+    :type control_socket: pep3143daemon.ControlSocket
+
+    :param metrics:
+        Exporter of process and daemon metrics in the Prometheus text
+        format, bound by open() before the chroot and the uid and gid
+        change, and served after the forks. If set, the signals handled
+        by the signal_map are counted in signal_counts.
+    :type metrics: pep3143daemon.MetricsExporter
+
+    :param stats_page:
+        Memory-mapped file holding the lifecycle state, heartbeat and
+        counters of the daemon, for monitoring tools. Created by open()
+        before the chroot and the uid and gid change; the signals
+        handled by the signal_map are counted in it.
+    :type stats_page: pep3143daemon.StatsPage
+
+    :param profiler:
+        Sampling profiler, started and stopped by its signal, unless
+        the signal_map handles that signal. A running profiler is
+        stopped by close(), and writes its profile.
+    :type profiler: pep3143daemon.SamplingProfiler
     """
     def __init__(
             self, chroot_directory=None, working_directory='/',
             umask=0, uid=None, gid=None, prevent_core=True,
             detach_process=None, files_preserve=None, pidfile=None,
-            stdin=None, stdout=None, stderr=None, signal_map=None):
+            stdin=None, stdout=None, stderr=None, signal_map=None,
+            startup_hook=None, socket_activation=True, notify=True,
+            wait_ready=False, ready_timeout=None, reexec_timeout=60,
+            signal_dispatch=None, resource_profile=None, cpu_affinity=None,
+            preload_manifest=None, fork_registry=None, shutdown=None,
+            executors=None, control_socket=None, metrics=None,
+            stats_page=None, profiler=None):
         """ Initialize a new Instance
 
         """
         self._is_open = False
+        self._ready_fd = None
+        self._reexec_pid = None
+        self._launch_directory = os.getcwd()
+        self.handover = _reexec.Handover.from_environment()
+        if self.handover is not None:
+            self._ready_fd = self.handover.ready_fd
+        self.startup_hook = startup_hook
+        self.startup_report = None
+        self.socket_activation = socket_activation
+        if socket_activation:
+            self.listen_fds = systemd.listen_fds(unset_environment=False)
+        else:
+            self.listen_fds = {}
+        self.listen_sockets = systemd.listen_sockets(self.listen_fds)
+        self.notifier = systemd.Notifier.from_environment() if notify else None
         self._working_directory = None
         self.chroot_directory = chroot_directory
         self.umask = umask
@@ -124,6 +281,27 @@ class DaemonContext(object):
         self.stdout = stdout
         self.stderr = stderr
         self.working_directory = working_directory
+        self.wait_ready = wait_ready
+        self.ready_timeout = ready_timeout
+        self.reexec_timeout = reexec_timeout
+        self.signal_dispatch = signal_dispatch
+        self.signal_dispatcher = None
+        self.resource_profile = resource_profile
+        self.cpu_affinity = cpu_affinity
+        self.topology = None
+        self.preload_manifest = preload_manifest
+        if fork_registry is None:
+            fork_registry = forkhooks.fork_registry
+        self.fork_registry = fork_registry
+        self.shutdown = shutdown
+        self.shutdown_report = None
+        self.control_socket = control_socket
+        self.metrics = metrics
+        self.signal_counts = {}
+        self.stats_page = stats_page
+        self.profiler = profiler
+        self.executors = {}
+        self.configure_executors(executors or {})
 
     def __enter__(self):
         """ Context Handler, wrapping self.open()
@@ -164,15 +342,34 @@ class DaemonContext(object):
     def _files_preserve(self):
         """ create a set of protected files
 
-        create a set of files, based on self.files_preserve and
-        self.stdin, self,stdout and self.stderr, that should not get
-        closed while daemonizing.
+        create a set of files, based on self.files_preserve,
+        self.stdin, self,stdout and self.stderr, the file descriptors
+        passed by socket activation or re-exec, the systemd notification
+        socket, the readiness pipe, a handed over pidfile and the
+        self-pipe of a selector mode signal dispatcher, that should not
+        get closed while daemonizing.
 
         :return: set
         """
         result = set()
-        files = [] if not self.files_preserve else self.files_preserve
+        files = [] if not self.files_preserve else list(self.files_preserve)
         files.extend([self.stdin, self.stdout, self.stderr])
+        if self.control_socket is not None:
+            files.append(self.control_socket)
+        if self.metrics is not None:
+            files.append(self.metrics)
+        for filenos in self.listen_fds.values():
+            files.extend(filenos)
+        if self.notifier is not None:
+            files.append(self.notifier)
+        if self._ready_fd is not None:
+            files.append(self._ready_fd)
+        if self.handover is not None and \
+                self.handover.pidfile_fd is not None:
+            files.append(self.handover.pidfile_fd)
+        if self.signal_dispatcher is not None and \
+                self.signal_dispatcher._pipe is not None:
+            files.extend(self.signal_dispatcher._pipe)
         for item in files:
             if hasattr(item, 'fileno'):
                 result.add(item.fileno())
@@ -185,15 +382,43 @@ class DaemonContext(object):
         """ Create the signal handler map
 
         create a dictionary with signal:handler mapping based on
-        self.signal_map
+        self.signal_map, and the signal of the profiler. If metrics are
+        exported, or a stats page is kept, the callable handlers are
+        wrapped, to count the signals.
 
         :return: dict
         """
+        signal_map = dict(self.signal_map)
+        if self.profiler is not None:
+            signal_map.setdefault(self.profiler.signal_number,
+                                  self.profiler.toggle)
         result = {}
-        for signum, handler in self.signal_map.items():
-            result[signum] = self._get_signal_handler(handler)
+        for signum, handler in signal_map.items():
+            handler = self._get_signal_handler(handler)
+            counted = self.metrics is not None or self.stats_page is not None
+            if counted and callable(handler):
+                handler = self._counting_handler(handler)
+            result[signum] = handler
         return result
 
+    def _counting_handler(self, handler):
+        """ Wrap a signal handler, to count its calls
+
+        The calls are counted in signal_counts, and in the stats page.
+
+        :param handler: signal handler
+        :type handler: callable
+
+        :return: callable
+        """
+        def counting_handler(signal_number, stack_frame):
+            self.signal_counts[signal_number] = \
+                self.signal_counts.get(signal_number, 0) + 1
+            if self.stats_page is not None:
+                self.stats_page.signal_seen(signal_number)
+            return handler(signal_number, stack_frame)
+        return counting_handler
+
     @property
     def working_directory(self):
         """ The working_directory property
@@ -226,19 +451,210 @@ class DaemonContext(object):
         return self._is_open
 
     def close(self):
-        """ Dummy function"""
-        pass
+        """ Shut the daemon down
+
+        The work is done in steps, see _close_steps: with a shutdown
+        coordinator, the listeners are stopped, the daemon drains, and
+        a hard stop is escalated if the drain takes too long. Then the
+        watchdog pinger is stopped, and the pidfile released. Every step
+        is measured, and the results are collected in shutdown_report.
+
+        :return: None
+        """
+        if not self.is_open:
+            return
+        self.shutdown_report = StartupReport(self.startup_hook)
+        try:
+            for phase, step in self._close_steps():
+                self.shutdown_report.run(phase, step)
+        finally:
+            self._is_open = False
+
+    def _close_steps(self):
+        """ Create the list of steps done by close()
+
+        :return: list of (name, callable) tuples
+        """
+        steps = []
+        if self.shutdown is not None:
+            steps.extend([
+                ('stop_listeners', self._stop_listeners),
+                ('drain', self.shutdown.drain),
+                ('executors', self.shutdown.stop_executors),
+                ('escalate', self.shutdown.escalate),
+            ])
+        elif self.executors:
+            steps.append(('executors', self._shutdown_executors))
+        if self.notifier is not None:
+            steps.append(('notify', self.notifier.stop_watchdog))
+        if self.profiler is not None:
+            steps.append(('profiler', self.profiler.close))
+        if self.control_socket is not None:
+            steps.append(('control_socket', self.control_socket.close))
+        if self.metrics is not None:
+            steps.append(('metrics', self.metrics.close))
+        if self.stats_page is not None:
+            steps.append(('stats_page', self.stats_page.close))
+        if self.pidfile is not None and hasattr(self.pidfile, 'release'):
+            steps.append(('pidfile', self.pidfile.release))
+        return steps
+
+    def _shutdown_executors(self):
+        """ Shut the executors down, and wait for their tasks
+
+        :return: None
+        """
+        for name in sorted(self.executors):
+            self.executors[name].shutdown(wait=True)
+
+    def configure_executors(self, executors):
+        """ Create or resize the executors
+
+        Can be called again, for example from a reload handler, with a
+        new configuration. Executors of new names are created, the
+        others resized. Executors missing from the configuration are
+        kept.
+
+        :param executors: mapping of names to the number of workers, or
+            to a dict of ManagedExecutor arguments
+        :type executors: dict
+
+        :return: None
+        :raise: DaemonError
+        """
+        from pep3143daemon.executors import ManagedExecutor, executor_spec
+        for name, spec in sorted(executors.items()):
+            spec = executor_spec(spec)
+            if name in self.executors:
+                self.executors[name].resize(spec.get('max_workers'))
+                continue
+            executor = ManagedExecutor(name, **spec)
+            self.executors[name] = executor
+            if self.shutdown is not None:
+                self.shutdown.add_executor(executor)
+
+    def executor(self, name):
+        """ Return an executor by name
+
+        :param name: name of the executor
+        :type name: str
+
+        :return: pep3143daemon.ManagedExecutor
+        :raise: DaemonError
+        """
+        try:
+            return self.executors[name]
+        except KeyError:
+            raise DaemonError('Unknown executor: {0}'.format(name))
+
+    def executor_stats(self):
+        """ Queue depth and task latency of every executor
+
+        :return: dict of name to ManagedExecutor.stats()
+        """
+        return dict((name, executor.stats())
+                    for name, executor in self.executors.items())
+
+    def _stop_listeners(self):
+        """ Stop the listeners of the coordinator, and listen_sockets
+
+        :return: None
+        """
+        sockets = []
+        for items in self.listen_sockets.values():
+            sockets.extend(items)
+        self.shutdown.stop_listeners(sockets)
 
     def open(self):
         """ Daemonize this process
 
         Do everything that is needed to become a Unix daemon.
 
+        The work is done in steps, see _open_steps. If startup_hook is
+        set, every step is measured, and the results are collected in
+        startup_report.
+
         :return: None
         :raise: DaemonError
         """
         if self.is_open:
             return
+        try:
+            if self.startup_hook is None:
+                for _, step in self._open_steps():
+                    step()
+            else:
+                self.startup_report = StartupReport(self.startup_hook)
+                for phase, step in self._open_steps():
+                    self.startup_report.run(phase, step)
+        except BaseException as err:
+            self.fail(str(err) or repr(err))
+            raise
+        self._is_open = True
+
+    def _open_steps(self):
+        """ Create the list of steps done by open()
+
+        :return: list of (name, callable) tuples
+        """
+        steps = []
+        if self.signal_dispatch == 'thread':
+            steps.append(('block_signals', self._block_signals))
+        if self.resource_profile is not None:
+            steps.append(('resources', self.resource_profile.apply))
+        if self.preload_manifest is not None:
+            steps.append(('preload', self.preload_manifest.apply))
+        if self.cpu_affinity is not None:
+            steps.append(('topology', self.read_topology))
+        if self.control_socket is not None:
+            steps.append(('control_bind', self._bind_control_socket))
+        if self.stats_page is not None:
+            steps.append(('stats_page', lambda: self.stats_page.create(
+                self.uid, self.gid)))
+        if self.metrics is not None:
+            steps.append(('metrics_bind',
+                          lambda: self.metrics.bind(self.uid, self.gid)))
+        steps.append(('environment', self._setup_environment))
+        if self.prevent_core:
+            steps.append(('prevent_core', self._prevent_core))
+        if self.detach_process:
+            steps.append(('first_fork', self._first_fork))
+            steps.append(('second_fork', self._second_fork))
+        if self.resource_profile is not None:
+            steps.append(('resources_after_fork',
+                          self.resource_profile.apply_after_fork))
+        if self.cpu_affinity is not None:
+            steps.append(('affinity', self._set_affinity))
+        steps.extend([
+            ('signals', self._install_signal_handlers),
+            ('close_filenos', self._close_filenos),
+            ('redirect_streams', self._redirect_streams),
+        ])
+        if self.pidfile:
+            steps.append(('pidfile', self._acquire_pidfile))
+        if self.notifier is not None:
+            steps.append(('notify', self._start_notify))
+        if self.stats_page is not None:
+            steps.append(('stats_page_start',
+                          lambda: self.stats_page.start(self)))
+        if self.control_socket is not None:
+            steps.append(('control_start',
+                          lambda: self.control_socket.start(self)))
+        if self.metrics is not None:
+            steps.append(('metrics_start', lambda: self.metrics.start(self)))
+        return steps
+
+    def _setup_environment(self):
+        """ Change directories, user, group and umask
+
+        The variables of socket activation are removed from the
+        environment.
+
+        :return: None
+        :raise: DaemonError
+        """
+        if self.socket_activation:
+            systemd.unset_listen_environment()
         try:
             os.chdir(self.working_directory)
             if self.chroot_directory:
@@ -250,44 +666,323 @@ class DaemonContext(object):
             raise DaemonError('Setting up Environment failed: {0}'
                               .format(err))
 
-        if self.prevent_core:
-            try:
-                resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
-            except Exception as err:
-                raise DaemonError('Could not disable core files: {0}'
-                                  .format(err))
+    def _bind_control_socket(self):
+        """ Create the control socket, owned by the daemon uid and gid
 
-        if self.detach_process:
-            try:
-                if os.fork() > 0:
-                    os._exit(0)
-            except OSError as err:
-                raise DaemonError('First fork failed: {0}'.format(err))
-            os.setsid()
-            try:
-                if os.fork() > 0:
-                    os._exit(0)
-            except OSError as err:
-                raise DaemonError('Second fork failed: {0}'.format(err))
+        :return: None
+        :raise: DaemonError
+        """
+        self.control_socket.bind(self.uid, self.gid)
+
+    def _prevent_core(self):
+        """ Disable core files
+
+        :return: None
+        :raise: DaemonError
+        """
+        try:
+            resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        except Exception as err:
+            raise DaemonError('Could not disable core files: {0}'
+                              .format(err))
+
+    def read_topology(self):
+        """ The CPU topology, read from sysfs on the first call
+
+        open() reads it before the chroot, if cpu_affinity is set, and
+        a PreforkPool with a cpu_policy before open(), because sysfs is
+        not available inside a chroot.
 
+        :return: pep3143daemon.Topology
+        """
+        if self.topology is None:
+            self.topology = affinity.Topology.read()
+        return self.topology
+
+    def _set_affinity(self):
+        """ Bind the daemon to the CPUs of cpu_affinity
+
+        :return: None
+        :raise: DaemonError
+        """
+        try:
+            cpus = self.read_topology().resolve(self.cpu_affinity)
+            affinity.set_affinity(cpus)
+        except (ValueError, OSError) as err:
+            raise DaemonError('Could not set CPU affinity to {0}: {1}'
+                              .format(self.cpu_affinity, err))
+
+    def _first_fork(self):
+        """ Fork, exit the parent, and become session leader
+
+        If wait_ready is set, the parent waits for the daemon to report
+        its readiness through a pipe, before it exits. A re-executed
+        daemon reports to the process it replaces instead.
+
+        :return: None
+        :raise: DaemonError
+        """
+        wait = self.wait_ready and self._ready_fd is None
+        try:
+            if wait:
+                read_fd, write_fd = os.pipe()
+            if self.fork_registry.fork(os.fork) > 0:
+                if wait:
+                    os.close(write_fd)
+                    os._exit(wait_ready(read_fd, self.ready_timeout))
+                os._exit(0)
+        except OSError as err:
+            raise DaemonError('First fork failed: {0}'.format(err))
+        if wait:
+            os.close(read_fd)
+            self._ready_fd = write_fd
+        os.setsid()
+
+    def _second_fork(self):
+        """ Fork again, so the daemon can never acquire a terminal
+
+        :return: None
+        :raise: DaemonError
+        """
+        try:
+            if self.fork_registry.fork(os.fork) > 0:
+                os._exit(0)
+        except OSError as err:
+            raise DaemonError('Second fork failed: {0}'.format(err))
+
+    def _block_signals(self):
+        """ Block the signals of the callable handlers in this thread
+
+        Done first by open() in "thread" dispatch mode, so the threads
+        started by later steps inherit the mask, and a signal is never
+        delivered to one of them.
+
+        :return: None
+        """
+        signal.pthread_sigmask(signal.SIG_BLOCK, [
+            signal_number for signal_number, handler
+            in self._signal_handler_map.items() if callable(handler)])
+
+    def _install_signal_handlers(self):
+        """ Install the handlers of the signal_map
+
+        If signal_dispatch is set, the callable handlers are passed
+        to a SignalDispatcher instead.
+
+        :return: None
+        """
+        if self.signal_dispatch is None:
+            for (signal_number, handler) in self._signal_handler_map.items():
+                signal.signal(signal_number, handler)
+            return
+        deferred = {}
         for (signal_number, handler) in self._signal_handler_map.items():
-            signal.signal(signal_number, handler)
+            if callable(handler):
+                deferred[signal_number] = handler
+            else:
+                signal.signal(signal_number, handler)
+        self.signal_dispatcher = SignalDispatcher(
+            deferred, self.signal_dispatch)
+        self.signal_dispatcher.install()
 
+    def dispatch_pending(self):
+        """ Run the handlers of the signals recorded since the last call
+
+        Only useful if signal_dispatch is set.
+
+        :return: list, the dispatched signal numbers
+        """
+        if self.signal_dispatcher is None:
+            return []
+        return self.signal_dispatcher.dispatch_pending()
+
+    def _close_filenos(self):
+        """ Close all files that are not preserved
+
+        :return: None
+        :raise: DaemonError
+        """
         close_filenos(self._files_preserve)
 
+    def _redirect_streams(self):
+        """ Redirect stdin, stdout and stderr
+
+        :return: None
+        :raise: DaemonError
+        """
         redirect_stream(sys.stdin, self.stdin)
         redirect_stream(sys.stdout, self.stdout)
         redirect_stream(sys.stderr, self.stderr)
 
-        if self.pidfile:
+    def _acquire_pidfile(self):
+        """ Acquire the pidfile, or adopt the one handed over by reexec()
+
+        :return: None
+        :raise: SystemExit
+        """
+        if self.handover is not None and \
+                self.handover.pidfile_fd is not None and \
+                hasattr(self.pidfile, 'adopt'):
+            self.pidfile.adopt(self.handover.pidfile_fd)
+        else:
             self.pidfile.acquire()
 
-        self._is_open = True
+    def _start_notify(self):
+        """ Announce the daemon pid and start the watchdog pinger
+
+        :return: None
+        """
+        if self.detach_process:
+            self.notifier.mainpid()
+        self.notifier.start_watchdog()
+
+    def ready(self, status=None):
+        """ Report that the daemon is ready to serve
+
+        If the launching process waits for the daemon, see wait_ready,
+        it is released and exits with status 0. A daemon started by
+        reexec() takes the handed over pidfile over first.
+
+        Sends READY=1 to the service manager, if the systemd
+        notification protocol is used.
+
+        :param status: optional status text
+        :type status: str
+
+        :return: None
+        """
+        if self.handover is not None and \
+                hasattr(self.pidfile, 'take_over'):
+            self.pidfile.take_over()
+        self._report_ready(b'R')
+        if self.notifier is not None:
+            self.notifier.ready(status)
+        if self.stats_page is not None:
+            self.stats_page.set_state('running')
+
+    def fail(self, message):
+        """ Report that the daemon failed to start
+
+        If the launching process waits for the daemon, see wait_ready,
+        it prints message and exits with status 1. Else nothing is done.
+
+        :param message: error message
+        :type message: str
+
+        :return: None
+        """
+        message = message.replace('\n', ' ').encode('utf-8', 'replace')
+        self._report_ready(b'F' + message + b'\n')
+
+    def _report_ready(self, data):
+        """ Send the result of the startup through the readiness pipe
+
+        :param data: b'R', or b'F' followed by an error message and newline
+        :type data: bytes
+
+        :return: None
+        """
+        if self._ready_fd is None:
+            return
+        fileno, self._ready_fd = self._ready_fd, None
+        try:
+            while data:
+                data = data[os.write(fileno, data):]
+        except OSError:
+            pass
+        finally:
+            os.close(fileno)
+
+    def reexec(self, signal_number, stack_frame):
+        """ Replace this daemon with a new copy of itself
+
+        Starts the command line of this process again, and hands the
+        sockets in listen_fds, the pidfile and a readiness pipe over to
+        it. This process keeps serving until the new process calls
+        ready(), then it hands the pidfile over and sends itself
+        SIGTERM, so it is shut down by the regular SIGTERM handler.
+        If the new process fails, or is not ready within
+        reexec_timeout seconds, this process keeps running, and writes
+        its pid into the pidfile again.
+
+        This method is meant to be used as a signal handler, by adding
+        it to the signal_map, for example {signal.SIGUSR2: 'reexec'}.
+
+        The new process is started in the directory the daemon was
+        launched from, with the privileges of the daemon. It will not
+        work after chroot_directory was set, or if the daemon needs
+        privileges it dropped to start.
+
+        :return: None
+        """
+        if self._reexec_pid is not None:
+            return
+        pidfile_fd = None
+        if self.pidfile is not None and hasattr(self.pidfile, 'fileno'):
+            pidfile_fd = self.pidfile.fileno()
+        generation = (self.handover.generation + 1
+                      if self.handover is not None else 1)
+        read_fd, write_fd = os.pipe()
+        try:
+            self._reexec_pid = _reexec.spawn(
+                self._listen_filenos(), pidfile_fd, write_fd, generation,
+                self._launch_directory)
+        except OSError as err:
+            os.close(read_fd)
+            sys.stderr.write('Re-exec failed: {0}\n'.format(err))
+            return
+        finally:
+            os.close(write_fd)
+        thread = threading.Thread(
+            target=self._wait_reexec, args=(read_fd,), name='reexec')
+        thread.daemon = True
+        thread.start()
+
+    def _listen_filenos(self):
+        """ Map the names in listen_sockets to file descriptors
+
+        :return: dict
+        """
+        result = {}
+        for name, sockets in self.listen_sockets.items():
+            result[name] = [sock.fileno() for sock in sockets]
+        return result
+
+    def _wait_reexec(self, read_fd):
+        """ Wait for the process started by reexec() to become ready
+
+        :return: None
+        """
+        try:
+            status = wait_ready(read_fd, self.reexec_timeout)
+        finally:
+            os.close(read_fd)
+        pid, self._reexec_pid = self._reexec_pid, None
+        if status == 0:
+            if self.pidfile is not None and \
+                    hasattr(self.pidfile, 'handover'):
+                self.pidfile.handover()
+            os.kill(os.getpid(), signal.SIGTERM)
+        else:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        try:
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+        if status != 0 and self.pidfile is not None and \
+                hasattr(self.pidfile, 'write_pid'):
+            self.pidfile.write_pid()
 
     def terminate(self, signal_number, stack_frame):
         """ Terminate this process
 
-        Simply terminate this process by raising SystemExit.
+        If a shutdown coordinator is set, the shutdown is requested, and
+        the application shuts down by calling close().
+
+        Else, simply terminate this process by raising SystemExit.
         This method is called if signal.SIGTERM was received.
 
         Check carefully if this really is what you want!
@@ -302,11 +997,76 @@ class DaemonContext(object):
         setting a custom handler via the signal_map. It is also possible
         to set the signal handlers directly via signal.signal().
 
+        If the systemd notification protocol is used, STOPPING=1
+        is sent first, and the state of the stats page is set to
+        draining or stopping.
+
         :return: None
         :raise: SystemExit
         """
+        if self._request_termination(signal_number):
+            return
         raise SystemExit('Terminating on signal {0}'.format(signal_number))
 
+    def _request_termination(self, signal_number):
+        """ Announce the termination, and request a coordinated shutdown
+
+        Sends STOPPING=1, sets the state of the stats page, and passes
+        the request to the shutdown coordinator, if one is set.
+
+        :param signal_number: signal that requested the termination
+        :type signal_number: int
+
+        :return: bool, True if a shutdown coordinator took the request
+        :raise: SystemExit, on a second request to the coordinator
+        """
+        if self.notifier is not None:
+            self.notifier.stopping()
+        if self.stats_page is not None:
+            self.stats_page.set_state(
+                'draining' if self.shutdown is not None else 'stopping')
+        if self.shutdown is None:
+            return False
+        self.shutdown.request(signal_number)
+        return True
+
+    def reopen_streams(self, signal_number, stack_frame):
+        """ Reopen the files stdout and stderr are redirected to
+
+        Map a signal to this method, to let logrotate move the log
+        files away, and signal the daemon, instead of using
+        copytruncate::
+
+            signal_map={signal.SIGTERM: 'terminate',
+                        signal.SIGUSR1: 'reopen_streams'}
+
+        Targets with a reopen method, like LogFile and LogWriter, are
+        reopened by it, other file objects by their name. A failure is
+        reported to stderr, and the stream keeps its old file.
+
+        :return: None
+        """
+        done = []
+        for system, target in ((sys.stdout, self.stdout),
+                               (sys.stderr, self.stderr)):
+            if target is None or any(target is item for item in done):
+                continue
+            done.append(target)
+            try:
+                reopen_stream(system, target)
+            except DaemonError as err:
+                sys.stderr.write('{0}\n'.format(err))
+
+
+CLOSE_RANGE_SYSCALL = 436
+"""close_range(2) syscall number, identical on every Linux architecture"""
+
+_LIBC_SYSCALL = {}
+"""Cache of _libc_syscall(), so the C library is only loaded once"""
+
+FD_DIRECTORIES = ('/proc/self/fd', '/dev/fd')
+"""Directories listing the open file descriptors of the current process"""
+
 
 def close_filenos(preserve):
     """ Close unprotected file descriptors
@@ -316,23 +1076,219 @@ def close_filenos(preserve):
     If ulimit -nofile is "unlimited", all is defined filenos <= 4096,
     else all is <= the output of resource.getrlimit().
 
+    The cheapest available method is used. If the kernel supports
+    close_range(2), the file descriptor space is split into ranges
+    around the protected files, and each range is closed at once, with
+    the system call itself, since os.closerange() falls back to closing
+    one descriptor after another where Python was built without it.
+    Else, if the open file descriptors can be listed, only those
+    are closed. Only if both fail, every file descriptor up to the
+    limit is closed one by one.
+
     :param preserve: set with protected files
     :type preserve: set
 
     :return: None
+    :raise: DaemonError
     """
     maxfd = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
     if maxfd == resource.RLIM_INFINITY:
         maxfd = 4096
-    for fileno in range(maxfd):
+    if close_range_supported():
+        for low, high in fileno_ranges(preserve, maxfd):
+            if not close_range(low, high):
+                os.closerange(low, high)
+        return
+    filenos = open_filenos()
+    if filenos is None:
+        filenos = range(maxfd)
+    for fileno in filenos:
         if fileno not in preserve:
-            try:
-                os.close(fileno)
-            except OSError as err:
-                if not err.errno == errno.EBADF:
-                    raise DaemonError(
-                        'Failed to close file descriptor {0}: {1}'
-                        .format(fileno, err))
+            close_fileno(fileno)
+
+
+def close_fileno(fileno):
+    """ Close a single file descriptor
+
+    A file descriptor that is not open is silently ignored.
+
+    :param fileno: file descriptor to close
+    :type fileno: int
+
+    :return: None
+    :raise: DaemonError
+    """
+    try:
+        os.close(fileno)
+    except OSError as err:
+        if not err.errno == errno.EBADF:
+            raise DaemonError(
+                'Failed to close file descriptor {0}: {1}'
+                .format(fileno, err))
+
+
+def close_range_supported():
+    """ Check if the kernel implements close_range(2)
+
+    The check closes the highest possible file descriptor, which is
+    never open, so it has no side effect.
+
+    :return: bool
+    """
+    syscall = _libc_syscall()
+    if syscall is None:
+        return False
+    last = ctypes.c_uint(0xffffffff)
+    return syscall(CLOSE_RANGE_SYSCALL, last, last, ctypes.c_uint(0)) == 0
+
+
+def close_range(low, high):
+    """ Close a range of file descriptors with close_range(2)
+
+    Like range(), low is included and high is excluded.
+
+    :param low: first file descriptor to close
+    :type low: int
+
+    :param high: first file descriptor not to close
+    :type high: int
+
+    :return: bool, False if the system call is not available, or
+        returned ENOSYS or EINVAL
+    :raise: DaemonError
+    """
+    syscall = _libc_syscall()
+    if syscall is None:
+        return False
+    result = syscall(CLOSE_RANGE_SYSCALL, ctypes.c_uint(low),
+                     ctypes.c_uint(high - 1), ctypes.c_uint(0))
+    if result == 0:
+        return True
+    error = ctypes.get_errno()
+    if error in (errno.ENOSYS, errno.EINVAL):
+        return False
+    raise DaemonError('Failed to close file descriptors {0} to {1}: {2}'
+                      .format(low, high - 1, os.strerror(error)))
+
+
+def _libc_syscall():
+    """ The syscall() function of the C library, on Linux
+
+    Loaded on the first call, and cached in _LIBC_SYSCALL.
+
+    :return: ctypes function, or None if not available
+    """
+    if 'syscall' not in _LIBC_SYSCALL:
+        _LIBC_SYSCALL['syscall'] = _load_libc_syscall()
+    return _LIBC_SYSCALL['syscall']
+
+
+def _load_libc_syscall():
+    """ Load the syscall() function of the C library
+
+    :return: ctypes function, or None if not available
+    """
+    if ctypes is None or not sys.platform.startswith('linux'):
+        return None
+    try:
+        syscall = ctypes.CDLL(None, use_errno=True).syscall
+    except (AttributeError, OSError):
+        return None
+    syscall.restype = ctypes.c_long
+    return syscall
+
+
+def fileno_ranges(preserve, maxfd):
+    """ Split the file descriptor space around protected files
+
+    Create a list of (low, high) tuples, covering every file descriptor
+    below maxfd that is not in preserve. Like range(), low is included
+    and high is excluded.
+
+    :param preserve: set with protected files
+    :type preserve: set
+
+    :param maxfd: first file descriptor not to be covered
+    :type maxfd: int
+
+    :return: list
+    """
+    result = []
+    low = 0
+    for fileno in sorted(preserve):
+        if fileno >= maxfd:
+            break
+        if fileno > low:
+            result.append((low, fileno))
+        low = max(low, fileno + 1)
+    if low < maxfd:
+        result.append((low, maxfd))
+    return result
+
+
+def open_filenos():
+    """ List the open file descriptors of this process
+
+    The descriptor used to read the directory is part of the result,
+    but already closed when this function returns.
+
+    :return: list, or None if no descriptor directory is available
+    """
+    for directory in FD_DIRECTORIES:
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        return sorted(int(name) for name in names if name.isdigit())
+    return None
+
+
+def wait_ready(fileno, timeout=None):
+    """ Wait for the daemon to report its readiness
+
+    Read the result of the startup from the readiness pipe, and print
+    the error message to stderr if the daemon failed.
+
+    :param fileno: read end of the readiness pipe
+    :type fileno: int
+
+    :param timeout: seconds to wait, or None to wait forever
+    :type timeout: float
+
+    :return: int, exit status for the launching process
+    """
+    data = b''
+    deadline = None if timeout is None else monotonic() + timeout
+    while True:
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                sys.stderr.write('Daemon not ready after {0} seconds\n'
+                                 .format(timeout))
+                return 1
+        try:
+            readable = select.select([fileno], [], [], remaining)[0]
+            if not readable:
+                continue
+            chunk = os.read(fileno, 4096)
+        except (OSError, select.error) as err:
+            if err.args[0] == errno.EINTR:
+                continue
+            raise
+        if not chunk:
+            break
+        data += chunk
+        if data[:1] == b'R' or data.endswith(b'\n'):
+            break
+    if data[:1] == b'R':
+        return 0
+    if data[:1] == b'F':
+        message = data[1:].rstrip(b'\n').decode('utf-8', 'replace')
+    else:
+        message = 'Daemon exited before it was ready'
+    sys.stderr.write(message + '\n')
+    return 1
 
 
 def default_signal_map():
@@ -406,6 +1362,8 @@ def redirect_stream(system, target):
     """ Redirect Unix streams
 
     If None, redirect Stream to /dev/null, else redirect to target.
+    If the class of target has an attach method, like LogWriter, the
+    stream is redirected to the descriptor returned by attach(system).
 
     :param system: ether sys.stdin, sys.stdout, or sys.stderr
     :type system: file object
@@ -418,6 +1376,8 @@ def redirect_stream(system, target):
     """
     if target is None:
         target_fd = os.open(os.devnull, os.O_RDWR)
+    elif hasattr(type(target), 'attach'):
+        target_fd = target.attach(system)
     else:
         target_fd = target.fileno()
     try:
@@ -425,3 +1385,40 @@ def redirect_stream(system, target):
     except OSError as err:
         raise DaemonError('Could not redirect {0} to {1}: {2}'
                           .format(system, target, err))
+
+
+def reopen_stream(system, target):
+    """ Reopen the file a stream is redirected to
+
+    If the class of target has a reopen method, it is called. Else the
+    file named by target.name is opened again for appending, and
+    duplicated onto target and the system stream.
+
+    :param system: ether sys.stdout, or sys.stderr
+    :type system: file object
+
+    :param target: File like object
+    :type target: File Object
+
+    :return: None
+    :raise: DaemonError
+    """
+    if hasattr(type(target), 'reopen'):
+        target.reopen()
+        return
+    name = getattr(target, 'name', None)
+    if not isinstance(name, string_types) or name.startswith('<'):
+        return
+    try:
+        target_fd = os.open(name, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                            0o644)
+    except OSError as err:
+        raise DaemonError('Could not reopen {0}: {1}'.format(name, err))
+    try:
+        target.flush()
+        os.dup2(target_fd, target.fileno())
+        os.dup2(target_fd, system.fileno())
+    except (IOError, OSError) as err:
+        raise DaemonError('Could not reopen {0}: {1}'.format(name, err))
+    finally:
+        os.close(target_fd)
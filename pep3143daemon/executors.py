@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Executor pools owned by a pep3143 daemon implementation.
+
+"""
+__author__ = 'schlitzer'
+
+
+import os
+import sys
+import threading
+
+try:
+    import concurrent.futures
+except ImportError:
+    concurrent = None
+
+from pep3143daemon.daemon import DaemonError
+from pep3143daemon.instrument import monotonic
+
+if concurrent is None:
+    EXECUTOR_KINDS = {}
+else:
+    EXECUTOR_KINDS = {
+        'thread': concurrent.futures.ThreadPoolExecutor,
+        'process': concurrent.futures.ProcessPoolExecutor,
+    }
+
+
+class ManagedExecutor(object):
+    """
+    Named executor pool, created lazily in the process that uses it.
+
+    The concurrent.futures executor is created on the first submit(),
+    so a pool configured before DaemonContext.open() only starts its
+    threads or processes in the daemon. If the process forked since
+    the executor was created, its threads are gone, so a new executor
+    is created.
+
+    concurrent.futures is part of the standard library since Python
+    3.2; on Python 2.7 the futures backport has to be installed.
+
+    Every task is timed: wait is the time from submit() to the start of
+    the task, only known for thread pools, latency the time from
+    submit() until the result is available. See stats().
+
+    :param name:
+        Name of the pool.
+    :type name: str
+
+    :param max_workers:
+        Number of threads or processes. If None, the default of the
+        executor class.
+    :type max_workers: int
+
+    :param kind:
+        "thread" for a ThreadPoolExecutor, "process" for a
+        ProcessPoolExecutor.
+    :type kind: str
+    """
+
+    def __init__(self, name, max_workers=None, kind='thread'):
+        """
+        Create a new instance
+        """
+        if concurrent is None:
+            raise DaemonError('ManagedExecutor needs concurrent.futures, '
+                              'install the futures package')
+        if kind not in EXECUTOR_KINDS:
+            raise DaemonError('Unknown executor kind: {0}'.format(kind))
+        self.name = name
+        self.max_workers = max_workers
+        self.kind = kind
+        self._executor = None
+        self._pid = None
+        self._shutdown = False
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        """ Set all counters to zero
+
+        :return: None
+        """
+        self.submitted = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._wait = [0.0, 0.0, 0]
+        self._latency = [0.0, 0.0, 0]
+
+    @property
+    def executor(self):
+        """ The executor, created if needed
+
+        :return: concurrent.futures.Executor
+        :raise: DaemonError
+        """
+        with self._lock:
+            if self._shutdown:
+                raise DaemonError('Executor {0} is shut down'
+                                  .format(self.name))
+            if self._pid != os.getpid():
+                self._executor = None
+                self._pid = os.getpid()
+                self._reset_stats()
+            if self._executor is None:
+                self._executor = self._create()
+            return self._executor
+
+    def _create(self):
+        """ Create the executor
+
+        :return: concurrent.futures.Executor
+        """
+        cls = EXECUTOR_KINDS[self.kind]
+        if self.kind == 'thread' and sys.version_info >= (3, 6):
+            return cls(self.max_workers, thread_name_prefix=self.name)
+        return cls(self.max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        """ Schedule fn(*args, **kwargs)
+
+        :return: concurrent.futures.Future
+        :raise: DaemonError
+        """
+        executor = self.executor
+        with self._lock:
+            self.submitted += 1
+        submitted = monotonic()
+        try:
+            if self.kind == 'thread':
+                future = executor.submit(
+                    self._run, submitted, fn, args, kwargs)
+            else:
+                future = executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.submitted -= 1
+            raise
+        future.add_done_callback(
+            lambda done: self._finished(done, submitted))
+        return future
+
+    def _run(self, submitted, fn, args, kwargs):
+        """ Run a task in a pool thread, recording its wait time
+
+        :return: the result of fn
+        """
+        with self._lock:
+            _record(self._wait, monotonic() - submitted)
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _finished(self, future, submitted):
+        """ Count a finished task, and record its latency
+
+        :return: None
+        """
+        with self._lock:
+            if future.cancelled():
+                self.cancelled += 1
+                return
+            _record(self._latency, monotonic() - submitted)
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def resize(self, max_workers):
+        """ Change the number of workers
+
+        New tasks go to a new executor of the new size. The old one
+        finishes its queued tasks in the background.
+
+        :param max_workers: number of threads or processes
+        :type max_workers: int
+
+        :return: None
+        """
+        with self._lock:
+            if max_workers == self.max_workers:
+                return
+            self.max_workers = max_workers
+            old, self._executor = self._executor, None
+        if old is not None and self._pid == os.getpid():
+            old.shutdown(wait=False)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """ Shut the executor down
+
+        Compatible with Executor.shutdown(), so a ShutdownCoordinator
+        can drain or cancel the pool.
+
+        :param wait: wait for the tasks to finish
+        :type wait: bool
+
+        :param cancel_futures: cancel the tasks that did not start yet
+        :type cancel_futures: bool
+
+        :return: None
+        """
+        with self._lock:
+            self._shutdown = True
+            executor = self._executor
+        if executor is None or self._pid != os.getpid():
+            return
+        if cancel_futures and sys.version_info >= (3, 9):
+            executor.shutdown(wait=wait, cancel_futures=True)
+        else:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        """ Queue depth and task latency of the pool
+
+        queued counts the tasks waiting for a worker, or, for process
+        pools, all tasks not finished yet. wait and latency hold the
+        mean and maximum in seconds; wait is None for process pools.
+
+        :return: dict
+        """
+        with self._lock:
+            pending = (self.submitted - self.completed - self.failed -
+                       self.cancelled)
+            return {
+                'name': self.name,
+                'kind': self.kind,
+                'max_workers': self.max_workers,
+                'queued': pending - self.running,
+                'running': self.running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'wait': (_summary(self._wait)
+                         if self.kind == 'thread' else None),
+                'latency': _summary(self._latency),
+            }
+
+
+def executor_spec(spec):
+    """ Normalize the configuration of an executor
+
+    :param spec: max_workers as int, or a dict of ManagedExecutor
+        arguments, like {'max_workers': 4, 'kind': 'process'}
+    :type spec: int, dict
+
+    :return: dict
+    """
+    if isinstance(spec, dict):
+        return dict(spec)
+    return {'max_workers': spec}
+
+
+def _record(summary, value):
+    """ Add a value to a [total, maximum, count] summary
+
+    :return: None
+    """
+    summary[0] += value
+    summary[1] = max(summary[1], value)
+    summary[2] += 1
+
+
+def _summary(summary):
+    """ Export a [total, maximum, count] summary
+
+    :return: dict with mean and max
+    """
+    total, maximum, count = summary
+    return {'mean': total / count if count else 0.0, 'max': maximum}
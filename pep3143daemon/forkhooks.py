@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of callbacks run around fork(), for pools and caches.
+
+"""
+__author__ = 'schlitzer'
+
+
+import os
+import threading
+import traceback
+
+
+class ForkRegistry(object):
+    """
+    Callbacks run before and after every fork of this process.
+
+    Thread pools, connection pools, random number generators and locks
+    created before a fork are broken or shared in the child. Components
+    register callbacks here, so their state can be built before
+    DaemonContext.open(), and only the parts that cannot be shared are
+    re-created in the child: the before callbacks quiesce the state,
+    after_in_parent callbacks resume it, and after_in_child callbacks
+    re-create it.
+
+    On Python 3.7 and later, the registry ties into os.register_at_fork
+    on its first registration, so the callbacks run for every fork of
+    the process, including os.fork() calls of the application. On older
+    versions, they run for forks done through fork(), which
+    DaemonContext.open() and PreforkPool use.
+
+    As with os.register_at_fork, before callbacks run in reverse
+    registration order, the after callbacks in registration order.
+    A callback raising an exception is reported on stderr, and does not
+    stop the other callbacks or the fork.
+
+    The registry is process wide, every DaemonContext uses the instance
+    in fork_registry, unless it is passed another one.
+    """
+
+    def __init__(self):
+        self.before = []
+        self.after_in_parent = []
+        self.after_in_child = []
+        self.installed = False
+        self._lock = threading.Lock()
+
+    def register(self, before=None, after_in_parent=None,
+                 after_in_child=None):
+        """ Register callbacks, called without arguments
+
+        :param before: called in the parent, before the fork
+        :type before: callable
+
+        :param after_in_parent: called in the parent, after the fork
+        :type after_in_parent: callable
+
+        :param after_in_child: called in the child, after the fork
+        :type after_in_child: callable
+
+        :return: None
+        """
+        self.install()
+        if before is not None:
+            self.before.append(before)
+        if after_in_parent is not None:
+            self.after_in_parent.append(after_in_parent)
+        if after_in_child is not None:
+            self.after_in_child.append(after_in_child)
+
+    def unregister(self, callback):
+        """ Remove a callback, wherever it was registered
+
+        :param callback: callable passed to register()
+        :type callback: callable
+
+        :return: None
+        """
+        for callbacks in (self.before, self.after_in_parent,
+                          self.after_in_child):
+            while callback in callbacks:
+                callbacks.remove(callback)
+
+    def install(self):
+        """ Tie the registry into os.register_at_fork, if available
+
+        Done only once, os.register_at_fork cannot be undone.
+
+        :return: bool, True if the callbacks run for every fork
+        """
+        with self._lock:
+            if not self.installed and hasattr(os, 'register_at_fork'):
+                os.register_at_fork(
+                    before=self.run_before,
+                    after_in_parent=self.run_after_in_parent,
+                    after_in_child=self.run_after_in_child)
+                self.installed = True
+        return self.installed
+
+    def fork(self, fork=None):
+        """ Fork, running the callbacks unless os.register_at_fork does
+
+        :param fork: fork function, defaults to os.fork
+        :type fork: callable
+
+        :return: int, as returned by fork
+        :raise: OSError
+        """
+        if fork is None:
+            fork = os.fork
+        if self.installed:
+            return fork()
+        self.run_before()
+        try:
+            pid = fork()
+        except OSError:
+            self.run_after_in_parent()
+            raise
+        if pid > 0:
+            self.run_after_in_parent()
+        else:
+            self.run_after_in_child()
+        return pid
+
+    def run_before(self):
+        """ Run the before callbacks, in reverse registration order
+
+        :return: None
+        """
+        _run(reversed(list(self.before)))
+
+    def run_after_in_parent(self):
+        """ Run the after_in_parent callbacks
+
+        :return: None
+        """
+        _run(list(self.after_in_parent))
+
+    def run_after_in_child(self):
+        """ Run the after_in_child callbacks
+
+        :return: None
+        """
+        _run(list(self.after_in_child))
+
+
+def _run(callbacks):
+    """ Call every callback, reporting exceptions on stderr
+
+    :return: None
+    """
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            traceback.print_exc()
+
+
+fork_registry = ForkRegistry()
+"""Registry used by DaemonContext, if no other is passed"""
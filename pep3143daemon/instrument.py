@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Startup instrumentation for a pep3143 daemon implementation.
+
+"""
+__author__ = 'schlitzer'
+
+
+import os
+import resource
+import time
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+RUSAGE_FIELDS = (
+    'ru_utime',
+    'ru_stime',
+    'ru_maxrss',
+    'ru_minflt',
+    'ru_majflt',
+    'ru_inblock',
+    'ru_oublock',
+    'ru_nvcsw',
+    'ru_nivcsw',
+)
+
+
+class StartupEvent(object):
+    """
+    A single, measured step of DaemonContext.open().
+
+    :param phase:
+        name of the step
+    :type phase: str
+
+    :param start:
+        monotonic timestamp taken before the step
+    :type start: float
+
+    :param end:
+        monotonic timestamp taken after the step
+    :type end: float
+
+    :param pid:
+        process id after the step, differs from parent_pid after a fork
+    :type pid: int
+
+    :param parent_pid:
+        process id before the step
+    :type parent_pid: int
+
+    :param rusage:
+        getrusage() difference caused by the step. After a fork,
+        the counters of the child start at zero, so this holds the
+        absolute values of the child.
+    :type rusage: dict
+
+    :param error:
+        exception raised by the step, or None
+    :type error: Exception
+    """
+
+    def __init__(self, phase, start, end, pid, parent_pid, rusage,
+                 error=None):
+        """
+        Create a new instance
+        """
+        self.phase = phase
+        self.start = start
+        self.end = end
+        self.pid = pid
+        self.parent_pid = parent_pid
+        self.rusage = rusage
+        self.error = error
+
+    def __repr__(self):
+        return '<StartupEvent {0} {1:.6f}s pid={2}>'.format(
+            self.phase, self.duration, self.pid)
+
+    @property
+    def duration(self):
+        """ Wall time of the step in seconds
+
+        :return: float
+        """
+        return self.end - self.start
+
+    @property
+    def forked(self):
+        """ True if the step continued in a new process
+
+        :return: bool
+        """
+        return self.pid != self.parent_pid
+
+    def as_dict(self):
+        """ Export the event as a dictionary
+
+        :return: dict
+        """
+        return {
+            'phase': self.phase,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.duration,
+            'pid': self.pid,
+            'parent_pid': self.parent_pid,
+            'rusage': dict(self.rusage),
+            'error': None if self.error is None else str(self.error),
+        }
+
+
+class StartupReport(object):
+    """
+    Collection of the StartupEvents of a DaemonContext.open() call, or
+    of the steps of a DaemonContext.close() call.
+
+    Every finished step is passed to the hook, if one is set.
+
+    :param hook:
+        callable, called with every StartupEvent
+    :type hook: callable
+    """
+
+    def __init__(self, hook=None):
+        """
+        Create a new instance
+        """
+        self.hook = hook
+        self.events = []
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __str__(self):
+        return ', '.join(
+            '{0}={1:.6f}s'.format(event.phase, event.duration)
+            for event in self.events)
+
+    @property
+    def duration(self):
+        """ Wall time from the start of the first to the end of the last step
+
+        :return: float
+        """
+        if not self.events:
+            return 0.0
+        return self.events[-1].end - self.events[0].start
+
+    def phase(self, name):
+        """ Return the event of a step
+
+        :param name: name of the step
+        :type name: str
+
+        :return: StartupEvent, or None if the step did not run
+        """
+        for event in self.events:
+            if event.phase == name:
+                return event
+        return None
+
+    def run(self, phase, func):
+        """ Run and measure a step
+
+        :param phase: name of the step
+        :type phase: str
+
+        :param func: callable doing the work of the step
+        :type func: callable
+
+        :return: the return value of func
+        """
+        parent_pid = os.getpid()
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        start = monotonic()
+        error = None
+        try:
+            return func()
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            end = monotonic()
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            pid = os.getpid()
+            if pid != parent_pid:
+                before = None
+            event = StartupEvent(
+                phase, start, end, pid, parent_pid,
+                rusage_delta(before, after), error)
+            self.events.append(event)
+            if self.hook is not None:
+                self.hook(event)
+
+    def as_dict(self):
+        """ Export the report as a dictionary
+
+        :return: dict
+        """
+        return {
+            'duration': self.duration,
+            'events': [event.as_dict() for event in self.events],
+        }
+
+
+def rusage_delta(before, after):
+    """ Calculate the difference of two getrusage() results
+
+    :param before: getrusage() result, or None to return after as dict
+    :type before: resource.struct_rusage
+
+    :param after: getrusage() result
+    :type after: resource.struct_rusage
+
+    :return: dict
+    """
+    result = {}
+    for field in RUSAGE_FIELDS:
+        value = getattr(after, field)
+        if before is not None:
+            value -= getattr(before, field)
+        result[field] = value
+    return result
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Log file for redirected streams, that can be reopened and rotated
+without copying.
+
+"""
+__author__ = 'schlitzer'
+
+
+import os
+import threading
+
+from pep3143daemon.daemon import DaemonError
+from pep3143daemon.instrument import monotonic
+
+
+class LogFile(object):
+    """
+    Stream target for DaemonContext, that can be reopened, for example
+    after logrotate moved it, and rotated by the daemon itself.
+
+    The file is opened for appending when the instance is created, so
+    before any chroot or uid change. Reopening and rotating use path
+    again, so it has to be reachable, and writable, by the daemon
+    afterwards.
+
+    reopen() opens path again, and duplicates the new descriptor onto
+    the descriptor of this instance, and onto every attached stream.
+    dup2() replaces a descriptor atomically, so no line is lost or
+    written to a closed file. The descriptor number of the instance
+    never changes, so it can also be the target of a LogWriter.
+
+    If max_bytes or rotate_interval is set, a thread started by
+    attach(), or start(), checks the file every check_interval seconds,
+    and rotates it: path is renamed to path.1, path.1 to path.2 and so
+    on, up to backup_count, and path is reopened. A rotation costs a few
+    renames, instead of the copy done by logrotate's copytruncate.
+
+    Example::
+
+        log = LogFile('/var/log/app.log', max_bytes=100 * 1024 * 1024)
+        daemon = DaemonContext(
+            stdout=log, stderr=log,
+            signal_map={signal.SIGTERM: 'terminate',
+                        signal.SIGUSR1: 'reopen_streams'})
+
+    :param path:
+        Full path of the log file
+    :type path: str
+
+    :param max_bytes:
+        Rotate once the file reached this size. If None, the size is
+        not checked.
+    :type max_bytes: int
+
+    :param rotate_interval:
+        Rotate after this many seconds. If None, the age is not
+        checked.
+    :type rotate_interval: float
+
+    :param backup_count:
+        Number of rotated files to keep. If 0, the file is removed on
+        rotation.
+    :type backup_count: int
+
+    :param check_interval:
+        Seconds between two checks of the rotation thread.
+    :type check_interval: float
+
+    :param file_mode:
+        Permissions of a newly created file, before the umask is applied.
+    :type file_mode: int
+    """
+
+    def __init__(
+            self, path, max_bytes=None, rotate_interval=None, backup_count=5,
+            check_interval=1.0, file_mode=0o644):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.check_interval = check_interval
+        self.file_mode = file_mode
+        self.rotations = 0
+        self._lock = threading.RLock()
+        self._attached = []
+        self._opened = monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        self._fileno = self._open()
+
+    def _open(self):
+        """ Open path for appending
+
+        :return: int, file descriptor
+        :raise: DaemonError
+        """
+        try:
+            fileno = os.open(
+                self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                self.file_mode)
+        except OSError as err:
+            raise DaemonError('Unable to open {0}: {1}'.format(self.path, err))
+        if hasattr(os, 'set_inheritable'):
+            os.set_inheritable(fileno, False)
+        return fileno
+
+    def fileno(self):
+        """ Return the descriptor of the log file
+
+        :return: int
+        """
+        return self._fileno
+
+    def attach(self, system):
+        """ Attach a system stream
+
+        The stream is reopened together with this instance, and the
+        rotation thread is started.
+
+        :param system: sys.stdout or sys.stderr
+        :type system: file object
+
+        :return: int, descriptor to duplicate onto the stream
+        """
+        self._attached.append(system.fileno())
+        self.start()
+        return self._fileno
+
+    def start(self):
+        """ Start the rotation thread
+
+        Does nothing if it already runs, or no rotation is configured.
+        Threads do not survive fork(), so call this only after
+        daemonizing.
+
+        :return: None
+        """
+        if self.max_bytes is None and self.rotate_interval is None:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._rotate_loop, name='pep3143daemon-log-rotate')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the rotation thread
+
+        :return: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reopen(self):
+        """ Reopen path
+
+        Call this after the file was moved away, for example by
+        logrotate.
+
+        :return: None
+        :raise: DaemonError
+        """
+        with self._lock:
+            fileno = self._open()
+            try:
+                for target in [self._fileno] + self._attached:
+                    os.dup2(fileno, target)
+            except OSError as err:
+                raise DaemonError('Unable to reopen {0}: {1}'.format(
+                    self.path, err))
+            finally:
+                os.close(fileno)
+            if hasattr(os, 'set_inheritable'):
+                os.set_inheritable(self._fileno, False)
+            self._opened = monotonic()
+
+    def rotate(self):
+        """ Rotate the log file now
+
+        :return: None
+        :raise: DaemonError
+        """
+        with self._lock:
+            try:
+                if self.backup_count > 0:
+                    for index in range(self.backup_count - 1, 0, -1):
+                        source = '{0}.{1}'.format(self.path, index)
+                        if os.path.exists(source):
+                            os.rename(source, '{0}.{1}'.format(
+                                self.path, index + 1))
+                    os.rename(self.path, self.path + '.1')
+                else:
+                    os.remove(self.path)
+            except OSError as err:
+                raise DaemonError('Unable to rotate {0}: {1}'.format(
+                    self.path, err))
+            self.reopen()
+            self.rotations += 1
+
+    def rotation_due(self):
+        """ Check if the file has to be rotated
+
+        :return: bool
+        """
+        if self.rotate_interval is not None and \
+                monotonic() - self._opened >= self.rotate_interval:
+            return True
+        if self.max_bytes is not None:
+            return os.fstat(self._fileno).st_size >= self.max_bytes
+        return False
+
+    def _rotate_loop(self):
+        """ Rotate the file, whenever it is due
+
+        Errors are written to the log file itself, and the rotation is
+        tried again with the next check.
+
+        :return: None
+        """
+        while not self._stop.wait(self.check_interval):
+            try:
+                if self.rotation_due():
+                    self.rotate()
+            except (DaemonError, OSError) as err:
+                try:
+                    os.write(self._fileno, '{0}\n'.format(err).encode(
+                        'utf-8', 'replace'))
+                except OSError:
+                    pass
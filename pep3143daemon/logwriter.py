@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Non-blocking redirection of stdout and stderr, through a pipe drained
+by background threads.
+
+"""
+__author__ = 'schlitzer'
+
+
+import atexit
+import collections
+import errno
+import fcntl
+import os
+import threading
+
+from pep3143daemon.daemon import DaemonError
+
+OVERFLOW_POLICIES = ('block', 'drop', 'count')
+
+# fcntl.F_SETPIPE_SZ is only exported by Python 3.10 and later
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+class LogWriter(object):
+    """
+    Stream target for DaemonContext, that decouples the daemon from the
+    latency of its log files.
+
+    Passed as stdout or stderr of a DaemonContext, the stream is
+    redirected into a pipe instead of the target file. A reader thread
+    moves the data from the pipe into a bounded buffer, and a writer
+    thread writes it to the target in batches. A stalled disk or NFS
+    mount then only stalls the writer thread, not the daemon.
+
+    The same instance can be used for stdout and stderr. The threads
+    are started by attach(), when open() redirects the streams, so they
+    are not lost by forking. At exit, close() writes out the buffer and
+    points the streams at the target directly.
+
+    Example::
+
+        log = LogWriter('/var/log/app.log', capacity=4 * 1024 * 1024)
+        daemon = DaemonContext(stdout=log, stderr=log)
+
+    :param target:
+        File name, opened for appending when the instance is created,
+        so before any chroot or uid change, or a file object, like a
+        LogFile, or a file descriptor.
+    :type target: str, file object or int
+
+    :param capacity:
+        Bytes buffered while the target is slow. Data above this limit
+        is handled according to overflow.
+    :type capacity: int
+
+    :param overflow:
+        "block" stops reading the pipe, so writes to the stream block
+        once the pipe is full as well, "drop" discards the data, and
+        "count" discards it and writes a note with the number of
+        dropped bytes into the log, once the target catches up.
+    :type overflow: str
+
+    :param batch_size:
+        Maximum bytes written to the target with a single write.
+    :type batch_size: int
+
+    :param pipe_size:
+        Requested capacity of the pipe, in bytes. Only honored on
+        Linux, and limited by /proc/sys/fs/pipe-max-size.
+    :type pipe_size: int
+
+    :param close_timeout:
+        Seconds close() waits for the buffer to be written.
+    :type close_timeout: float
+    """
+
+    def __init__(
+            self, target, capacity=1024 * 1024, overflow='block',
+            batch_size=64 * 1024, pipe_size=None, close_timeout=5.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise DaemonError('Unknown overflow policy: {0}'.format(overflow))
+        if isinstance(target, int):
+            self._target = None
+            self._target_fd = target
+        else:
+            if not hasattr(target, 'fileno'):
+                try:
+                    target = open(target, 'ab')
+                except (IOError, OSError) as err:
+                    raise DaemonError('Unable to open {0}: {1}'.format(
+                        target, err))
+            self._target = target
+            self._target_fd = target.fileno()
+        self._path = getattr(self._target, 'name', None)
+        self.capacity = capacity
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.pipe_size = pipe_size
+        self.close_timeout = close_timeout
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._unreported = 0
+        self._buffer = collections.deque()
+        self._buffered = 0
+        self._eof = False
+        self._cond = threading.Condition(threading.Lock())
+        self._read_fd = None
+        self._write_fd = None
+        self._attached = []
+        self._reader = None
+        self._writer = None
+
+    def fileno(self):
+        """ Return the descriptor of the target
+
+        DaemonContext preserves it while daemonizing.
+
+        :return: int
+        """
+        return self._target_fd
+
+    @property
+    def pending(self):
+        """ Bytes buffered, but not written to the target yet """
+        with self._cond:
+            return self._buffered
+
+    def attach(self, system):
+        """ Attach a system stream
+
+        Creates the pipe and starts the threads on the first call, and
+        returns the descriptor, that has to be duplicated onto the
+        stream.
+
+        :param system: sys.stdout or sys.stderr
+        :type system: file object
+
+        :return: int, write end of the pipe
+        :raise: DaemonError
+        """
+        if self._write_fd is None:
+            try:
+                self._read_fd, self._write_fd = [
+                    above_stdio(fileno) for fileno in os.pipe()]
+            except (IOError, OSError) as err:
+                raise DaemonError('Unable to create log pipe: {0}'.format(err))
+            if self.pipe_size is not None:
+                try:
+                    fcntl.fcntl(self._write_fd, F_SETPIPE_SZ, self.pipe_size)
+                except (IOError, OSError):
+                    pass
+            self._reader = threading.Thread(
+                target=self._read_loop, name='pep3143daemon-log-reader')
+            self._writer = threading.Thread(
+                target=self._write_loop, name='pep3143daemon-log-writer')
+            for thread in self._reader, self._writer:
+                thread.daemon = True
+                thread.start()
+            atexit.register(self.close)
+            if hasattr(type(self._target), 'start'):
+                self._target.start()
+        self._attached.append(system)
+        return self._write_fd
+
+    def reopen(self):
+        """ Reopen the target
+
+        A target with a reopen method, like LogFile, is reopened by it,
+        else the target file is opened again by name, and duplicated
+        onto the target descriptor, so buffered data goes to the new
+        file.
+
+        :return: None
+        :raise: DaemonError
+        """
+        if hasattr(type(self._target), 'reopen'):
+            self._target.reopen()
+            return
+        if not isinstance(self._path, str) or self._path.startswith('<'):
+            return
+        try:
+            fileno = os.open(
+                self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except OSError as err:
+            raise DaemonError('Unable to reopen {0}: {1}'.format(
+                self._path, err))
+        try:
+            os.dup2(fileno, self._target_fd)
+        except OSError as err:
+            raise DaemonError('Unable to reopen {0}: {1}'.format(
+                self._path, err))
+        finally:
+            os.close(fileno)
+
+    def close(self):
+        """ Write out the buffer, and stop the threads
+
+        The attached streams are flushed, and pointed at the target
+        directly, so output written afterwards, like a final traceback,
+        is not lost. Waits at most close_timeout seconds, for example
+        if a child process still holds the pipe open.
+
+        :return: None
+        """
+        if self._write_fd is None:
+            return
+        for system in self._attached:
+            try:
+                system.flush()
+                os.dup2(self._target_fd, system.fileno())
+            except (IOError, OSError, ValueError):
+                pass
+        os.close(self._write_fd)
+        self._write_fd = None
+        self._writer.join(self.close_timeout)
+
+    def _read_loop(self):
+        """ Move data from the pipe into the buffer
+
+        :return: None
+        """
+        while True:
+            try:
+                chunk = os.read(self._read_fd, 64 * 1024)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                chunk = b''
+            with self._cond:
+                if not chunk:
+                    self._eof = True
+                    self._cond.notify_all()
+                    break
+                if self.overflow == 'block':
+                    while self._buffered >= self.capacity:
+                        self._cond.wait()
+                elif self._buffered and \
+                        self._buffered + len(chunk) > self.capacity:
+                    self.dropped += len(chunk)
+                    if self.overflow == 'count':
+                        self._unreported += len(chunk)
+                    continue
+                self._buffer.append(chunk)
+                self._buffered += len(chunk)
+                self._cond.notify_all()
+        os.close(self._read_fd)
+
+    def _write_loop(self):
+        """ Write the buffer to the target in batches
+
+        :return: None
+        """
+        while True:
+            with self._cond:
+                while not self._buffer and not self._eof:
+                    self._cond.wait()
+                if not self._buffer and not self._unreported:
+                    break
+                chunks = []
+                size = 0
+                while self._buffer and (not chunks or size + len(
+                        self._buffer[0]) <= self.batch_size):
+                    chunks.append(self._buffer.popleft())
+                    size += len(chunks[-1])
+                self._buffered -= size
+                unreported, self._unreported = self._unreported, 0
+                self._cond.notify_all()
+            if unreported:
+                chunks.append('[pep3143daemon: {0} bytes of log output '
+                              'dropped]\n'.format(unreported).encode('ascii'))
+            self._write(b''.join(chunks))
+
+    def _write(self, data):
+        """ Write data to the target
+
+        Errors are counted, and the data is discarded, there is no
+        place left to report them.
+
+        :param data: data to write
+        :type data: bytes
+
+        :return: None
+        """
+        try:
+            while data:
+                try:
+                    written = os.write(self._target_fd, data)
+                except OSError as err:
+                    if err.errno == errno.EINTR:
+                        continue
+                    raise
+                self.written += written
+                data = data[written:]
+        except OSError:
+            self.errors += 1
+
+
+def above_stdio(fileno):
+    """ Move a descriptor above the standard streams
+
+    While daemonizing, descriptors 0 to 2 are closed before the streams
+    are redirected, so a new pipe can get them, and would be overwritten
+    by the redirection.
+
+    :param fileno: file descriptor
+    :type fileno: int
+
+    :return: int, fileno, or a close-on-exec duplicate of it above 2
+    """
+    if fileno > 2:
+        return fileno
+    try:
+        duplicate = fcntl.fcntl(
+            fileno, getattr(fcntl, 'F_DUPFD_CLOEXEC', fcntl.F_DUPFD), 3)
+    finally:
+        os.close(fileno)
+    return duplicate
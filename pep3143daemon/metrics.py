@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus text format exporter of process and daemon metrics.
+
+"""
+__author__ = 'schlitzer'
+
+
+import errno
+import os
+import resource
+import select
+import socket
+import threading
+
+from pep3143daemon.daemon import DaemonError, open_filenos
+from pep3143daemon.instrument import monotonic
+from pep3143daemon.prefork import listen_socket
+
+PROC_STAT = '/proc/self/stat'
+PROC_STATUS = '/proc/self/status'
+PROC_SYSTEM_STAT = '/proc/stat'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsExporter(object):
+    """
+    Serve process and daemon metrics in the Prometheus text format.
+
+    A single background thread samples /proc/self/stat,
+    /proc/self/status and /proc/self/fd every interval seconds, and
+    answers scrapes from the last sample, so scrapes never touch /proc.
+    Where /proc is missing, getrusage() is used instead.
+
+    Passed as metrics to DaemonContext, the listening socket is bound
+    by open() before the chroot and the uid and gid change, so a
+    privileged port works, it survives close_filenos, and is served
+    after the forks. Besides the process metrics, the exporter reports
+    the signals handled by the signal_map, per signal number, the
+    re-exec generation, the duration of the startup steps, if
+    startup_hook was set, and the queue depth of the executors. More
+    metrics are added with add_collector(); a PreforkPool adds the
+    number of its workers, and how often they exited. Forked children,
+    like the workers of a PreforkPool, close their copy of the socket,
+    through the fork_registry of the daemon.
+
+    Any HTTP GET request is answered, for example::
+
+        $ curl http://127.0.0.1:9100/metrics
+        $ curl --unix-socket /run/server.metrics http://localhost/metrics
+
+    :param address:
+        (host, port) tuple for TCP, or path of a Unix domain socket.
+    :type address: tuple, str
+
+    :param interval:
+        Seconds between two samples of /proc.
+    :type interval: float
+
+    :param mode:
+        Permissions of a Unix domain socket file.
+    :type mode: int
+    """
+
+    def __init__(self, address, interval=15.0, mode=0o600):
+        """
+        Create a new instance
+        """
+        self.address = address
+        self.interval = interval
+        self.mode = mode
+        self.sock = None
+        self.collectors = []
+        self.sample = []
+        self._daemon = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def fileno(self):
+        """ Descriptor of the listening socket
+
+        :return: int
+        """
+        return self.sock.fileno()
+
+    def add_collector(self, collector):
+        """ Add a source of metrics
+
+        :param collector: callable returning a list of metric families,
+            (name, type, help, samples) tuples, where samples is a list
+            of (labels, value) tuples and labels a dict
+        :type collector: callable
+
+        :return: None
+        """
+        self.collectors.append(collector)
+
+    def bind(self, uid=None, gid=None):
+        """ Create the listening socket
+
+        :param uid: owner of a Unix domain socket file, or None
+        :type uid: int
+
+        :param gid: group of a Unix domain socket file, or None
+        :type gid: int
+
+        :return: None
+        :raise: DaemonError
+        """
+        try:
+            sock = listen_socket(self.address, 8)
+            if not isinstance(self.address, tuple):
+                os.chmod(self.address, self.mode)
+                if (uid, gid) != (os.getuid(), os.getgid()):
+                    os.chown(self.address, -1 if uid is None else uid,
+                             -1 if gid is None else gid)
+        except (OSError, socket.error) as err:
+            raise DaemonError('Could not listen for metrics on {0}: {1}'
+                              .format(self.address, err))
+        self.sock = sock
+
+    def start(self, daemon):
+        """ Take the first sample, and serve the socket in a thread
+
+        :param daemon: the daemon to report on
+        :type daemon: pep3143daemon.DaemonContext
+
+        :return: None
+        """
+        self._daemon = daemon
+        self.sample = process_metrics()
+        daemon.fork_registry.register(after_in_child=self._after_fork)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name='metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """ Stop serving, and close the socket
+
+        :return: None
+        """
+        self._stop.set()
+        if self._daemon is not None:
+            self._daemon.fork_registry.unregister(self._after_fork)
+        if self._thread is not None:
+            self._thread.join(self.interval)
+            self._thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if not isinstance(self.address, tuple):
+                try:
+                    os.unlink(self.address)
+                except OSError:
+                    pass
+
+    def _after_fork(self):
+        """ Close the socket in a forked child, keeping the socket file
+
+        :return: None
+        """
+        self._stop.set()
+        self._thread = None
+        if self.sock is not None:
+            sock, self.sock = self.sock, None
+            sock.close()
+
+    def _serve(self):
+        """ Answer scrapes, and sample /proc every interval seconds
+
+        :return: None
+        """
+        next_sample = monotonic() + self.interval
+        while not self._stop.is_set():
+            timeout = max(min(next_sample - monotonic(), 0.5), 0)
+            try:
+                ready = select.select([self.sock], [], [], timeout)[0]
+            except (OSError, select.error) as err:
+                if err.args[0] != errno.EINTR:
+                    raise
+                continue
+            if ready:
+                self._answer()
+            if monotonic() >= next_sample:
+                self.sample = process_metrics()
+                next_sample = monotonic() + self.interval
+
+    def _answer(self):
+        """ Accept a client, and send it the metrics
+
+        :return: None
+        """
+        try:
+            client, _ = self.sock.accept()
+        except (OSError, socket.error):
+            return
+        try:
+            client.settimeout(2.0)
+            request = b''
+            while b'\r\n\r\n' not in request and len(request) < 8192:
+                data = client.recv(4096)
+                if not data:
+                    break
+                request += data
+            if request.startswith(b'GET '):
+                body = self.render().encode('utf-8')
+                head = ('HTTP/1.0 200 OK\r\nContent-Type: {0}\r\n'
+                        'Content-Length: {1}\r\n\r\n'
+                        .format(CONTENT_TYPE, len(body)))
+            else:
+                body = b''
+                head = 'HTTP/1.0 405 Method Not Allowed\r\n\r\n'
+            client.sendall(head.encode('ascii') + body)
+        except (OSError, socket.error):
+            pass
+        finally:
+            client.close()
+
+    def collect(self):
+        """ All metric families: the last sample, and the live metrics
+
+        :return: list of (name, type, help, samples) tuples
+        """
+        families = list(self.sample)
+        if self._daemon is not None:
+            families.extend(daemon_metrics(self._daemon))
+        for collector in self.collectors:
+            families.extend(collector())
+        return families
+
+    def render(self):
+        """ The metrics in the Prometheus text format
+
+        :return: str
+        """
+        return render(self.collect())
+
+
+def process_metrics():
+    """ Sample the metrics of this process
+
+    :return: list of (name, type, help, samples) tuples
+    """
+    families = []
+    stat = _read_stat()
+    status = _read_status()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    if stat is not None:
+        cpu = (int(stat[13]) + int(stat[14])) / ticks
+        minflt, majflt = int(stat[9]), int(stat[11])
+    else:
+        cpu = usage.ru_utime + usage.ru_stime
+        minflt, majflt = usage.ru_minflt, usage.ru_majflt
+    families.append(('process_cpu_seconds_total', 'counter',
+                     'User and system CPU time in seconds.', [({}, cpu)]))
+    if 'VmRSS' in status:
+        families.append(('process_resident_memory_bytes', 'gauge',
+                         'Resident memory size in bytes.',
+                         [({}, status['VmRSS'] * 1024)]))
+    if stat is not None:
+        families.append(('process_virtual_memory_bytes', 'gauge',
+                         'Virtual memory size in bytes.',
+                         [({}, int(stat[22]))]))
+        boot_time = _boot_time()
+        if boot_time is not None:
+            families.append(('process_start_time_seconds', 'gauge',
+                             'Start time of the process since the epoch.',
+                             [({}, boot_time + int(stat[21]) / ticks)]))
+    filenos = open_filenos()
+    if filenos is not None:
+        families.append(('process_open_fds', 'gauge',
+                         'Number of open file descriptors.',
+                         [({}, len(filenos))]))
+    families.append(('process_max_fds', 'gauge',
+                     'Maximum number of open file descriptors.',
+                     [({}, resource.getrlimit(resource.RLIMIT_NOFILE)[0])]))
+    families.append(('process_threads', 'gauge', 'Number of threads.',
+                     [({}, status.get('Threads',
+                                      threading.active_count()))]))
+    families.append(('process_context_switches_total', 'counter',
+                     'Context switches.', [
+                         ({'type': 'voluntary'}, status.get(
+                             'voluntary_ctxt_switches', usage.ru_nvcsw)),
+                         ({'type': 'involuntary'}, status.get(
+                             'nonvoluntary_ctxt_switches', usage.ru_nivcsw)),
+                     ]))
+    families.append(('process_page_faults_total', 'counter',
+                     'Page faults.', [({'type': 'minor'}, minflt),
+                                      ({'type': 'major'}, majflt)]))
+    return families
+
+
+def daemon_metrics(daemon):
+    """ The metrics of a DaemonContext
+
+    :param daemon: the daemon
+    :type daemon: pep3143daemon.DaemonContext
+
+    :return: list of (name, type, help, samples) tuples
+    """
+    families = [
+        ('daemon_signals_total', 'counter',
+         'Signals handled by the signal_map, by signal number.',
+         [({'signal': str(signal_number)}, count) for signal_number, count
+          in sorted(daemon.signal_counts.items())]),
+        ('daemon_generation', 'gauge',
+         'Number of re-execs this daemon descends from.',
+         [({}, daemon.handover.generation
+           if daemon.handover is not None else 0)]),
+    ]
+    if daemon.startup_report is not None:
+        families.append((
+            'daemon_startup_phase_seconds', 'gauge',
+            'Duration of the steps of DaemonContext.open().',
+            [({'phase': event.phase}, event.duration)
+             for event in daemon.startup_report]))
+    if daemon.executors:
+        stats = daemon.executor_stats()
+        families.append((
+            'daemon_executor_queued_tasks', 'gauge',
+            'Tasks waiting for a worker, by executor.',
+            [({'executor': name}, stats[name]['queued'])
+             for name in sorted(stats)]))
+        families.append((
+            'daemon_executor_tasks_total', 'counter',
+            'Finished tasks, by executor and result.',
+            [({'executor': name, 'result': result}, stats[name][result])
+             for name in sorted(stats)
+             for result in ('completed', 'failed', 'cancelled')]))
+    return families
+
+
+def render(families):
+    """ Format metric families in the Prometheus text format
+
+    :param families: list of (name, type, help, samples) tuples
+    :type families: list
+
+    :return: str
+    """
+    lines = []
+    for name, kind, text, samples in families:
+        lines.append('# HELP {0} {1}'.format(name, text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for labels, value in samples:
+            if labels:
+                label_text = ','.join(
+                    '{0}="{1}"'.format(key, _escape(labels[key]))
+                    for key in sorted(labels))
+                lines.append('{0}{{{1}}} {2}'.format(
+                    name, label_text, _format(value)))
+            else:
+                lines.append('{0} {1}'.format(name, _format(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    """ Escape a label value
+
+    :return: str
+    """
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def _format(value):
+    """ Format a sample value
+
+    :return: str
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _read_stat():
+    """ Read the fields of /proc/self/stat
+
+    The fields are split after the command name, which may contain
+    spaces, and shifted, so index n is field n + 1 of proc(5).
+
+    :return: list of str, or None if not available
+    """
+    try:
+        with open(PROC_STAT) as stat:
+            data = stat.read()
+    except (IOError, OSError):
+        return None
+    return ['', ''] + data[data.rindex(')') + 2:].split()
+
+
+def _read_status():
+    """ Read the numeric fields of /proc/self/status
+
+    :return: dict of int, values in kB for memory fields
+    """
+    result = {}
+    try:
+        with open(PROC_STATUS) as status:
+            for line in status:
+                name, _, value = line.partition(':')
+                fields = value.split()
+                if fields and fields[0].isdigit():
+                    result[name] = int(fields[0])
+    except (IOError, OSError):
+        pass
+    return result
+
+
+def _boot_time():
+    """ Boot time of the system, since the epoch
+
+    :return: int, or None if not available
+    """
+    try:
+        with open(PROC_SYSTEM_STAT) as stat:
+            for line in stat:
+                if line.startswith('btime '):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
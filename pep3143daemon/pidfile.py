@@ -7,8 +7,15 @@ __author__ = 'schlitzer'
 
 
 import atexit
+import errno
 import fcntl
 import os
+import select
+import time
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+PROC_LOCKS = '/proc/locks'
 
 
 class PidFile(object):
@@ -18,6 +25,10 @@ class PidFile(object):
     This Class can also be used with pythons 'with'
     statement.
 
+    Other processes, like control scripts, can use read_pid(),
+    is_locked() and wait_for_exit() on their own instance, to inspect
+    the daemon owning the pidfile.
+
     :param pidfile:
         filename to be used as pidfile, including path
     :type pidfile: str
@@ -28,6 +39,8 @@ class PidFile(object):
         Create a new instance
         """
         self._pidfile = pidfile
+        self._handed_over = False
+        self._adopted = False
         self.pidfile = None
 
     def __enter__(self):
@@ -59,24 +72,254 @@ class PidFile(object):
             fcntl.flock(pidfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
         except IOError:
             raise SystemExit('Already running according to ' + self._pidfile)
-        pidfile.seek(0)
-        pidfile.truncate()
-        pidfile.write(str(os.getpid()) + '\n')
-        pidfile.flush()
         self.pidfile = pidfile
+        self.write_pid()
         atexit.register(self.release)
 
+    def adopt(self, fileno):
+        """Adopt a pidfile locked by a previous process.
+
+        The descriptor has to refer to the pidfile, locked by the
+        process that handed it over. The lock is shared through the
+        descriptor, so taking it again succeeds. The release is
+        registered with atexit, but the pidfile still belongs to the
+        previous process: release() only closes it, and the pid is not
+        written, until take_over() is called, once this process is
+        ready. A process failing before that leaves the pidfile alone.
+
+        :param fileno: descriptor of the locked pidfile
+        :type fileno: int
+
+        :return: None
+        :raise: SystemExit
+        """
+        try:
+            pidfile = os.fdopen(fileno, "a")
+        except (IOError, OSError) as err:
+            raise SystemExit(err)
+        try:
+            fcntl.flock(pidfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            raise SystemExit('Could not adopt lock of ' + self._pidfile)
+        self.pidfile = pidfile
+        self._adopted = True
+        atexit.register(self.release)
+
+    def take_over(self):
+        """Take over an adopted pidfile.
+
+        Writes the pid of this process into the pidfile, and makes
+        release() delete it. Does nothing, unless the pidfile was
+        adopted and not taken over yet.
+
+        :return: None
+        """
+        if not self._adopted:
+            return
+        self.write_pid()
+        self._adopted = False
+
+    def write_pid(self):
+        """Write the pid of this process into the acquired pidfile.
+
+        :return: None
+        """
+        self.pidfile.seek(0)
+        self.pidfile.truncate()
+        self.pidfile.write(str(os.getpid()) + '\n')
+        self.pidfile.flush()
+
+    def fileno(self):
+        """Return the descriptor of the acquired pidfile.
+
+        :return: int, or None if the pidfile is not acquired
+        """
+        if self.pidfile is None or self.pidfile.closed:
+            return None
+        return self.pidfile.fileno()
+
+    def handover(self):
+        """Mark the pidfile as handed over to another process.
+
+        release() then only closes the pidfile, without deleting it,
+        because it belongs to the other process now.
+
+        :return: None
+        """
+        self._handed_over = True
+
     def release(self):
         """Release the pidfile.
 
-        Close and delete the Pidfile.
+        Close and delete the Pidfile. If the pidfile was handed over,
+        or adopted and not taken over, it is only closed.
 
 
         :return: None
         """
         try:
             self.pidfile.close()
+            if self._handed_over or self._adopted:
+                return
             os.remove(self._pidfile)
         except OSError as err:
             if err.errno != 2:
                 raise
+
+    def read_pid(self):
+        """Read the pid from the pidfile.
+
+        :return: int, or None if the pidfile is missing or empty
+        """
+        try:
+            with open(self._pidfile) as pidfile:
+                content = pidfile.read().strip()
+        except (IOError, OSError) as err:
+            if err.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            return int(content)
+        except ValueError:
+            return None
+
+    def is_locked(self):
+        """Check if a process holds the lock of the pidfile.
+
+        The lock is taken with flock(), which F_GETLK can not see. The
+        check looks the lock up in /proc/locks, so it never takes the
+        lock itself. Where /proc/locks is not available, a shared lock
+        is taken and released at once, which can make a concurrent
+        acquire() fail.
+
+        :return: bool
+        """
+        try:
+            stat = os.stat(self._pidfile)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                return False
+            raise
+        try:
+            return flock_held(stat.st_dev, stat.st_ino)
+        except (IOError, OSError):
+            pass
+        try:
+            pidfile = open(self._pidfile, "r")
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                return False
+            raise
+        try:
+            fcntl.flock(pidfile.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except IOError:
+            return True
+        finally:
+            pidfile.close()
+        return False
+
+    def wait_for_exit(self, timeout=None):
+        """Wait until the process owning the pidfile exits.
+
+        Where the kernel supports pidfd_open(), the wait is a single
+        poll() on the process file descriptor, which returns the moment
+        the process exits, and is not fooled by reused pids. Else the
+        lock of the pidfile is polled.
+
+        :param timeout: seconds to wait, or None to wait forever
+        :type timeout: float
+
+        :return: bool, True if the process exited, False on timeout
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        pid = self.read_pid()
+        if pid is None or not self.is_locked():
+            return True
+        pidfd = open_pidfd(pid)
+        if pidfd is not None:
+            try:
+                if not self.is_locked():
+                    return True
+                return wait_pidfd(pidfd, deadline)
+            finally:
+                os.close(pidfd)
+        delay = 0.001
+        while self.is_locked():
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        return True
+
+
+def flock_held(device, inode):
+    """Check /proc/locks for a flock() lock on a file.
+
+    :param device: st_dev of the file
+    :type device: int
+
+    :param inode: st_ino of the file
+    :type inode: int
+
+    :return: bool
+    :raise: IOError, if /proc/locks is not available
+    """
+    wanted = '{0:02x}:{1:02x}:{2}'.format(
+        os.major(device), os.minor(device), inode)
+    with open(PROC_LOCKS) as locks:
+        for line in locks:
+            fields = line.split()
+            if len(fields) < 6 or fields[1] == '->':
+                continue
+            if fields[1] == 'FLOCK' and fields[5] == wanted:
+                return True
+    return False
+
+
+def open_pidfd(pid):
+    """Open a process file descriptor.
+
+    :param pid: process id
+    :type pid: int
+
+    :return: int, or None if the kernel or Python do not support it,
+        or the process does not exist
+    """
+    if not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def wait_pidfd(pidfd, deadline):
+    """Wait until a process file descriptor becomes readable.
+
+    :param pidfd: process file descriptor
+    :type pidfd: int
+
+    :param deadline: monotonic deadline, or None to wait forever
+    :type deadline: float
+
+    :return: bool, True if the process exited
+    """
+    poller = select.poll()
+    poller.register(pidfd, select.POLLIN)
+    while True:
+        if deadline is None:
+            timeout = None
+        else:
+            timeout = max(deadline - monotonic(), 0) * 1000
+        try:
+            if poller.poll(timeout):
+                return True
+        except (OSError, select.error) as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            continue
+        if deadline is not None and monotonic() >= deadline:
+            return False
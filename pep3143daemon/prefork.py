@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-fork worker pool for a pep3143 daemon implementation.
+
+"""
+__author__ = 'schlitzer'
+
+
+import errno
+import fcntl
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from pep3143daemon import affinity
+from pep3143daemon.daemon import DaemonError
+from pep3143daemon.preload import memory_usage
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+SHUTDOWN_POLL_INTERVAL = 0.2
+"""Seconds between two checks for a shutdown requested by SIGTERM"""
+
+
+class PreforkPool(object):
+    """
+    Pre-fork worker pool, supervising the workers of a DaemonContext.
+
+    The listening sockets are bound by bind(), which should be called
+    while the process still has the privileges to do so. They are
+    added to the files_preserve list of the DaemonContext, so they
+    survive close_filenos.
+
+    start() daemonizes the process, forks the workers, reports the
+    daemon as ready, and supervises the workers. Workers that die are
+    respawned. The pool is grown by one worker on SIGTTIN, and shrunk
+    by one worker on SIGTTOU.
+
+    The supervisor stops all workers when it terminates, for example
+    because the SIGTERM handler of the DaemonContext raised SystemExit.
+    If the DaemonContext has a ShutdownCoordinator, SIGTERM only
+    requests the shutdown; the supervisor notices it within
+    SHUTDOWN_POLL_INTERVAL seconds, stops the workers, and start()
+    returns, leaving the drain to DaemonContext.close().
+
+    If the DaemonContext keeps a stats page, the pid and state of every
+    worker are recorded in the slot of the worker, and a worker counts
+    its requests with
+    daemon.stats_page.add_requests(slot=pool.worker_slot).
+
+    :param daemon:
+        DaemonContext instance, used to daemonize this process.
+    :type daemon: pep3143daemon.DaemonContext
+
+    :param worker:
+        Callable that is run in every worker process, with the list of
+        listening sockets as its only argument. The worker exits when
+        the callable returns.
+    :type worker: callable
+
+    :param workers:
+        Number of worker processes. If None, one per CPU.
+    :type workers: int
+
+    :param listen:
+        List of addresses to listen on. (host, port) tuples create
+        TCP sockets, strings create Unix domain sockets, socket objects
+        are used as they are. If empty, the sockets passed to the
+        DaemonContext by systemd socket activation are used.
+    :type listen: list
+
+    :param backlog:
+        Backlog passed to listen().
+    :type backlog: int
+
+    :param respawn_delay:
+        Workers dying within this number of seconds after their start
+        are respawned only after this delay, to avoid a fork loop.
+    :type respawn_delay: float
+
+    :param stop_timeout:
+        Seconds to wait for workers to exit after SIGTERM, before
+        they are killed.
+    :type stop_timeout: float
+
+    :param name:
+        Name of the listening sockets in DaemonContext.listen_sockets.
+    :type name: str
+
+    :param cpu_policy:
+        Bind every worker to its own slice of the CPUs of the daemon.
+        "core-per-worker" gives each worker cpus_per_worker CPUs of one
+        NUMA node, spreading consecutive workers over the nodes, and
+        "node-local" gives each worker all CPUs of one node. Slices are
+        reused round robin, if there are more workers than slices. If
+        None, workers inherit the affinity of the daemon.
+    :type cpu_policy: str
+
+    :param cpus_per_worker:
+        Size of the CPU slices of the "core-per-worker" policy.
+    :type cpus_per_worker: int
+
+    :param preload:
+        Preload stage, run after the daemon is opened and before the
+        first worker is forked.
+    :type preload: pep3143daemon.Preload
+    """
+
+    def __init__(self, daemon, worker, workers=None, listen=None,
+                 backlog=128, respawn_delay=1.0, stop_timeout=10.0,
+                 name='prefork', cpu_policy=None, cpus_per_worker=1,
+                 preload=None):
+        """
+        Create a new instance
+        """
+        self.daemon = daemon
+        self.worker = worker
+        self.workers = workers if workers else multiprocessing.cpu_count()
+        self.listen = listen if listen else []
+        self.backlog = backlog
+        self.respawn_delay = respawn_delay
+        self.stop_timeout = stop_timeout
+        self.name = name
+        self.cpu_policy = cpu_policy
+        self.cpus_per_worker = cpus_per_worker
+        self.cpu_slices = None
+        self.topology = None
+        self.preload = preload
+        self.sockets = None
+        self.children = {}
+        self.slots = {}
+        self.exits = 0
+        self.worker_slot = None
+        self._wakeup = None
+        self._spawn_after = 0
+
+    def bind(self):
+        """ Create the listening sockets
+
+        The sockets are added to the files_preserve list, and to the
+        listen_sockets of the DaemonContext under the name of the pool,
+        so DaemonContext.reexec() hands them over. If the DaemonContext
+        already has sockets of that name, because they were handed over,
+        they are used instead.
+
+        :return: list of sockets
+        :raise: DaemonError
+        """
+        if self.sockets is not None:
+            return self.sockets
+        listen_sockets = self.daemon.listen_sockets
+        if self.name in listen_sockets:
+            self.sockets = list(listen_sockets[self.name])
+            return self.sockets
+        if not self.listen and listen_sockets:
+            self.sockets = []
+            for sockets in listen_sockets.values():
+                self.sockets.extend(sockets)
+            return self.sockets
+        sockets = []
+        for address in self.listen:
+            try:
+                sockets.append(listen_socket(address, self.backlog))
+            except (OSError, socket.error) as err:
+                raise DaemonError('Could not listen on {0}: {1}'
+                                  .format(address, err))
+        files_preserve = list(self.daemon.files_preserve or [])
+        files_preserve.extend(sockets)
+        self.daemon.files_preserve = files_preserve
+        listen_sockets[self.name] = sockets
+        self.sockets = sockets
+        return sockets
+
+    def start(self):
+        """ Daemonize, start the workers, and supervise them
+
+        Returns when the supervisor is terminated, after all workers
+        have been stopped.
+
+        :return: None
+        :raise: DaemonError
+        """
+        self.bind()
+        if self.cpu_policy is not None:
+            self.topology = self.daemon.read_topology()
+        self.daemon.open()
+        metrics = getattr(self.daemon, 'metrics', None)
+        if metrics is not None:
+            metrics.add_collector(self.collect_metrics)
+        if self.preload is not None:
+            self.preload.run()
+        self._wakeup = os.pipe()
+        for fileno in self._wakeup:
+            set_nonblocking(fileno)
+        signal.signal(signal.SIGCHLD, self._handle_signal)
+        signal.signal(signal.SIGTTIN, self._handle_signal)
+        signal.signal(signal.SIGTTOU, self._handle_signal)
+        try:
+            self.manage()
+            self.daemon.ready()
+            self.supervise()
+        finally:
+            self.stop()
+
+    def supervise(self):
+        """ Supervise the workers until interrupted
+
+        Returns when the shutdown coordinator of the daemon, if any,
+        has a shutdown requested.
+
+        :return: None
+        """
+        shutdown = getattr(self.daemon, 'shutdown', None)
+        while shutdown is None or not shutdown.requested:
+            self.reap()
+            self.manage()
+            timeout = max(self._spawn_after - monotonic(), 0) or None
+            if shutdown is not None:
+                timeout = min(timeout or SHUTDOWN_POLL_INTERVAL,
+                              SHUTDOWN_POLL_INTERVAL)
+            self._wait(timeout)
+
+    def _wait(self, timeout):
+        """ Wait for a signal, and handle pool resizing
+
+        :param timeout: seconds to wait, or None
+        :type timeout: float
+
+        :return: None
+        """
+        try:
+            ready = select.select([self._wakeup[0]], [], [], timeout)[0]
+        except (OSError, select.error) as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+        if not ready:
+            return
+        try:
+            data = os.read(self._wakeup[0], 4096)
+        except OSError as err:
+            if err.errno != errno.EAGAIN:
+                raise
+            return
+        for signal_number in bytearray(data):
+            if signal_number == signal.SIGTTIN:
+                self.workers += 1
+            elif signal_number == signal.SIGTTOU:
+                self.workers = max(self.workers - 1, 0)
+
+    def _handle_signal(self, signal_number, stack_frame):
+        """ Wake up the supervisor loop
+
+        :return: None
+        """
+        try:
+            os.write(self._wakeup[1], bytearray([signal_number]))
+        except OSError:
+            pass
+
+    def manage(self):
+        """ Spawn or stop workers until their number matches workers
+
+        :return: None
+        """
+        while len(self.children) > self.workers:
+            pid = max(self.children)
+            self.kill_worker(pid, signal.SIGTERM)
+            self.children.pop(pid)
+        if monotonic() < self._spawn_after:
+            return
+        while len(self.children) < self.workers:
+            self.spawn_worker()
+
+    def reap(self):
+        """ Collect exited workers
+
+        :return: list of (pid, status) tuples
+        """
+        result = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno == errno.ECHILD:
+                    break
+                raise
+            if pid == 0:
+                break
+            started = self.children.pop(pid, None)
+            if started is not None:
+                self.exits += 1
+                self._worker_state(pid, 'exited')
+            if started is not None and \
+                    monotonic() - started < self.respawn_delay:
+                self._spawn_after = monotonic() + self.respawn_delay
+            result.append((pid, status))
+        return result
+
+    def spawn_worker(self):
+        """ Fork a new worker
+
+        :return: int, pid of the worker
+        :raise: DaemonError
+        """
+        self.slots = dict((pid, slot) for pid, slot in self.slots.items()
+                          if pid in self.children)
+        used = set(self.slots.values())
+        slot = min(set(range(len(self.children) + 1)) - used)
+        cpus = self.worker_cpus(slot)
+        try:
+            pid = self.daemon.fork_registry.fork(os.fork)
+        except OSError as err:
+            raise DaemonError('Forking worker failed: {0}'.format(err))
+        if pid > 0:
+            self.children[pid] = monotonic()
+            self.slots[pid] = slot
+            self._worker_state(pid, 'running')
+            return pid
+        self.worker_slot = slot
+        self._run_worker(cpus)
+
+    def _worker_state(self, pid, state):
+        """ Record the state of a worker in the stats page, if any
+
+        :param pid: process id of the worker
+        :type pid: int
+
+        :param state: worker state, see pep3143daemon.statspage
+        :type state: str
+
+        :return: None
+        """
+        stats_page = getattr(self.daemon, 'stats_page', None)
+        if stats_page is not None and pid in self.slots:
+            stats_page.set_worker(self.slots[pid], pid, state)
+
+    def worker_cpus(self, slot):
+        """ The CPUs of the worker in a slot
+
+        The slices are computed from the CPU affinity and topology of
+        the daemon, when the first worker is spawned. start() reads the
+        topology before the daemon is opened, and possibly chrooted.
+
+        :param slot: number of the worker, from 0 to workers - 1
+        :type slot: int
+
+        :return: list of CPU numbers, or None if there is no cpu_policy
+        :raise: DaemonError
+        """
+        if self.cpu_policy is None:
+            return None
+        if self.cpu_slices is None:
+            topology = self.topology
+            if topology is None:
+                topology = affinity.Topology.read()
+            try:
+                self.cpu_slices = topology.restrict(
+                    affinity.allowed_cpus()).worker_slices(
+                    self.cpu_policy, self.cpus_per_worker)
+            except ValueError as err:
+                raise DaemonError('Could not assign worker CPUs: {0}'
+                                  .format(err))
+        return self.cpu_slices[slot % len(self.cpu_slices)]
+
+    def _run_worker(self, cpus=None):
+        """ Run the worker callable in this process, and exit
+
+        :param cpus: CPUs to bind the worker to, or None
+        :type cpus: list
+
+        :return: None, never returns
+        """
+        status = 0
+        try:
+            if cpus is not None:
+                affinity.set_affinity(cpus)
+            if self.preload is not None:
+                self.preload.after_fork()
+            for signal_number in (signal.SIGTERM, signal.SIGCHLD,
+                                  signal.SIGTTIN, signal.SIGTTOU):
+                signal.signal(signal_number, signal.SIG_DFL)
+            if hasattr(signal, 'pthread_sigmask'):
+                signal.pthread_sigmask(signal.SIG_SETMASK, [])
+            for fileno in self._wakeup:
+                os.close(fileno)
+            self.worker(self.sockets)
+        except SystemExit as err:
+            status = err.code if isinstance(err.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
+    def collect_metrics(self):
+        """ Metrics of the pool, for a MetricsExporter
+
+        :return: list of (name, type, help, samples) tuples
+        """
+        return [
+            ('daemon_workers', 'gauge', 'Running worker processes.',
+             [({'pool': self.name}, len(self.children))]),
+            ('daemon_worker_exits_total', 'counter',
+             'Workers that exited, and were respawned.',
+             [({'pool': self.name}, self.exits)]),
+        ]
+
+    def memory_usage(self):
+        """ Shared and private memory of the supervisor and the workers
+
+        Used to measure how much memory the workers share with the
+        supervisor, for example with and without a preload stage.
+        Workers that exited meanwhile are left out.
+
+        :return: dict of pid to the dict returned by memory_usage()
+        """
+        result = {}
+        for pid in [os.getpid()] + sorted(self.children):
+            try:
+                result[pid] = memory_usage(pid)
+            except (IOError, OSError):
+                continue
+        return result
+
+    def kill_worker(self, pid, signal_number):
+        """ Send a signal to a worker, ignoring already exited workers
+
+        :return: None
+        """
+        try:
+            os.kill(pid, signal_number)
+        except OSError as err:
+            if err.errno != errno.ESRCH:
+                raise
+
+    def stop(self):
+        """ Stop all workers
+
+        The workers get SIGTERM, and SIGKILL if they are still running
+        after stop_timeout seconds.
+
+        :return: None
+        """
+        for pid in list(self.children):
+            self.kill_worker(pid, signal.SIGTERM)
+        deadline = monotonic() + self.stop_timeout
+        while self.children and monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in list(self.children):
+            self.kill_worker(pid, signal.SIGKILL)
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                break
+            self.children.pop(pid, None)
+        self.children.clear()
+
+
+def listen_socket(address, backlog):
+    """ Create a listening socket
+
+    :param address: (host, port) tuple, Unix socket path, or socket
+    :type address: tuple, str, socket.socket
+
+    :param backlog: backlog passed to listen()
+    :type backlog: int
+
+    :return: socket.socket
+    """
+    if isinstance(address, socket.socket):
+        return address
+    if isinstance(address, tuple):
+        family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.unlink(address)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+
+def set_nonblocking(fileno):
+    """ Put a file descriptor into non-blocking mode
+
+    :return: None
+    """
+    flags = fcntl.fcntl(fileno, fcntl.F_GETFL)
+    fcntl.fcntl(fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
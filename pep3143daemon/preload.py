@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Preloading of modules and files, before the chroot, and before worker
+processes are forked.
+
+"""
+__author__ = 'schlitzer'
+
+
+import codecs
+import gc
+import importlib
+import os
+import sys
+import time
+
+from pep3143daemon.daemon import DaemonError
+
+PROC_SMAPS_ROLLUP = '/proc/{0}/smaps_rollup'
+PROC_SMAPS = '/proc/{0}/smaps'
+
+SMAPS_FIELDS = {
+    'Rss': 'rss',
+    'Pss': 'pss',
+    'Shared_Clean': 'shared',
+    'Shared_Dirty': 'shared',
+    'Private_Clean': 'private',
+    'Private_Dirty': 'private',
+    'Swap': 'swap',
+}
+"""Fields of /proc/<pid>/smaps_rollup, and the key they are summed into"""
+
+
+class Preload(object):
+    """
+    Preload stage, run in the supervisor before the workers are forked.
+
+    Everything imported or created by the preload stage is shared
+    between the workers, as long as its memory pages are not written
+    to. Reference counting writes to the objects that are used, but the
+    cyclic garbage collector writes to the header of every tracked
+    object, in every worker, on every full collection. gc.freeze()
+    moves all objects existing at fork time into a permanent
+    generation, which the collector ignores, so their pages stay shared.
+
+    Passed as preload to PreforkPool, run() is called once, after the
+    daemon is opened and before the first worker is forked, and
+    after_fork() is called in every worker.
+
+    Example::
+
+        preload = Preload(
+            modules=['json', 'myapp.views'], warmup=[myapp.load_config],
+            gc_threshold=(50000, 20, 20))
+        pool = PreforkPool(daemon, worker, preload=preload)
+
+    :param modules:
+        Names of modules to import.
+    :type modules: list
+
+    :param warmup:
+        Callables without arguments, called after the imports, to fill
+        caches, compile templates, and the like.
+    :type warmup: list
+
+    :param freeze:
+        Run gc.collect() and gc.freeze() at the end of run(). Without
+        gc.freeze(), which needs Python 3.7, only gc.collect() is run.
+    :type freeze: bool
+
+    :param gc_threshold:
+        Tuple passed to gc.set_threshold() in the workers. A higher
+        first threshold makes collections, and the pages they dirty,
+        less frequent. If None, the thresholds are not changed.
+    :type gc_threshold: tuple
+    """
+
+    def __init__(self, modules=None, warmup=None, freeze=True,
+                 gc_threshold=None):
+        self.modules = list(modules or [])
+        self.warmup = list(warmup or [])
+        self.freeze = freeze
+        self.gc_threshold = gc_threshold
+        self.loaded = {}
+
+    def run(self):
+        """ Import the modules, call the warmup callables, and freeze
+
+        :return: None
+        :raise: DaemonError
+        """
+        for name in self.modules:
+            try:
+                self.loaded[name] = importlib.import_module(name)
+            except ImportError as err:
+                raise DaemonError('Could not preload module {0}: {1}'
+                                  .format(name, err))
+        for warmup in self.warmup:
+            warmup()
+        if self.freeze:
+            gc.collect()
+            if hasattr(gc, 'freeze'):
+                gc.freeze()
+
+    def after_fork(self):
+        """ Apply the gc thresholds in a worker
+
+        :return: None
+        """
+        if self.gc_threshold is not None:
+            gc.set_threshold(*self.gc_threshold)
+
+
+def memory_usage(pid='self'):
+    """ Shared and private memory of a process
+
+    Read from /proc/<pid>/smaps_rollup, or /proc/<pid>/smaps on kernels
+    older than 4.14. Linux only.
+
+    :param pid: process id, or 'self'
+    :type pid: int, str
+
+    :return: dict with rss, pss, shared, private and swap in bytes
+    :raise: OSError, IOError
+    """
+    path = PROC_SMAPS_ROLLUP.format(pid)
+    if not os.path.exists(path):
+        path = PROC_SMAPS.format(pid)
+    result = dict((key, 0) for key in SMAPS_FIELDS.values())
+    with open(path) as smaps:
+        for line in smaps:
+            fields = line.split()
+            if len(fields) != 3 or fields[2] != 'kB':
+                continue
+            key = SMAPS_FIELDS.get(fields[0].rstrip(':'))
+            if key is not None:
+                result[key] += int(fields[1]) * 1024
+    return result
+
+
+class PreloadManifest(object):
+    """
+    Modules, encodings and files loaded by DaemonContext.open(), before
+    the chroot.
+
+    After os.chroot() everything outside of the chroot directory is out
+    of reach: lazy imports, codec lookups, timezone and locale data, or
+    CA bundles read on first use fail, unless they were copied into the
+    chroot directory. Passed as preload_manifest to DaemonContext, the
+    manifest is worked through while the whole file system is still
+    visible, so the application finds everything it needs in memory.
+
+    With diagnose set, entries of the manifest that cannot be loaded
+    are recorded in missed instead of failing open(), and every import
+    that finds no module afterwards is recorded too, so running the
+    daemon once in diagnostic mode lists what the manifest lacks.
+
+    Example::
+
+        manifest = PreloadManifest(
+            modules=['json', 'email.mime.text'], encodings=['idna'],
+            files=['/etc/ssl/certs/ca-certificates.crt'])
+        daemon = DaemonContext(chroot_directory='/srv/jail',
+                               preload_manifest=manifest)
+        daemon.open()
+        ca_bundle = manifest.read('/etc/ssl/certs/ca-certificates.crt')
+
+    :param modules:
+        Names of modules to import.
+    :type modules: list
+
+    :param encodings:
+        Names of codecs to look up, which imports their encodings
+        module.
+    :type encodings: list
+
+    :param files:
+        Paths of files to read into memory, available from read()
+        afterwards.
+    :type files: list
+
+    :param timezone:
+        Load the local timezone from /etc/localtime and TZ, so
+        time.localtime() keeps working in the chroot.
+    :type timezone: bool
+
+    :param diagnose:
+        Record missing entries and later missed imports in missed,
+        instead of raising DaemonError.
+    :type diagnose: bool
+    """
+
+    def __init__(self, modules=None, encodings=None, files=None,
+                 timezone=True, diagnose=False):
+        self.modules = list(modules or [])
+        self.encodings = list(encodings or [])
+        self.paths = list(files or [])
+        self.timezone = timezone
+        self.diagnose = diagnose
+        self.files = {}
+        self.missed = []
+        self._recorder = None
+
+    def apply(self):
+        """ Load everything in the manifest
+
+        :return: None
+        :raise: DaemonError
+        """
+        for name in self.modules:
+            try:
+                importlib.import_module(name)
+            except ImportError as err:
+                self._miss('module', name, err)
+        for name in self.encodings:
+            try:
+                codecs.lookup(name)
+            except LookupError as err:
+                self._miss('encoding', name, err)
+        for path in self.paths:
+            try:
+                with open(path, 'rb') as handle:
+                    self.files[path] = handle.read()
+            except (IOError, OSError) as err:
+                self._miss('file', path, err)
+        if self.timezone and hasattr(time, 'tzset'):
+            time.tzset()
+            time.localtime()
+        if self.diagnose and self._recorder is None:
+            self._recorder = MissedImportRecorder(self)
+            sys.meta_path.append(self._recorder)
+
+    def read(self, path):
+        """ Content of a preloaded file
+
+        :param path: path, as given in files
+        :type path: str
+
+        :return: bytes
+        :raise: KeyError, if the file was not preloaded
+        """
+        return self.files[path]
+
+    def _miss(self, kind, name, err):
+        """ Record or raise a manifest entry that could not be loaded
+
+        :return: None
+        :raise: DaemonError, unless diagnose is set
+        """
+        if not self.diagnose:
+            raise DaemonError('Could not preload {0} {1}: {2}'
+                              .format(kind, name, err))
+        self.missed.append((kind, name))
+
+
+class MissedImportRecorder(object):
+    """
+    Import finder, appended to sys.meta_path, that records the imports
+    no other finder could satisfy in the missed list of a manifest.
+
+    :param manifest:
+        Manifest to record the missed imports in.
+    :type manifest: PreloadManifest
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    def find_spec(self, fullname, path=None, target=None):
+        """ Record fullname, and let the import fail
+
+        :return: None
+        """
+        self.manifest.missed.append(('module', fullname))
+        return None
+
+    def find_module(self, fullname, path=None):
+        """ Record fullname, and let the import fail, on Python 2
+
+        :return: None
+        """
+        return self.find_spec(fullname, path)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Sampling profiler of a running daemon, toggled by a signal.
+
+"""
+__author__ = 'schlitzer'
+
+
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from pep3143daemon.instrument import monotonic
+
+
+class SamplingProfiler(object):
+    """
+    Sample the stacks of all threads, started and stopped by a signal.
+
+    For daemons where no external profiler can be attached. The first
+    signal starts a thread, which takes a snapshot of the stacks of all
+    other threads, with sys._current_frames(), rate times a second. The
+    second signal stops it, and the thread writes the samples in the
+    collapsed stack format, one line per distinct stack with its count,
+    ready for flamegraph.pl or speedscope::
+
+        $ kill -USR2 $(cat /run/app.pid)    # start
+        $ kill -USR2 $(cat /run/app.pid)    # stop, and write the file
+
+    The file is named profile-<pid>-<time>.collapsed, and written to
+    directory, relative to the working directory of the daemon, so
+    inside a chroot if there is one. The daemon needs write access to
+    it. A summary with the number of samples and the measured overhead
+    is written to stderr.
+
+    The overhead is bounded: the time every sample takes is measured,
+    and the sampler sleeps long enough after it, that sampling takes at
+    most max_overhead of the wall time, lowering the rate if needed.
+    Sampling stops by itself after max_duration seconds.
+
+    Passed as profiler to DaemonContext, toggle() handles signal_number,
+    unless the signal_map has its own handler for it. Forked children,
+    like the workers of a PreforkPool, inherit the handler, and are
+    profiled on their own, when they get the signal.
+
+    :param signal_number:
+        Signal toggling the profiler.
+    :type signal_number: int
+
+    :param rate:
+        Samples per second.
+    :type rate: float
+
+    :param directory:
+        Directory of the profiles.
+    :type directory: str
+
+    :param max_overhead:
+        Fraction of the wall time the sampling may take.
+    :type max_overhead: float
+
+    :param max_duration:
+        Seconds after which sampling stops, or None.
+    :type max_duration: float
+    """
+
+    def __init__(self, signal_number=signal.SIGUSR2, rate=100.0,
+                 directory='.', max_overhead=0.02, max_duration=300.0):
+        """
+        Create a new instance
+        """
+        self.signal_number = signal_number
+        self.rate = rate
+        self.directory = directory
+        self.max_overhead = max_overhead
+        self.max_duration = max_duration
+        self.samples = {}
+        self.sample_count = 0
+        self.sample_time = 0.0
+        self.started = None
+        self.stopped = None
+        self.path = None
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        """ True while this process samples
+
+        :return: bool
+        """
+        return self._pid == os.getpid() and self._thread is not None and \
+            self._thread.is_alive()
+
+    def toggle(self, signal_number=None, stack_frame=None):
+        """ Start sampling, or stop it, if it is running
+
+        Usable as signal handler.
+
+        :return: None
+        """
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        """ Start the sampling thread
+
+        :return: None
+        """
+        if self.running:
+            return
+        self._pid = os.getpid()
+        self.samples = {}
+        self.sample_count = 0
+        self.sample_time = 0.0
+        self.started = monotonic()
+        self.stopped = None
+        self.path = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait=False):
+        """ Stop sampling; the sampling thread writes the profile
+
+        :param wait: wait until the profile is written
+        :type wait: bool
+
+        :return: None
+        """
+        self._stop.set()
+        if wait and self.running:
+            self._thread.join()
+
+    def close(self):
+        """ Stop sampling, and wait for the profile to be written
+
+        :return: None
+        """
+        self.stop(wait=True)
+
+    def _run(self):
+        """ Sample until stopped, then write the profile
+
+        :return: None
+        """
+        interval = 1.0 / self.rate
+        ident = threading.current_thread().ident
+        while True:
+            begin = monotonic()
+            self.sample(ident)
+            cost = monotonic() - begin
+            self.sample_time += cost
+            if self.max_duration is not None and \
+                    begin - self.started >= self.max_duration:
+                break
+            if self._stop.wait(max(interval - cost,
+                                   cost / self.max_overhead - cost)):
+                break
+        self.stopped = monotonic()
+        try:
+            self.path = self.write()
+        except (IOError, OSError):
+            traceback.print_exc()
+        sys.stderr.write('profiler: {0}\n'.format(self.summary()))
+        sys.stderr.flush()
+
+    def sample(self, skip=None):
+        """ Record the stacks of all threads once
+
+        :param skip: ident of a thread not to sample
+        :type skip: int
+
+        :return: None
+        """
+        names = dict((thread.ident, thread.name)
+                     for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{0} ({1}:{2})'.format(
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            key = ';'.join(part.replace(';', ':') for part in reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+        self.sample_count += 1
+
+    def collapsed(self):
+        """ The samples in the collapsed stack format
+
+        :return: str
+        """
+        return ''.join('{0} {1}\n'.format(stack, count)
+                       for stack, count in sorted(self.samples.items()))
+
+    def write(self):
+        """ Write the collapsed stacks to a new file in directory
+
+        :return: str, path of the file
+        """
+        path = os.path.join(self.directory, 'profile-{0}-{1}.collapsed'.format(
+            os.getpid(), time.strftime('%Y%m%d%H%M%S')))
+        with open(path, 'w') as profile:
+            profile.write(self.collapsed())
+        return path
+
+    def summary(self):
+        """ Number of samples, duration and overhead of the last run
+
+        overhead is the fraction of the wall time spent sampling.
+
+        :return: dict
+        """
+        if self.started is None:
+            duration = 0.0
+        else:
+            duration = (self.stopped or monotonic()) - self.started
+        return {
+            'path': self.path,
+            'samples': self.sample_count,
+            'duration': duration,
+            'sample_time': self.sample_time,
+            'overhead': self.sample_time / duration if duration else 0.0,
+        }
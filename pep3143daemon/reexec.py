@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Re-exec support for a pep3143 daemon implementation.
+
+A running daemon starts a new copy of itself, and passes its listening
+sockets, its pidfile and a readiness pipe to it. The sockets are passed
+like systemd socket activation does, so the new process finds them in
+DaemonContext.listen_sockets. The pidfile descriptor carries the lock,
+and the readiness pipe tells the old process when to exit.
+
+"""
+__author__ = 'schlitzer'
+
+
+import fcntl
+import os
+import sys
+
+from pep3143daemon.systemd import SD_LISTEN_FDS_START
+
+ENV_PIDFILE_FD = 'PEP3143_PIDFILE_FD'
+ENV_READY_FD = 'PEP3143_READY_FD'
+ENV_GENERATION = 'PEP3143_GENERATION'
+
+
+class Handover(object):
+    """
+    File descriptors handed over by the previous daemon process.
+
+    :param pidfile_fd:
+        descriptor of the locked pidfile, or None
+    :type pidfile_fd: int
+
+    :param ready_fd:
+        write end of the readiness pipe, or None
+    :type ready_fd: int
+
+    :param generation:
+        number of re-execs since the daemon was first started
+    :type generation: int
+    """
+
+    def __init__(self, pidfile_fd=None, ready_fd=None, generation=0):
+        """
+        Create a new instance
+        """
+        self.pidfile_fd = pidfile_fd
+        self.ready_fd = ready_fd
+        self.generation = generation
+
+    @classmethod
+    def from_environment(cls, unset_environment=True):
+        """ Create an instance from the environment set by spawn()
+
+        :param unset_environment:
+            Remove the variables from the environment, so they are not
+            inherited by child processes.
+        :type unset_environment: bool
+
+        :return: Handover, or None if this process was not re-executed
+        """
+        values = {}
+        for name in (ENV_PIDFILE_FD, ENV_READY_FD, ENV_GENERATION):
+            value = os.environ.get(name)
+            if unset_environment:
+                os.environ.pop(name, None)
+            try:
+                values[name] = int(value)
+            except (TypeError, ValueError):
+                values[name] = None
+        if values[ENV_GENERATION] is None:
+            return None
+        return cls(values[ENV_PIDFILE_FD], values[ENV_READY_FD],
+                   values[ENV_GENERATION])
+
+
+def command():
+    """ Return the command line that started this process
+
+    :return: list
+    """
+    argv = getattr(sys, 'orig_argv', None)
+    if argv:
+        return [sys.executable] + list(argv[1:])
+    return [sys.executable] + list(sys.argv)
+
+
+def spawn(listen_fds, pidfile_fd, ready_fd, generation, directory,
+          argv=None):
+    """ Fork and execute a new copy of this process
+
+    :param listen_fds: mapping of names to lists of file descriptors
+    :type listen_fds: dict
+
+    :param pidfile_fd: descriptor of the locked pidfile, or None
+    :type pidfile_fd: int
+
+    :param ready_fd: write end of the readiness pipe
+    :type ready_fd: int
+
+    :param generation: generation of the new process
+    :type generation: int
+
+    :param directory: working directory for the new process
+    :type directory: str
+
+    :param argv: command line, defaults to command()
+    :type argv: list
+
+    :return: int, pid of the new process
+    :raise: OSError
+    """
+    argv = argv if argv else command()
+    pid = os.fork()
+    if pid > 0:
+        return pid
+    try:
+        _exec(listen_fds, pidfile_fd, ready_fd, generation, directory, argv)
+    finally:
+        os._exit(127)
+
+
+def _exec(listen_fds, pidfile_fd, ready_fd, generation, directory, argv):
+    """ Arrange the file descriptors and environment, and exec argv
+
+    The listening sockets are moved to 3 and up, followed by the pidfile
+    and the readiness pipe. The standard streams are made inheritable,
+    redirect_stream() may have left them close-on-exec.
+
+    :return: None, never returns
+    """
+    names = []
+    filenos = []
+    for name in sorted(listen_fds):
+        for fileno in listen_fds[name]:
+            names.append(name)
+            filenos.append(fileno)
+    passed = list(filenos)
+    env = dict(os.environ)
+    for name, fileno in ((ENV_PIDFILE_FD, pidfile_fd),
+                         (ENV_READY_FD, ready_fd)):
+        if fileno is None:
+            env.pop(name, None)
+            continue
+        env[name] = str(SD_LISTEN_FDS_START + len(passed))
+        passed.append(fileno)
+    base = SD_LISTEN_FDS_START + len(passed)
+    moved = [fcntl.fcntl(fileno, fcntl.F_DUPFD_CLOEXEC, base)
+             for fileno in passed]
+    for index, fileno in enumerate(moved):
+        os.dup2(fileno, SD_LISTEN_FDS_START + index)
+    if filenos:
+        env['LISTEN_PID'] = str(os.getpid())
+        env['LISTEN_FDS'] = str(len(filenos))
+        env['LISTEN_FDNAMES'] = ':'.join(names)
+    else:
+        for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+            env.pop(name, None)
+    env[ENV_GENERATION] = str(generation)
+    for fileno in (0, 1, 2):
+        try:
+            os.set_inheritable(fileno, True)
+        except OSError:
+            pass
+    os.chdir(directory)
+    os.execve(argv[0], argv, env)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Resource limits and scheduling settings, applied while daemonizing.
+
+"""
+__author__ = 'schlitzer'
+
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+import os
+import platform
+import resource
+
+from pep3143daemon.daemon import DaemonError
+
+PROC_OOM_SCORE_ADJ = '/proc/self/oom_score_adj'
+
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+    's390x': 282,
+}
+"""ioprio_set(2) syscall numbers, by platform.machine()"""
+
+SCHED_POLICIES = ('other', 'batch', 'idle', 'fifo', 'rr')
+
+
+class ResourceProfile(object):
+    """
+    Declarative resource limits and scheduling settings for a daemon.
+
+    Passed as resource_profile to DaemonContext, open() applies it
+    before the chroot and the uid and gid change, so hard limits can be
+    raised, priorities raised and /proc is reachable. Only RLIMIT_NPROC
+    is applied after the forks, because it limits the processes of the
+    real user id, and a low limit could make the forks fail.
+
+    Example::
+
+        profile = ResourceProfile(
+            rlimits={'NOFILE': 'hard', 'MEMLOCK': (2 ** 26, 2 ** 26)},
+            nice=5, ionice=('best-effort', 7), oom_score_adj=-500,
+            sched_policy='batch')
+        daemon = DaemonContext(uid=1000, gid=1000, resource_profile=profile)
+
+    :param rlimits:
+        Mapping of limits, by name like 'NOFILE' or 'RLIMIT_NOFILE',
+        or by resource constant, to the new value: an int sets the soft
+        and hard limit, a (soft, hard) tuple sets both, 'hard' raises
+        the soft limit to the hard limit. resource.RLIM_INFINITY is
+        accepted in all places.
+    :type rlimits: dict
+
+    :param nice:
+        Absolute nice level, from -20 to 19.
+    :type nice: int
+
+    :param ionice:
+        I/O scheduling class and level, like ('best-effort', 4),
+        ('realtime', 0) or ('idle', 0). Linux only.
+    :type ionice: tuple
+
+    :param oom_score_adj:
+        Value for /proc/self/oom_score_adj, from -1000 to 1000. Linux
+        only.
+    :type oom_score_adj: int
+
+    :param sched_policy:
+        CPU scheduling policy, one of 'other', 'batch', 'idle', 'fifo'
+        or 'rr'.
+    :type sched_policy: str
+
+    :param sched_priority:
+        Static priority for the 'fifo' and 'rr' policies.
+    :type sched_priority: int
+    """
+
+    def __init__(
+            self, rlimits=None, nice=None, ionice=None, oom_score_adj=None,
+            sched_policy=None, sched_priority=0):
+        self.rlimits = {}
+        for name, value in (rlimits or {}).items():
+            self.rlimits[rlimit_number(name)] = value
+        self.nice = nice
+        if ionice is not None:
+            ioprio_class, level = ionice
+            if ioprio_class not in IOPRIO_CLASSES:
+                raise DaemonError('Unknown ionice class: {0}'.format(
+                    ioprio_class))
+            ionice = (ioprio_class, level)
+        self.ionice = ionice
+        self.oom_score_adj = oom_score_adj
+        if sched_policy is not None and sched_policy not in SCHED_POLICIES:
+            raise DaemonError('Unknown scheduling policy: {0}'.format(
+                sched_policy))
+        self.sched_policy = sched_policy
+        self.sched_priority = sched_priority
+
+    def apply(self):
+        """ Apply everything, except RLIMIT_NPROC
+
+        :return: None
+        :raise: DaemonError
+        """
+        for number, value in sorted(self.rlimits.items()):
+            if number != resource.RLIMIT_NPROC:
+                set_rlimit(number, value)
+        if self.oom_score_adj is not None:
+            set_oom_score_adj(self.oom_score_adj)
+        if self.sched_policy is not None:
+            set_sched_policy(self.sched_policy, self.sched_priority)
+        if self.nice is not None:
+            set_nice(self.nice)
+        if self.ionice is not None:
+            set_ionice(*self.ionice)
+
+    def apply_after_fork(self):
+        """ Apply RLIMIT_NPROC
+
+        :return: None
+        :raise: DaemonError
+        """
+        if resource.RLIMIT_NPROC in self.rlimits:
+            set_rlimit(resource.RLIMIT_NPROC,
+                       self.rlimits[resource.RLIMIT_NPROC])
+
+
+def rlimit_number(name):
+    """ Resolve the name of a resource limit
+
+    :param name: like 'NOFILE', 'RLIMIT_NOFILE', or a resource constant
+    :type name: str, int
+
+    :return: int
+    :raise: DaemonError
+    """
+    if isinstance(name, int):
+        return name
+    attribute = name.upper()
+    if not attribute.startswith('RLIMIT_'):
+        attribute = 'RLIMIT_' + attribute
+    number = getattr(resource, attribute, None)
+    if number is None:
+        raise DaemonError('Unknown resource limit: {0}'.format(name))
+    return number
+
+
+def rlimit_name(number):
+    """ Name a resource limit, for error messages
+
+    :param number: resource constant
+    :type number: int
+
+    :return: str
+    """
+    for attribute in dir(resource):
+        if attribute.startswith('RLIMIT_') and \
+                getattr(resource, attribute) == number:
+            return attribute
+    return str(number)
+
+
+def set_rlimit(number, value):
+    """ Set a resource limit
+
+    :param number: resource constant
+    :type number: int
+
+    :param value: int, (soft, hard) tuple, or 'hard'
+    :type value: int, tuple, str
+
+    :return: None
+    :raise: DaemonError
+    """
+    try:
+        if value == 'hard':
+            hard = resource.getrlimit(number)[1]
+            value = (hard, hard)
+        elif isinstance(value, int):
+            value = (value, value)
+        resource.setrlimit(number, tuple(value))
+    except (ValueError, OSError, resource.error) as err:
+        raise DaemonError('Could not set {0} to {1}: {2}'.format(
+            rlimit_name(number), value, err))
+
+
+def set_nice(nice):
+    """ Set the absolute nice level of this process
+
+    :param nice: nice level
+    :type nice: int
+
+    :return: None
+    :raise: DaemonError
+    """
+    try:
+        if hasattr(os, 'setpriority'):
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        else:
+            os.nice(nice - os.nice(0))
+    except OSError as err:
+        raise DaemonError('Could not set nice level to {0}: {1}'.format(
+            nice, err))
+
+
+def set_ionice(ioprio_class, level):
+    """ Set the I/O scheduling class and level of this process
+
+    Python has no binding for ioprio_set(2), so it is called through
+    ctypes.
+
+    :param ioprio_class: 'realtime', 'best-effort' or 'idle'
+    :type ioprio_class: str
+
+    :param level: priority inside the class, from 0 to 7
+    :type level: int
+
+    :return: None
+    :raise: DaemonError
+    """
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if ctypes is None or number is None:
+        raise DaemonError('Could not set ionice: not supported on {0}'
+                          .format(platform.machine()))
+    ioprio = IOPRIO_CLASSES[ioprio_class] << IOPRIO_CLASS_SHIFT | level
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+        err = ctypes.get_errno()
+        raise DaemonError('Could not set ionice to {0} {1}: {2}'.format(
+            ioprio_class, level, os.strerror(err)))
+
+
+def set_oom_score_adj(value):
+    """ Adjust the OOM killer score of this process
+
+    :param value: from -1000 to 1000
+    :type value: int
+
+    :return: None
+    :raise: DaemonError
+    """
+    try:
+        with open(PROC_OOM_SCORE_ADJ, 'w') as oom_score_adj:
+            oom_score_adj.write('{0}\n'.format(value))
+    except (IOError, OSError) as err:
+        raise DaemonError('Could not set oom_score_adj to {0}: {1}'.format(
+            value, err))
+
+
+def set_sched_policy(policy, priority=0):
+    """ Set the CPU scheduling policy of this process
+
+    :param policy: 'other', 'batch', 'idle', 'fifo' or 'rr'
+    :type policy: str
+
+    :param priority: static priority, for 'fifo' and 'rr'
+    :type priority: int
+
+    :return: None
+    :raise: DaemonError
+    """
+    constant = getattr(os, 'SCHED_' + policy.upper(), None)
+    if constant is None or not hasattr(os, 'sched_setscheduler'):
+        raise DaemonError('Could not set scheduling policy {0}: not '
+                          'supported'.format(policy))
+    try:
+        os.sched_setscheduler(0, constant, os.sched_param(priority))
+    except OSError as err:
+        raise DaemonError('Could not set scheduling policy {0}: {1}'.format(
+            policy, err))
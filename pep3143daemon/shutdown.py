@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Graceful drain and shutdown for a pep3143 daemon implementation.
+
+"""
+__author__ = 'schlitzer'
+
+
+import sys
+import threading
+import time
+import traceback
+
+from pep3143daemon.instrument import monotonic
+
+POLL_INTERVAL = 0.1
+"""Seconds between two checks of wait() for a requested shutdown"""
+
+
+class ShutdownCoordinator(object):
+    """
+    Turn SIGTERM into an orderly drain, instead of an immediate exit.
+
+    Passed as shutdown to DaemonContext, terminate() no longer raises
+    SystemExit, it calls request(), which sets the requested flag. The
+    application waits for it with wait(), or polls it, finishes its
+    main loop, and
+    calls DaemonContext.close(), or leaves the with block, which runs
+    the shutdown sequence:
+
+    1. stop_listeners(): the registered listeners, and the sockets in
+       DaemonContext.listen_sockets, stop accepting.
+    2. drain(): the drain callbacks are called one after another, with
+       the seconds left until the deadline, drain_timeout seconds after
+       the drain started, and should return when their work is done.
+    3. stop_executors(): the executors are shut down, and waited for
+       until the deadline.
+    4. escalate(): if the deadline passed, or a drain callback returned
+       False, the pending futures of the executors are cancelled and
+       the hard stop callbacks are called.
+
+    A second SIGTERM, while the shutdown is already requested, raises
+    SystemExit, to stop a daemon that does not drain.
+
+    request() runs in the signal handler, interrupting whatever the main
+    thread does, so it only sets a plain flag and takes no lock; a
+    threading.Event set there could deadlock against a wait() on it in
+    the same thread. wait() polls the flag instead, every POLL_INTERVAL
+    seconds.
+
+    Example::
+
+        shutdown = ShutdownCoordinator(drain_timeout=20)
+        shutdown.add_drain(server.finish_requests)
+        shutdown.add_executor(executor)
+        with DaemonContext(shutdown=shutdown):
+            server.start()
+            shutdown.wait()
+
+    :param drain_timeout:
+        Seconds the drain callbacks and executors get, together.
+    :type drain_timeout: float
+    """
+
+    def __init__(self, drain_timeout=30.0):
+        """
+        Create a new instance
+        """
+        self.drain_timeout = drain_timeout
+        self.listeners = []
+        self.drains = []
+        self.executors = []
+        self.hard_stops = []
+        self.requested = False
+        self.signal_number = None
+        self.deadline = None
+        self.expired = False
+
+    def add_listener(self, listener):
+        """ Register a listener, stopped first
+
+        :param listener: object with a close method, like a socket,
+            which is closed, or a callable, which is called
+        :type listener: socket.socket, callable
+
+        :return: None
+        """
+        self.listeners.append(listener)
+
+    def add_drain(self, callback):
+        """ Register a drain callback
+
+        The callback is called with the seconds left until the deadline,
+        and returns when its in-flight work is done. Returning False
+        reports that it gave up, which escalates to a hard stop.
+
+        :param callback: callable
+        :type callback: callable
+
+        :return: None
+        """
+        self.drains.append(callback)
+
+    def add_executor(self, executor):
+        """ Register an executor, shut down after the drain callbacks
+
+        :param executor: concurrent.futures executor, or any object
+            with a compatible shutdown method
+        :type executor: concurrent.futures.Executor
+
+        :return: None
+        """
+        self.executors.append(executor)
+
+    def add_hard_stop(self, callback):
+        """ Register a callback, called without arguments on escalation
+
+        :param callback: callable
+        :type callback: callable
+
+        :return: None
+        """
+        self.hard_stops.append(callback)
+
+    def request(self, signal_number=None):
+        """ Request the shutdown
+
+        Called by DaemonContext.terminate(), from the signal handler.
+        A second request raises SystemExit.
+
+        :param signal_number: signal that requested the shutdown
+        :type signal_number: int
+
+        :return: None
+        :raise: SystemExit
+        """
+        if self.requested:
+            raise SystemExit('Terminating on signal {0}'
+                             .format(signal_number))
+        self.signal_number = signal_number
+        self.requested = True
+
+    def wait(self, timeout=None):
+        """ Wait until the shutdown is requested
+
+        :param timeout: seconds to wait, or None
+        :type timeout: float
+
+        :return: bool, True if the shutdown was requested
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while not self.requested:
+            delay = POLL_INTERVAL
+            if deadline is not None:
+                delay = min(delay, deadline - monotonic())
+                if delay <= 0:
+                    return False
+            time.sleep(delay)
+        return True
+
+    def remaining(self):
+        """ Seconds left until the deadline
+
+        The deadline is set when the drain starts.
+
+        :return: float
+        """
+        if self.deadline is None:
+            self.deadline = monotonic() + self.drain_timeout
+        return max(self.deadline - monotonic(), 0.0)
+
+    def stop_listeners(self, sockets=None):
+        """ Stop accepting, by closing or calling the listeners
+
+        :param sockets: more sockets to close
+        :type sockets: list
+
+        :return: None
+        """
+        for listener in list(self.listeners) + list(sockets or []):
+            _call(listener.close if hasattr(listener, 'close') else listener)
+
+    def drain(self):
+        """ Call the drain callbacks, with the seconds left
+
+        :return: None
+        """
+        for callback in self.drains:
+            if _call(callback, self.remaining()) is False:
+                self.expired = True
+        if self.drains and self.remaining() <= 0:
+            self.expired = True
+
+    def stop_executors(self):
+        """ Shut the executors down, and wait for them until the deadline
+
+        :return: None
+        """
+        threads = []
+        for executor in self.executors:
+            thread = threading.Thread(
+                target=_call, args=(executor.shutdown, True),
+                name='shutdown-executor')
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join(self.remaining())
+            if thread.is_alive():
+                self.expired = True
+
+    def escalate(self):
+        """ Cancel pending work, and call the hard stop callbacks
+
+        Does nothing, unless the deadline passed or a drain callback
+        gave up.
+
+        :return: None
+        """
+        if not self.expired:
+            return
+        for executor in self.executors:
+            if sys.version_info >= (3, 9):
+                _call(executor.shutdown, False, cancel_futures=True)
+            else:
+                _call(executor.shutdown, False)
+        for callback in self.hard_stops:
+            _call(callback)
+
+
+def _call(func, *args, **kwargs):
+    """ Call func, reporting exceptions on stderr
+
+    :return: the return value of func, or None if it raised
+    """
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        traceback.print_exc()
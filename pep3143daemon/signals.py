@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Deferred signal dispatch for a pep3143 daemon implementation.
+
+"""
+__author__ = 'schlitzer'
+
+
+import errno
+import fcntl
+import os
+import signal
+import threading
+import traceback
+
+DISPATCH_MODES = ('thread', 'selector', 'manual')
+
+
+class SignalDispatcher(object):
+    """
+    Dispatch signals to their handlers at safe points.
+
+    Regular Python signal handlers run in the main thread, between any
+    two bytecodes, and a burst of signals runs them over and over. The
+    dispatcher only records the signals, and runs each pending handler
+    once, when it is asked to.
+
+    In "thread" mode, the signals are blocked, and a dispatcher thread
+    collects them with sigtimedwait(), the portable equivalent of
+    signalfd(2), and runs the handlers. A handler raising SystemExit
+    stops the dispatcher thread; the exception is re-raised by the next
+    dispatch_pending() call in another thread, and exit_requested is
+    set, so the main thread can wait on it. The mode has to be set up
+    before other threads are started, because they inherit the signal
+    mask.
+
+    In "selector" mode, a self-pipe is installed with
+    signal.set_wakeup_fd(). The application registers fileno() with the
+    selector it already polls, and calls dispatch_pending() when it is
+    readable. Only one wakeup fd exists per process, so this mode can
+    not be combined with asyncio.
+
+    In "manual" mode, the application calls dispatch_pending() whenever
+    it is safe to run the handlers.
+
+    :param handlers:
+        Mapping from signal number to handler. Handlers are called
+        like regular signal handlers, with the signal number and None
+        as frame.
+    :type handlers: dict
+
+    :param mode:
+        One of "thread", "selector" or "manual".
+    :type mode: str
+    """
+
+    def __init__(self, handlers, mode='manual'):
+        """
+        Create a new instance
+        """
+        if mode not in DISPATCH_MODES:
+            raise ValueError('Unknown signal dispatch mode: {0}'
+                             .format(mode))
+        self.handlers = dict(handlers)
+        self.mode = mode
+        self.exit_requested = threading.Event()
+        self._pending = {}
+        self._pipe = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._exit = None
+
+    def install(self):
+        """ Start recording the signals
+
+        Must be called from the main thread.
+
+        :return: None
+        """
+        signals = list(self.handlers)
+        if self.mode == 'thread':
+            signal.pthread_sigmask(signal.SIG_BLOCK, signals)
+            self._thread = threading.Thread(
+                target=self._thread_loop, name='signal dispatcher')
+            self._thread.daemon = True
+            self._thread.start()
+            return
+        if self.mode == 'selector':
+            self._pipe = os.pipe()
+            for fileno in self._pipe:
+                flags = fcntl.fcntl(fileno, fcntl.F_GETFL)
+                fcntl.fcntl(fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            signal.set_wakeup_fd(self._pipe[1])
+        for signal_number in signals:
+            signal.signal(signal_number, self._record)
+
+    def close(self):
+        """ Stop recording, and restore the default signal handling
+
+        Signals that arrive afterwards get their default action.
+
+        :return: None
+        """
+        signals = list(self.handlers)
+        if self.mode == 'thread':
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, signals)
+            return
+        for signal_number in signals:
+            signal.signal(signal_number, signal.SIG_DFL)
+        if self._pipe is not None:
+            signal.set_wakeup_fd(-1)
+            for fileno in self._pipe:
+                os.close(fileno)
+            self._pipe = None
+
+    def fileno(self):
+        """ Read end of the self-pipe, readable when signals are pending
+
+        Only available in "selector" mode.
+
+        :return: int
+        """
+        if self._pipe is None:
+            raise ValueError('fileno() needs selector mode')
+        return self._pipe[0]
+
+    @property
+    def pending(self):
+        """ The recorded, not yet dispatched signals, in order of arrival
+
+        :return: list
+        """
+        return list(self._pending)
+
+    def _record(self, signal_number, stack_frame):
+        """ Signal handler recording the signal
+
+        Repeated signals are coalesced, the order of the first
+        arrival is kept. No lock is taken, the handler may interrupt
+        dispatch_pending() in the same thread.
+
+        :return: None
+        """
+        self._pending[signal_number] = None
+
+    def dispatch_pending(self):
+        """ Run the handlers of all pending signals
+
+        :return: list, the dispatched signal numbers
+        :raise: SystemExit, if a handler in the dispatcher thread did
+        """
+        if self._exit is not None:
+            raise self._exit
+        if self._pipe is not None:
+            while True:
+                try:
+                    if not os.read(self._pipe[0], 4096):
+                        break
+                except OSError as err:
+                    if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    raise
+        pending, self._pending = self._pending, {}
+        for signal_number in pending:
+            self.handlers[signal_number](signal_number, None)
+        return list(pending)
+
+    def _thread_loop(self):
+        """ Collect blocked signals and dispatch them
+
+        :return: None
+        """
+        signals = set(self.handlers)
+        while not self._stop.is_set():
+            info = signal.sigtimedwait(signals, 0.2)
+            if info is None:
+                continue
+            while info is not None:
+                self._pending[info.si_signo] = None
+                info = signal.sigtimedwait(signals, 0)
+            try:
+                self.dispatch_pending()
+            except SystemExit as err:
+                self._exit = err
+                self.exit_requested.set()
+                return
+            except Exception:
+                traceback.print_exc()
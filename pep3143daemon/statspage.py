@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped stats page of a daemon, readable by external tools.
+
+"""
+__author__ = 'schlitzer'
+
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from pep3143daemon.daemon import DaemonError
+
+MAGIC = b'P3143STS'
+VERSION = 1
+
+STATES = ('unknown', 'starting', 'running', 'draining', 'stopping',
+          'stopped')
+"""Lifecycle states of the daemon"""
+
+WORKER_STATES = ('free', 'running', 'exited')
+"""States of a worker slot"""
+
+HEADER = struct.Struct('=8sIIiIII' 'dd' 'Q')
+"""magic, version, worker slots, pid, state, generation, padding,
+started, heartbeat, requests"""
+
+SIGNALS = 65
+"""Signal counters, indexed by signal number"""
+
+SIGNAL = struct.Struct('=Q')
+
+WORKER = struct.Struct('=iIQd')
+"""pid, state, requests, heartbeat"""
+
+OFFSET_PID = 16
+OFFSET_STATE = 20
+OFFSET_GENERATION = 24
+OFFSET_STARTED = 32
+OFFSET_HEARTBEAT = 40
+OFFSET_REQUESTS = 48
+OFFSET_SIGNALS = HEADER.size
+OFFSET_WORKERS = OFFSET_SIGNALS + SIGNALS * SIGNAL.size
+
+
+def page_size(workers):
+    """ Size of a stats page in bytes
+
+    :param workers: number of worker slots
+    :type workers: int
+
+    :return: int
+    """
+    return OFFSET_WORKERS + workers * WORKER.size
+
+
+class StatsPage(object):
+    """
+    Small file of fixed layout, mapped into the daemon, holding its
+    counters.
+
+    The daemon updates the counters in place, with plain stores into
+    the mapping, without a syscall or a lock. Monitoring tools map the
+    file read-only, see StatsReader, and never talk to the daemon.
+    Every field is written on its own, so a reader may see one field
+    updated and the next not yet, but never a partly written number
+    on the platforms Python runs on.
+
+    Passed as stats_page to DaemonContext, the page is created by
+    open() before the chroot and the uid and gid change, and owned by
+    the daemon uid and gid. open() sets the pid and the state, and
+    starts a heartbeat thread; ready(), terminate() and close() update
+    the state, and the signals handled by the signal_map are counted.
+    The mapping is shared with forked children, so the workers of a
+    PreforkPool update their own slot.
+
+    Counters with a single writer are updated without a lock: the
+    requests counter of the page belongs to the process that created
+    it, every worker slot to its worker.
+
+    :param path:
+        Path of the stats file, for example next to the pidfile.
+    :type path: str
+
+    :param workers:
+        Number of worker slots.
+    :type workers: int
+
+    :param heartbeat_interval:
+        Seconds between two heartbeats of the heartbeat thread. If None,
+        no thread is started, and the application calls heartbeat().
+    :type heartbeat_interval: float
+
+    :param mode:
+        Permissions of the stats file.
+    :type mode: int
+    """
+
+    def __init__(self, path, workers=64, heartbeat_interval=1.0,
+                 mode=0o644):
+        """
+        Create a new instance
+        """
+        self.path = path
+        self.workers = workers
+        self.heartbeat_interval = heartbeat_interval
+        self.mode = mode
+        self.map = None
+        self._inode = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def create(self, uid=None, gid=None):
+        """ Create and map the stats file
+
+        The file is written next to path, and renamed over it, so a
+        process mapping an older file, like the daemon a reexec()
+        replaces, keeps its own page.
+
+        :param uid: owner of the file, or None to keep it
+        :type uid: int
+
+        :param gid: group of the file, or None to keep it
+        :type gid: int
+
+        :return: None
+        :raise: DaemonError
+        """
+        temp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        try:
+            fileno = os.open(temp, os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                             self.mode)
+            try:
+                os.fchmod(fileno, self.mode)
+                if (uid, gid) != (os.getuid(), os.getgid()):
+                    os.fchown(fileno, -1 if uid is None else uid,
+                              -1 if gid is None else gid)
+                os.ftruncate(fileno, page_size(self.workers))
+                self.map = mmap.mmap(fileno, page_size(self.workers))
+                stat = os.fstat(fileno)
+                self._inode = (stat.st_dev, stat.st_ino)
+            finally:
+                os.close(fileno)
+            HEADER.pack_into(
+                self.map, 0, MAGIC, VERSION, self.workers, os.getpid(),
+                STATES.index('starting'), 0, 0, time.time(), time.time(), 0)
+            os.rename(temp, self.path)
+        except (IOError, OSError, mmap.error) as err:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise DaemonError('Could not create stats page {0}: {1}'
+                              .format(self.path, err))
+
+    def start(self, daemon):
+        """ Record the pid and generation, and start the heartbeat thread
+
+        Called by DaemonContext.open() after the forks.
+
+        :param daemon: the daemon
+        :type daemon: pep3143daemon.DaemonContext
+
+        :return: None
+        """
+        struct.pack_into('=i', self.map, OFFSET_PID, os.getpid())
+        if daemon.handover is not None:
+            struct.pack_into('=I', self.map, OFFSET_GENERATION,
+                             daemon.handover.generation)
+        self.heartbeat()
+        if self.heartbeat_interval is None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._heartbeat_loop, name='stats-heartbeat')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """ Set the state to stopped, unmap and remove the stats file
+
+        The file is only removed if it is still the one created by
+        create().
+
+        :return: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.map is None:
+            return
+        self.set_state('stopped')
+        self.map.close()
+        self.map = None
+        try:
+            stat = os.stat(self.path)
+            if (stat.st_dev, stat.st_ino) == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _heartbeat_loop(self):
+        """ Update the heartbeat, until close()
+
+        :return: None
+        """
+        while not self._stop.wait(self.heartbeat_interval):
+            self.heartbeat()
+
+    def set_state(self, state):
+        """ Set the lifecycle state
+
+        :param state: one of STATES
+        :type state: str
+
+        :return: None
+        """
+        struct.pack_into('=I', self.map, OFFSET_STATE, STATES.index(state))
+
+    def heartbeat(self, slot=None):
+        """ Store the current time as heartbeat
+
+        :param slot: worker slot, or None for the daemon
+        :type slot: int
+
+        :return: None
+        """
+        if slot is None:
+            struct.pack_into('=d', self.map, OFFSET_HEARTBEAT, time.time())
+        elif 0 <= slot < self.workers:
+            struct.pack_into('=d', self.map, _worker_offset(slot) + 16,
+                             time.time())
+
+    def add_requests(self, count=1, slot=None):
+        """ Count served requests
+
+        :param count: number of requests
+        :type count: int
+
+        :param slot: worker slot, or None for the daemon
+        :type slot: int
+
+        :return: None
+        """
+        if slot is None:
+            offset = OFFSET_REQUESTS
+        elif 0 <= slot < self.workers:
+            offset = _worker_offset(slot) + 8
+        else:
+            return
+        value = struct.unpack_from('=Q', self.map, offset)[0]
+        struct.pack_into('=Q', self.map, offset, value + count)
+
+    def signal_seen(self, signal_number):
+        """ Count a handled signal
+
+        :param signal_number: signal number
+        :type signal_number: int
+
+        :return: None
+        """
+        if 0 <= signal_number < SIGNALS:
+            offset = OFFSET_SIGNALS + signal_number * SIGNAL.size
+            value = SIGNAL.unpack_from(self.map, offset)[0]
+            SIGNAL.pack_into(self.map, offset, value + 1)
+
+    def set_worker(self, slot, pid, state):
+        """ Set the pid and state of a worker slot
+
+        Slots beyond the size of the page are ignored.
+
+        :param slot: worker slot
+        :type slot: int
+
+        :param pid: process id of the worker
+        :type pid: int
+
+        :param state: one of WORKER_STATES
+        :type state: str
+
+        :return: None
+        """
+        if 0 <= slot < self.workers:
+            struct.pack_into('=iI', self.map, _worker_offset(slot), pid,
+                             WORKER_STATES.index(state))
+
+
+class StatsReader(object):
+    """
+    Read-only view of the stats page of a daemon.
+
+    Keep an instance to poll the page repeatedly, read() only copies
+    the mapped memory. A daemon restarted with create() renames a new
+    file over the path; reopen() maps it.
+
+    :param path:
+        Path of the stats file.
+    :type path: str
+    """
+
+    def __init__(self, path):
+        """
+        Create a new instance
+        """
+        self.path = path
+        self.map = None
+        self.reopen()
+
+    def reopen(self):
+        """ Map the current stats file
+
+        :return: None
+        :raise: DaemonError
+        """
+        self.close()
+        try:
+            with open(self.path, 'rb') as stats:
+                self.map = mmap.mmap(stats.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError, mmap.error) as err:
+            raise DaemonError('Could not read stats page {0}: {1}'
+                              .format(self.path, err))
+        if len(self.map) < HEADER.size or \
+                HEADER.unpack_from(self.map, 0)[0] != MAGIC:
+            self.close()
+            raise DaemonError('Not a stats page: {0}'.format(self.path))
+
+    def close(self):
+        """ Unmap the stats file
+
+        :return: None
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def read(self):
+        """ Copy the counters
+
+        :return: dict
+        """
+        data = self.map[:]
+        (_, version, workers, pid, state, generation, _, started, heartbeat,
+         requests) = HEADER.unpack_from(data, 0)
+        workers = min(workers, (len(data) - OFFSET_WORKERS) // WORKER.size)
+        signals = {}
+        for signal_number in range(SIGNALS):
+            count = SIGNAL.unpack_from(
+                data, OFFSET_SIGNALS + signal_number * SIGNAL.size)[0]
+            if count:
+                signals[signal_number] = count
+        slots = []
+        for slot in range(workers):
+            worker_pid, worker_state, worker_requests, worker_heartbeat = \
+                WORKER.unpack_from(data, _worker_offset(slot))
+            if worker_state:
+                slots.append({
+                    'slot': slot,
+                    'pid': worker_pid,
+                    'state': _name(WORKER_STATES, worker_state),
+                    'requests': worker_requests,
+                    'heartbeat': worker_heartbeat,
+                })
+        return {
+            'version': version,
+            'pid': pid,
+            'state': _name(STATES, state),
+            'generation': generation,
+            'started': started,
+            'heartbeat': heartbeat,
+            'requests': requests + sum(worker['requests']
+                                       for worker in slots),
+            'signals': signals,
+            'workers': slots,
+        }
+
+
+def read_stats(path):
+    """ Read the stats page of a daemon once
+
+    :param path: path of the stats file
+    :type path: str
+
+    :return: dict, see StatsReader.read()
+    :raise: DaemonError
+    """
+    reader = StatsReader(path)
+    try:
+        return reader.read()
+    finally:
+        reader.close()
+
+
+def _worker_offset(slot):
+    """ Offset of a worker slot
+
+    :return: int
+    """
+    return OFFSET_WORKERS + slot * WORKER.size
+
+
+def _name(names, index):
+    """ Name of a state, tolerating unknown numbers
+
+    :return: str
+    """
+    return names[index] if index < len(names) else 'unknown'
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+systemd integration for a pep3143 daemon implementation.
+
+"""
+__author__ = 'schlitzer'
+
+
+import errno
+import fcntl
+import os
+import socket
+import threading
+import time
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+SD_LISTEN_FDS_START = 3
+"""First file descriptor passed by systemd socket activation"""
+
+LISTEN_ENVIRONMENT = ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES')
+"""Environment variables of systemd socket activation"""
+
+
+def listen_fds(unset_environment=True):
+    """ Collect the file descriptors passed by systemd socket activation
+
+    Implements sd_listen_fds_with_names(). The file descriptors are only
+    accepted if LISTEN_PID matches the pid of this process. They are
+    marked close-on-exec. Descriptors without a name in LISTEN_FDNAMES
+    are named "unknown".
+
+    :param unset_environment:
+        Remove LISTEN_PID, LISTEN_FDS and LISTEN_FDNAMES from the
+        environment, so they are not inherited by child processes.
+    :type unset_environment: bool
+
+    :return: dict, mapping names to lists of file descriptors
+    """
+    result = {}
+    try:
+        pid = int(os.environ.get('LISTEN_PID', ''))
+        count = int(os.environ.get('LISTEN_FDS', ''))
+    except ValueError:
+        return result
+    finally:
+        names = os.environ.get('LISTEN_FDNAMES')
+        if unset_environment:
+            unset_listen_environment()
+    if pid != os.getpid() or count <= 0:
+        return result
+    names = names.split(':') if names else []
+    for index in range(count):
+        fileno = SD_LISTEN_FDS_START + index
+        name = names[index] if index < len(names) else 'unknown'
+        flags = fcntl.fcntl(fileno, fcntl.F_GETFD)
+        fcntl.fcntl(fileno, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        result.setdefault(name, []).append(fileno)
+    return result
+
+
+def unset_listen_environment():
+    """ Remove the variables of socket activation from the environment
+
+    So they are not inherited by child processes.
+
+    :return: None
+    """
+    for name in LISTEN_ENVIRONMENT:
+        os.environ.pop(name, None)
+
+
+def listen_sockets(fds):
+    """ Create socket objects for passed file descriptors
+
+    File descriptors that are not sockets, like FIFOs, are left out.
+
+    :param fds: result of listen_fds()
+    :type fds: dict
+
+    :return: dict, mapping names to lists of socket.socket
+    """
+    result = {}
+    for name, filenos in fds.items():
+        for fileno in filenos:
+            try:
+                sock = socket.socket(fileno=fileno)
+            except (OSError, socket.error) as err:
+                if err.errno != errno.ENOTSOCK:
+                    raise
+                continue
+            result.setdefault(name, []).append(sock)
+    return result
+
+
+class Notifier(object):
+    """
+    Client for the systemd notification protocol, see sd_notify(3).
+
+    The datagram socket is connected when the instance is created, so
+    notifications can still be sent after a chroot, and the socket has
+    to be preserved while daemonizing.
+
+    :param address:
+        Address of the notification socket, as in NOTIFY_SOCKET.
+        Addresses starting with "@" are in the abstract namespace.
+    :type address: str
+
+    :param watchdog_usec:
+        Watchdog timeout in microseconds, as in WATCHDOG_USEC, or None.
+    :type watchdog_usec: int
+    """
+
+    def __init__(self, address, watchdog_usec=None):
+        """
+        Create a new instance
+        """
+        self.address = address
+        self.watchdog_usec = watchdog_usec
+        self._watchdog = None
+        self._watchdog_stop = threading.Event()
+        if address.startswith('@'):
+            address = '\0' + address[1:]
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.socket.connect(address)
+        except (OSError, socket.error):
+            self.socket.close()
+            raise
+
+    @classmethod
+    def from_environment(cls, unset_environment=False):
+        """ Create an instance from NOTIFY_SOCKET and WATCHDOG_USEC
+
+        The watchdog timeout is only used if WATCHDOG_PID is unset or
+        matches the pid of this process. Notifications are best effort,
+        so a socket that can not be connected, for example a stale
+        NOTIFY_SOCKET, is treated like an unset one.
+
+        :param unset_environment:
+            Remove the variables from the environment, so they are not
+            inherited by child processes.
+        :type unset_environment: bool
+
+        :return: Notifier, or None if NOTIFY_SOCKET is not set, or its
+            socket can not be connected
+        """
+        address = os.environ.get('NOTIFY_SOCKET')
+        watchdog_usec = os.environ.get('WATCHDOG_USEC')
+        watchdog_pid = os.environ.get('WATCHDOG_PID')
+        if unset_environment:
+            for name in ('NOTIFY_SOCKET', 'WATCHDOG_USEC', 'WATCHDOG_PID'):
+                os.environ.pop(name, None)
+        if not address:
+            return None
+        try:
+            watchdog_usec = int(watchdog_usec)
+            if watchdog_pid and int(watchdog_pid) != os.getpid():
+                watchdog_usec = None
+        except (TypeError, ValueError):
+            watchdog_usec = None
+        if watchdog_usec is not None and watchdog_usec <= 0:
+            watchdog_usec = None
+        try:
+            return cls(address, watchdog_usec)
+        except (OSError, socket.error):
+            return None
+
+    def fileno(self):
+        """ File descriptor of the notification socket
+
+        :return: int
+        """
+        return self.socket.fileno()
+
+    def notify(self, *states, **fields):
+        """ Send a notification
+
+        Each state is a "NAME=value" string, fields are sent as
+        NAME=value lines in addition.
+
+        :return: None
+        """
+        lines = list(states)
+        for name in sorted(fields):
+            lines.append('{0}={1}'.format(name, fields[name]))
+        self.socket.send('\n'.join(lines).encode('utf-8'))
+
+    def ready(self, status=None):
+        """ Tell the service manager that startup is finished
+
+        :param status: optional status text
+        :type status: str
+
+        :return: None
+        """
+        if status is None:
+            self.notify('READY=1')
+        else:
+            self.notify('READY=1', STATUS=status)
+
+    def status(self, status):
+        """ Send a free-form status text
+
+        :return: None
+        """
+        self.notify(STATUS=status)
+
+    def reloading(self):
+        """ Tell the service manager that the configuration is reloaded
+
+        Call ready() when reloading is finished.
+
+        :return: None
+        """
+        usec = int(monotonic() * 1000000)
+        self.notify('RELOADING=1', MONOTONIC_USEC=usec)
+
+    def stopping(self):
+        """ Tell the service manager that the service is shutting down
+
+        :return: None
+        """
+        self.notify('STOPPING=1')
+
+    def mainpid(self, pid=None):
+        """ Tell the service manager the pid of the main process
+
+        :param pid: pid of the main process, defaults to this process
+        :type pid: int
+
+        :return: None
+        """
+        self.notify(MAINPID=pid if pid is not None else os.getpid())
+
+    def watchdog(self):
+        """ Send a single watchdog keep-alive ping
+
+        :return: None
+        """
+        self.notify('WATCHDOG=1')
+
+    def start_watchdog(self):
+        """ Start a thread that pings the watchdog
+
+        Pings are sent every half watchdog timeout. Nothing is done if
+        no watchdog timeout is configured.
+
+        :return: None
+        """
+        if self.watchdog_usec is None or self._watchdog is not None:
+            return
+        self._watchdog_stop.clear()
+        self._watchdog = threading.Thread(
+            target=self._watchdog_loop, args=(self.watchdog_usec / 2e6,),
+            name='sd_notify watchdog')
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def stop_watchdog(self):
+        """ Stop the watchdog thread
+
+        :return: None
+        """
+        if self._watchdog is None:
+            return
+        self._watchdog_stop.set()
+        self._watchdog.join()
+        self._watchdog = None
+
+    def _watchdog_loop(self, interval):
+        while not self._watchdog_stop.is_set():
+            try:
+                self.watchdog()
+            except (OSError, socket.error):
+                pass
+            self._watchdog_stop.wait(interval)
@@ -8,6 +8,11 @@ setup(
     description='Implementation of PEP 3143, a unix daemon',
     long_description=pep3143daemon.__doc__,
     packages=['pep3143daemon'],
+    entry_points={
+        'console_scripts': [
+            'pep3143daemon = pep3143daemon.cli:main',
+        ],
+    },
     url='https://github.com/schlitzered/pep3143daemon',
     license='MIT',
     author='schlitzer',
@@ -0,0 +1,110 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import benchmark.open_latency
+import pep3143daemon.pidfile
+
+
+class TestDaemonContextIntegration(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def test_open_daemonizes_subprocess(self):
+        point = {'nofile': 1024, 'open_fds': 20, 'preserve': 5}
+        report = benchmark.open_latency.sample(point, self.directory)
+        self.assertEqual(report['open_fds'], 20)
+        for phase in benchmark.open_latency.PHASES:
+            self.assertIn(phase, report['phases'])
+            self.assertGreaterEqual(report['phases'][phase], 0)
+
+    def run_daemon(self, code):
+        script = (
+            'import sys, time\n'
+            'from pep3143daemon import DaemonContext, PidFile\n'
+            'daemon = DaemonContext(\n'
+            '    detach_process=True, wait_ready=True, ready_timeout=10,\n'
+            '    pidfile=PidFile(sys.argv[1]), working_directory=sys.argv[2])\n'
+            'daemon.open()\n' + code)
+        return subprocess.run(
+            [sys.executable, '-c', script,
+             os.path.join(self.directory, 'test.pid'), self.directory],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, timeout=30)
+
+    def test_wait_ready(self):
+        result = self.run_daemon(
+            'open("ready", "w").close()\n'
+            'daemon.ready()\n'
+            'time.sleep(0.5)\n')
+        self.assertEqual(result.returncode, 0)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'ready')))
+
+    def test_wait_ready_fail(self):
+        result = self.run_daemon('daemon.fail("port in use")\n')
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stderr, b'port in use\n')
+
+    def test_wait_ready_exit(self):
+        result = self.run_daemon('sys.exit(3)\n')
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stderr, b'Daemon exited before it was ready\n')
+
+    def test_wait_ready_open_error(self):
+        with pep3143daemon.pidfile.PidFile(os.path.join(self.directory, 'test.pid')):
+            result = self.run_daemon('daemon.ready()\n')
+        self.assertEqual(result.returncode, 1)
+        self.assertIn(b'Already running', result.stderr)
+
+    def test_signal_dispatch_thread_with_other_threads(self):
+        script = (
+            'import os, signal, sys, threading, time\n'
+            'from pep3143daemon import DaemonContext, StatsPage\n'
+            'class StartThread(object):\n'
+            '    def apply(self):\n'
+            '        thread = threading.Thread(target=threading.Event().wait)\n'
+            '        thread.daemon = True\n'
+            '        thread.start()\n'
+            'handled = threading.Event()\n'
+            'daemon = DaemonContext(\n'
+            '    detach_process=False, working_directory=sys.argv[1],\n'
+            '    signal_dispatch="thread", preload_manifest=StartThread(),\n'
+            '    stats_page=StatsPage(os.path.join(sys.argv[1], "app.stats")),\n'
+            '    signal_map={signal.SIGTERM: lambda n, f: handled.set()})\n'
+            'daemon.open()\n'
+            'for _ in range(20):\n'
+            '    os.kill(os.getpid(), signal.SIGTERM)\n'
+            '    time.sleep(0.01)\n'
+            'sys.exit(0 if handled.wait(5) else 2)\n')
+        result = subprocess.run(
+            [sys.executable, '-c', script, self.directory],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, timeout=30)
+        self.assertEqual(result.returncode, 0)
+
+    def test_signal_dispatch_selector(self):
+        script = (
+            'import os, select, signal, sys\n'
+            'from pep3143daemon import DaemonContext\n'
+            'handled = []\n'
+            'daemon = DaemonContext(\n'
+            '    detach_process=False, working_directory=sys.argv[1],\n'
+            '    signal_dispatch="selector",\n'
+            '    signal_map={signal.SIGUSR1: lambda n, f: handled.append(n)})\n'
+            'daemon.open()\n'
+            'os.kill(os.getpid(), signal.SIGUSR1)\n'
+            'readable = select.select(\n'
+            '    [daemon.signal_dispatcher.fileno()], [], [], 5)[0]\n'
+            'daemon.dispatch_pending()\n'
+            'sys.exit(0 if readable and handled == [signal.SIGUSR1] else 2)\n')
+        result = subprocess.run(
+            [sys.executable, '-c', script, self.directory],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, timeout=30)
+        self.assertEqual(result.returncode, 0, result.stderr)
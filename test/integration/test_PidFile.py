@@ -1,6 +1,9 @@
 __author__ = 'schlitzer'
 
 from unittest import TestCase
+import os
+import subprocess
+import sys
 import pep3143daemon.pidfile
 import _io
 
@@ -34,3 +37,58 @@ class TestPidFileIntegration(TestCase):
             self.assertEqual(pidfile.pidfile.name, self.pidfile)
             self.assertFalse(pidfile.pidfile.closed)
         self.assertTrue(pidfile.pidfile.closed)
+
+    def start_owner(self):
+        process = subprocess.Popen(
+            [sys.executable, '-c',
+             'import sys\n'
+             'from pep3143daemon import PidFile\n'
+             'PidFile(sys.argv[1]).acquire()\n'
+             'print("locked", flush=True)\n'
+             'sys.stdin.read()\n',
+             self.pidfile],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.stdin.close)
+        self.addCleanup(process.stdout.close)
+        self.assertEqual(process.stdout.readline(), b'locked\n')
+        return process
+
+    def test_status(self):
+        pidfile = pep3143daemon.pidfile.PidFile(self.pidfile)
+        self.assertIsNone(pidfile.read_pid())
+        self.assertFalse(pidfile.is_locked())
+        process = self.start_owner()
+        self.assertEqual(pidfile.read_pid(), process.pid)
+        self.assertTrue(pidfile.is_locked())
+        self.assertFalse(pidfile.wait_for_exit(0.05))
+        process.stdin.close()
+        self.assertTrue(pidfile.wait_for_exit(10))
+        self.assertFalse(pidfile.is_locked())
+
+    def adopt_in_child(self, code):
+        pidfile = pep3143daemon.pidfile.PidFile(self.pidfile)
+        pidfile.acquire()
+        self.addCleanup(pidfile.release)
+        fileno = pidfile.fileno()
+        script = (
+            'import sys\n'
+            'from pep3143daemon.pidfile import PidFile\n'
+            'pidfile = PidFile(sys.argv[1])\n'
+            'pidfile.adopt(int(sys.argv[2]))\n' + code)
+        subprocess.run(
+            [sys.executable, '-c', script, self.pidfile, str(fileno)],
+            pass_fds=(fileno,), timeout=30, check=False)
+        return pidfile
+
+    def test_adopt_exit_before_take_over(self):
+        pidfile = self.adopt_in_child('sys.exit(1)\n')
+        self.assertTrue(os.path.exists(self.pidfile))
+        self.assertEqual(pidfile.read_pid(), os.getpid())
+        self.assertTrue(pidfile.is_locked())
+
+    def test_adopt_take_over(self):
+        pidfile = self.adopt_in_child(
+            'pidfile.take_over()\n'
+            'pidfile.handover()\n')
+        self.assertNotEqual(pidfile.read_pid(), os.getpid())
@@ -0,0 +1,53 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pep3143daemon.pidfile
+
+SERVICE = '''
+import time
+
+
+def main():
+    while True:
+        time.sleep(1)
+'''
+
+
+class TestCliIntegration(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        with open(os.path.join(self.directory, 'service.py'), 'w') as service:
+            service.write(SERVICE)
+        self.pidfile = os.path.join(self.directory, 'service.pid')
+
+    def run_cli(self, *argv):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(pep3143daemon.__file__)),
+             env.get('PYTHONPATH', '')])
+        with open(os.devnull) as devnull:
+            return subprocess.call(
+                [sys.executable, '-m', 'pep3143daemon',
+                 '--pidfile', self.pidfile] + list(argv),
+                cwd=self.directory, stdin=devnull, env=env, timeout=30)
+
+    def test_start_status_stop(self):
+        self.addCleanup(self.run_cli, '--stop-timeout', '1', 'stop')
+        self.assertEqual(self.run_cli('status'), 3)
+        self.assertEqual(self.run_cli('start', 'service:main'), 0)
+        pidfile = pep3143daemon.pidfile.PidFile(self.pidfile)
+        self.assertTrue(pidfile.is_locked())
+        self.assertEqual(self.run_cli('status'), 0)
+        self.assertEqual(self.run_cli('reload'), 0)
+        self.assertFalse(pidfile.wait_for_exit(0.5))
+        self.assertEqual(self.run_cli('status'), 0)
+        self.assertEqual(self.run_cli('stop'), 0)
+        self.assertFalse(pidfile.is_locked())
+        self.assertFalse(os.path.exists(self.pidfile))
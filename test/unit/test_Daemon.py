@@ -7,7 +7,9 @@ except ImportError:
     from mock import Mock, MagicMock, call, patch
 
 import pep3143daemon.daemon
+import pep3143daemon.reexec
 import errno
+import os
 
 
 class LowLevelExit(SystemExit):
@@ -48,6 +50,14 @@ class TestDaemonContextUnit(TestCase):
         syspatcher = patch('pep3143daemon.daemon.sys', autospeck=False)
         self.sys_mock = syspatcher.start()
 
+        close_range_supportedpatcher = patch('pep3143daemon.daemon.close_range_supported', autospeck=True)
+        self.close_range_supported_mock = close_range_supportedpatcher.start()
+        self.close_range_supported_mock.return_value = False
+
+        open_filenospatcher = patch('pep3143daemon.daemon.open_filenos', autospeck=True)
+        self.open_filenos_mock = open_filenospatcher.start()
+        self.open_filenos_mock.return_value = None
+
         self.daemoncontext = pep3143daemon.daemon.DaemonContext()
 
         self.addCleanup(patch.stopall)
@@ -141,6 +151,37 @@ class TestDaemonContextUnit(TestCase):
         result = self.daemoncontext._files_preserve
         self.assertEqual(result, set((1, 2, 4, 15, 16)))
 
+    def test_exclude_filenos_listen_fds(self):
+        self.daemoncontext.files_preserve = [15]
+        self.daemoncontext.listen_fds = {'http': [3, 4], 'unknown': [5]}
+        result = self.daemoncontext._files_preserve
+        self.assertEqual(result, set((3, 4, 5, 15)))
+        self.assertEqual(self.daemoncontext.files_preserve, [15])
+
+# Test DaemonContext socket activation
+    def test___init__socket_activation(self):
+        with patch('pep3143daemon.daemon.systemd') as systemd_mock:
+            systemd_mock.listen_fds.return_value = {'http': [3]}
+            daemon = pep3143daemon.daemon.DaemonContext()
+        self.assertEqual(daemon.listen_fds, {'http': [3]})
+        systemd_mock.listen_fds.assert_called_once_with(
+            unset_environment=False)
+        systemd_mock.listen_sockets.assert_called_once_with({'http': [3]})
+        self.assertEqual(daemon.listen_sockets, systemd_mock.listen_sockets())
+
+    def test___init__socket_activation_disabled(self):
+        with patch('pep3143daemon.daemon.systemd') as systemd_mock:
+            daemon = pep3143daemon.daemon.DaemonContext(socket_activation=False)
+        self.assertFalse(systemd_mock.listen_fds.called)
+        self.assertEqual(daemon.listen_fds, {})
+
+    def test__setup_environment_unsets_listen_environment(self):
+        with patch('pep3143daemon.daemon.systemd') as systemd_mock:
+            self.daemoncontext._setup_environment()
+            self.daemoncontext.socket_activation = False
+            self.daemoncontext._setup_environment()
+        systemd_mock.unset_listen_environment.assert_called_once_with()
+
 # Test DaemonContext._get_signal_handler()
     def test__get_signal_handler_None(self):
         result = pep3143daemon.daemon.DaemonContext._get_signal_handler(
@@ -335,6 +376,456 @@ class TestDaemonContextUnit(TestCase):
             [call.acquire()]
         )
 
+    def test_open_startup_hook(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.pidfile = Mock()
+        self.daemoncontext.signal_map = {}
+        hook = Mock()
+        self.daemoncontext.startup_hook = hook
+
+        with patch('pep3143daemon.daemon.StartupReport') as report_mock:
+            self.daemoncontext.open()
+
+        report_mock.assert_called_once_with(hook)
+        self.assertEqual(self.daemoncontext.startup_report, report_mock())
+        phases = [item[0][0] for item in report_mock().run.call_args_list]
+        self.assertEqual(
+            phases,
+            ['environment', 'prevent_core', 'first_fork', 'second_fork',
+             'signals', 'close_filenos', 'redirect_streams', 'pidfile'])
+        self.assertTrue(self.daemoncontext.is_open)
+
+    def test_open_resource_profile(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        profile = Mock()
+        profile.apply.side_effect = lambda: self.assertFalse(self.os_mock.setuid.called)
+        profile.apply_after_fork.side_effect = lambda: self.assertEqual(
+            self.os_mock.fork.call_count, 2)
+        self.daemoncontext.resource_profile = profile
+        steps = [name for name, step in self.daemoncontext._open_steps()]
+        self.assertEqual(steps[0], 'resources')
+        self.assertEqual(steps[steps.index('second_fork') + 1],
+                         'resources_after_fork')
+        self.daemoncontext.open()
+        profile.apply.assert_called_once_with()
+        profile.apply_after_fork.assert_called_once_with()
+
+    def test_open_preload_manifest(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        self.daemoncontext.chroot_directory = '/srv/jail'
+        manifest = Mock()
+        manifest.apply.side_effect = lambda: self.assertFalse(self.os_mock.chroot.called)
+        self.daemoncontext.preload_manifest = manifest
+        steps = [name for name, step in self.daemoncontext._open_steps()]
+        self.assertEqual(steps[:2], ['preload', 'environment'])
+        self.daemoncontext.open()
+        manifest.apply.assert_called_once_with()
+        self.os_mock.chroot.assert_called_once_with('/srv/jail')
+
+    def test_open_fork_registry(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        self.daemoncontext.fork_registry = Mock()
+        self.daemoncontext.fork_registry.fork.side_effect = lambda fork: fork()
+        self.daemoncontext.open()
+        self.daemoncontext.fork_registry.fork.assert_has_calls(
+            [call(self.os_mock.fork), call(self.os_mock.fork)])
+        self.assertEqual(self.os_mock.fork.call_count, 2)
+
+    def test_open_control_socket(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        control = Mock()
+        control.fileno.return_value = 11
+        control.bind.side_effect = lambda uid, gid: self.assertFalse(
+            self.os_mock.setuid.called)
+        self.daemoncontext.control_socket = control
+        self.assertIn(11, self.daemoncontext._files_preserve)
+        steps = [name for name, step in self.daemoncontext._open_steps()]
+        self.assertEqual(steps[0], 'control_bind')
+        self.assertEqual(steps[-1], 'control_start')
+        self.daemoncontext.open()
+        control.bind.assert_called_once_with(12345, 54321)
+        control.start.assert_called_once_with(self.daemoncontext)
+
+    def test_open_metrics(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        metrics = Mock()
+        metrics.fileno.return_value = 12
+        self.daemoncontext.metrics = metrics
+        self.assertIn(12, self.daemoncontext._files_preserve)
+        steps = [name for name, step in self.daemoncontext._open_steps()]
+        self.assertEqual(steps[0], 'metrics_bind')
+        self.assertEqual(steps[-1], 'metrics_start')
+        self.daemoncontext.open()
+        metrics.bind.assert_called_once_with(12345, 54321)
+        metrics.start.assert_called_once_with(self.daemoncontext)
+
+    def test__signal_handler_map_counting(self):
+        handler = Mock(return_value='handled')
+        self.daemoncontext.signal_map = {10: handler}
+        self.daemoncontext.metrics = Mock()
+        counting = self.daemoncontext._signal_handler_map[10]
+        self.assertEqual(counting(10, None), 'handled')
+        counting(10, None)
+        handler.assert_called_with(10, None)
+        self.assertEqual(self.daemoncontext.signal_counts, {10: 2})
+
+    def test_open_stats_page(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        stats_page = Mock()
+        stats_page.create.side_effect = lambda uid, gid: self.assertFalse(
+            self.os_mock.setuid.called)
+        self.daemoncontext.stats_page = stats_page
+        steps = [name for name, step in self.daemoncontext._open_steps()]
+        self.assertEqual(steps[0], 'stats_page')
+        self.assertEqual(steps[-1], 'stats_page_start')
+        self.assertGreater(steps.index('stats_page_start'),
+                           steps.index('signals'))
+        self.daemoncontext.open()
+        stats_page.create.assert_called_once_with(12345, 54321)
+        stats_page.start.assert_called_once_with(self.daemoncontext)
+
+    def test_stats_page_state(self):
+        stats_page = self.daemoncontext.stats_page = Mock()
+        self.daemoncontext.ready()
+        stats_page.set_state.assert_called_once_with('running')
+        self.assertRaises(SystemExit, self.daemoncontext.terminate, 15, None)
+        stats_page.set_state.assert_called_with('stopping')
+        self.daemoncontext.shutdown = Mock()
+        self.daemoncontext.terminate(15, None)
+        stats_page.set_state.assert_called_with('draining')
+        self.daemoncontext._is_open = True
+        with patch('pep3143daemon.instrument.resource'):
+            self.daemoncontext.close()
+        stats_page.close.assert_called_once_with()
+
+    def test__signal_handler_map_stats_page(self):
+        handler = Mock()
+        self.daemoncontext.signal_map = {10: handler}
+        self.daemoncontext.stats_page = Mock()
+        self.daemoncontext._signal_handler_map[10](10, None)
+        handler.assert_called_once_with(10, None)
+        self.daemoncontext.stats_page.signal_seen.assert_called_once_with(10)
+
+    def test__signal_handler_map_profiler(self):
+        handler = Mock()
+        profiler = self.daemoncontext.profiler = Mock(signal_number=12)
+        self.daemoncontext.signal_map = {10: handler}
+        self.assertEqual(self.daemoncontext._signal_handler_map,
+                         {10: handler, 12: profiler.toggle})
+        self.assertEqual(self.daemoncontext.signal_map, {10: handler})
+        self.daemoncontext.signal_map = {12: handler}
+        self.assertEqual(self.daemoncontext._signal_handler_map,
+                         {12: handler})
+
+    def test_close_profiler(self):
+        self.daemoncontext._is_open = True
+        self.daemoncontext.profiler = Mock()
+        with patch('pep3143daemon.instrument.resource'):
+            self.daemoncontext.close()
+        self.daemoncontext.profiler.close.assert_called_once_with()
+        self.assertEqual(
+            [event.phase for event in self.daemoncontext.shutdown_report],
+            ['profiler'])
+
+    def test_open_cpu_affinity(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        self.daemoncontext.cpu_affinity = 'node:1'
+        steps = [name for name, step in self.daemoncontext._open_steps()]
+        self.assertEqual(steps[steps.index('second_fork') + 1], 'affinity')
+        self.assertLess(steps.index('topology'), steps.index('environment'))
+        with patch('pep3143daemon.daemon.affinity') as affinity_mock:
+            affinity_mock.Topology.read.return_value.resolve.return_value = [2, 3]
+            self.daemoncontext.open()
+        affinity_mock.Topology.read.assert_called_once_with()
+        affinity_mock.Topology.read.return_value.resolve.assert_called_once_with('node:1')
+        affinity_mock.set_affinity.assert_called_once_with([2, 3])
+
+    def test_open_cpu_affinity_error(self):
+        self.daemoncontext.cpu_affinity = 'node:7'
+        with patch('pep3143daemon.daemon.affinity') as affinity_mock:
+            affinity_mock.Topology.read.return_value.resolve.side_effect = ValueError('nope')
+            self.assertRaises(pep3143daemon.daemon.DaemonError, self.daemoncontext._set_affinity)
+        self.assertFalse(affinity_mock.set_affinity.called)
+
+    def test_open_notify(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        self.daemoncontext.notifier = Mock()
+        self.daemoncontext.notifier.fileno.return_value = 9
+
+        self.assertIn(9, self.daemoncontext._files_preserve)
+        self.daemoncontext.open()
+
+        self.daemoncontext.notifier.mainpid.assert_called_once_with()
+        self.daemoncontext.notifier.start_watchdog.assert_called_once_with()
+
+    def test_ready(self):
+        self.daemoncontext.notifier = Mock()
+        self.daemoncontext.ready('serving')
+        self.daemoncontext.notifier.ready.assert_called_once_with('serving')
+
+    def test_terminate(self):
+        self.daemoncontext.notifier = Mock()
+        self.assertRaises(SystemExit, self.daemoncontext.terminate, 15, None)
+        self.daemoncontext.notifier.stopping.assert_called_once_with()
+
+    def test_terminate_shutdown(self):
+        self.daemoncontext.notifier = Mock()
+        self.daemoncontext.shutdown = Mock()
+        self.daemoncontext.terminate(15, None)
+        self.daemoncontext.notifier.stopping.assert_called_once_with()
+        self.daemoncontext.shutdown.request.assert_called_once_with(15)
+
+    def test_close(self):
+        self.daemoncontext._is_open = True
+        self.daemoncontext.notifier = Mock()
+        self.daemoncontext.pidfile = Mock()
+        sock = Mock()
+        self.daemoncontext.listen_sockets = {'http': [sock]}
+        shutdown = self.daemoncontext.shutdown = Mock()
+        shutdown.drain.side_effect = lambda: self.assertFalse(
+            self.daemoncontext.pidfile.release.called)
+        with patch('pep3143daemon.instrument.resource'):
+            self.daemoncontext.close()
+        self.assertFalse(self.daemoncontext.is_open)
+        self.assertEqual(
+            [event.phase for event in self.daemoncontext.shutdown_report],
+            ['stop_listeners', 'drain', 'executors', 'escalate', 'notify',
+             'pidfile'])
+        shutdown.stop_listeners.assert_called_once_with([sock])
+        shutdown.escalate.assert_called_once_with()
+        self.daemoncontext.notifier.stop_watchdog.assert_called_once_with()
+        self.daemoncontext.pidfile.release.assert_called_once_with()
+
+    def test_close_executors(self):
+        self.daemoncontext._is_open = True
+        self.daemoncontext.configure_executors({'io': 2})
+        self.daemoncontext.executors['io'] = Mock()
+        with patch('pep3143daemon.instrument.resource'):
+            self.daemoncontext.close()
+        self.daemoncontext.executors['io'].shutdown.assert_called_once_with(wait=True)
+        self.assertEqual(
+            [event.phase for event in self.daemoncontext.shutdown_report],
+            ['executors'])
+
+    def test_configure_executors(self):
+        self.daemoncontext.shutdown = Mock()
+        self.daemoncontext.configure_executors(
+            {'io': 2, 'cpu': {'max_workers': 1, 'kind': 'process'}})
+        io = self.daemoncontext.executor('io')
+        self.assertEqual((io.name, io.max_workers, io.kind), ('io', 2, 'thread'))
+        self.assertEqual(self.daemoncontext.executor('cpu').kind, 'process')
+        self.assertEqual(self.daemoncontext.shutdown.add_executor.call_count, 2)
+        self.daemoncontext.configure_executors({'io': 8})
+        self.assertIs(self.daemoncontext.executor('io'), io)
+        self.assertEqual(io.max_workers, 8)
+        self.assertEqual(sorted(self.daemoncontext.executor_stats()), ['cpu', 'io'])
+        self.assertRaises(pep3143daemon.daemon.DaemonError,
+                          self.daemoncontext.executor, 'missing')
+
+    def test_close_not_open(self):
+        self.daemoncontext.pidfile = Mock()
+        self.daemoncontext.close()
+        self.assertIsNone(self.daemoncontext.shutdown_report)
+        self.assertFalse(self.daemoncontext.pidfile.release.called)
+
+    def test_reopen_streams(self):
+        log = Mock()
+        self.daemoncontext.stdout = log
+        self.daemoncontext.stderr = log
+        with patch('pep3143daemon.daemon.reopen_stream') as reopen_stream_mock:
+            self.daemoncontext.reopen_streams(10, None)
+        reopen_stream_mock.assert_called_once_with(self.sys_mock.stdout, log)
+
+    def test_reopen_streams_error(self):
+        self.daemoncontext.stdout = Mock()
+        self.daemoncontext.stderr = Mock()
+        with patch('pep3143daemon.daemon.reopen_stream') as reopen_stream_mock:
+            reopen_stream_mock.side_effect = pep3143daemon.DaemonError('denied')
+            self.daemoncontext.reopen_streams(10, None)
+        self.assertEqual(reopen_stream_mock.call_count, 2)
+        self.sys_mock.stderr.write.assert_called_with('denied\n')
+
+    def test_open_wait_ready_parent(self):
+        self.os_mock.fork = MagicMock(return_value=123)
+        self.os_mock.pipe.return_value = (5, 6)
+        self.os_mock._exit.side_effect = LowLevelExit
+        self.daemoncontext.wait_ready = True
+        self.daemoncontext.ready_timeout = 10
+
+        with patch('pep3143daemon.daemon.wait_ready') as wait_ready_mock:
+            wait_ready_mock.return_value = 1
+            self.assertRaises(LowLevelExit, self.daemoncontext.open)
+
+        self.os_mock.close.assert_called_once_with(6)
+        wait_ready_mock.assert_called_once_with(5, 10)
+        self.os_mock._exit.assert_called_once_with(1)
+
+    def test_open_wait_ready_child(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.os_mock.pipe.return_value = (5, 6)
+        self.daemoncontext.wait_ready = True
+        self.daemoncontext.signal_map = {}
+
+        self.daemoncontext.open()
+
+        self.assertEqual(self.daemoncontext._ready_fd, 6)
+        self.assertIn(6, self.daemoncontext._files_preserve)
+        self.assertEqual(self.os_mock.close.call_args_list[0], call(5))
+
+    def test_open_wait_ready_error(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.os_mock.pipe.return_value = (5, 6)
+        self.os_mock.write.side_effect = lambda fileno, data: len(data)
+        self.daemoncontext.wait_ready = True
+        self.daemoncontext.signal_map = {}
+        self.daemoncontext.pidfile = Mock()
+        self.daemoncontext.pidfile.acquire.side_effect = SystemExit('Already running')
+
+        self.assertRaises(SystemExit, self.daemoncontext.open)
+
+        self.os_mock.write.assert_called_once_with(6, b'FAlready running\n')
+        self.os_mock.close.assert_called_with(6)
+        self.assertIsNone(self.daemoncontext._ready_fd)
+        self.assertFalse(self.daemoncontext.is_open)
+
+    def test_ready_wait_ready(self):
+        self.os_mock.write.side_effect = lambda fileno, data: len(data)
+        self.daemoncontext._ready_fd = 6
+        self.daemoncontext.ready()
+        self.os_mock.write.assert_called_once_with(6, b'R')
+        self.os_mock.close.assert_called_once_with(6)
+        self.daemoncontext.ready()
+        self.assertEqual(self.os_mock.write.call_count, 1)
+
+    def test_fail(self):
+        self.os_mock.write.side_effect = lambda fileno, data: len(data)
+        self.daemoncontext._ready_fd = 6
+        self.daemoncontext.fail('bad\nconfig')
+        self.os_mock.write.assert_called_once_with(6, b'Fbad config\n')
+
+    def test_fail_no_wait_ready(self):
+        self.daemoncontext.fail('bad config')
+        self.assertFalse(self.os_mock.write.called)
+
+    def test_open_handover_pidfile(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+        self.daemoncontext.pidfile = Mock()
+        self.daemoncontext.handover = pep3143daemon.reexec.Handover(5, 6, 1)
+        self.daemoncontext._ready_fd = 6
+
+        self.assertTrue(set((5, 6)) <= self.daemoncontext._files_preserve)
+        self.daemoncontext.open()
+
+        self.daemoncontext.pidfile.adopt.assert_called_once_with(5)
+        self.assertFalse(self.daemoncontext.pidfile.acquire.called)
+        self.assertFalse(self.daemoncontext.pidfile.take_over.called)
+        self.daemoncontext.ready()
+        self.daemoncontext.pidfile.take_over.assert_called_once_with()
+
+    def test_reexec(self):
+        self.os_mock.pipe.return_value = (5, 6)
+        self.daemoncontext.pidfile = Mock()
+        self.daemoncontext.pidfile.fileno.return_value = 8
+        sock = Mock()
+        sock.fileno.return_value = 7
+        self.daemoncontext.listen_sockets = {'http': [sock]}
+        self.daemoncontext._launch_directory = '/srv'
+
+        with patch('pep3143daemon.daemon._reexec') as reexec_mock, \
+                patch('pep3143daemon.daemon.threading') as threading_mock:
+            reexec_mock.spawn.return_value = 1234
+            self.daemoncontext.reexec(12, None)
+            self.daemoncontext.reexec(12, None)
+
+        reexec_mock.spawn.assert_called_once_with({'http': [7]}, 8, 6, 1, '/srv')
+        self.os_mock.close.assert_called_once_with(6)
+        threading_mock.Thread.assert_called_once_with(
+            target=self.daemoncontext._wait_reexec, args=(5,), name='reexec')
+        threading_mock.Thread().start.assert_called_once_with()
+        self.assertEqual(self.daemoncontext._reexec_pid, 1234)
+
+    def test__wait_reexec_ready(self):
+        self.daemoncontext.pidfile = Mock()
+        self.daemoncontext._reexec_pid = 1234
+        self.os_mock.getpid.return_value = 4711
+
+        with patch('pep3143daemon.daemon.wait_ready') as wait_ready_mock:
+            wait_ready_mock.return_value = 0
+            self.daemoncontext._wait_reexec(5)
+
+        self.daemoncontext.pidfile.handover.assert_called_once_with()
+        self.assertFalse(self.daemoncontext.pidfile.write_pid.called)
+        self.os_mock.kill.assert_called_once_with(4711, self.signal_mock.SIGTERM)
+        self.os_mock.waitpid.assert_called_once_with(1234, 0)
+        self.assertIsNone(self.daemoncontext._reexec_pid)
+
+    def test__wait_reexec_failed(self):
+        self.daemoncontext.pidfile = Mock()
+        self.daemoncontext._reexec_pid = 1234
+
+        with patch('pep3143daemon.daemon.wait_ready') as wait_ready_mock:
+            wait_ready_mock.return_value = 1
+            self.daemoncontext._wait_reexec(5)
+
+        self.assertFalse(self.daemoncontext.pidfile.handover.called)
+        self.os_mock.kill.assert_called_once_with(1234, self.signal_mock.SIGTERM)
+        self.assertIsNone(self.daemoncontext._reexec_pid)
+        self.daemoncontext.pidfile.write_pid.assert_called_once_with()
+
+    def test_open_signal_dispatch(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        handler = Mock()
+        self.signal_mock.SIG_IGN = 1
+        self.daemoncontext.signal_map = {
+            self.signal_mock.SIGTSTP: None,
+            self.signal_mock.SIGHUP: handler}
+        self.daemoncontext.signal_dispatch = 'manual'
+
+        with patch('pep3143daemon.daemon.SignalDispatcher') as dispatcher_mock:
+            self.daemoncontext.open()
+            self.daemoncontext.dispatch_pending()
+
+        self.signal_mock.signal.assert_called_once_with(self.signal_mock.SIGTSTP, 1)
+        dispatcher_mock.assert_called_once_with({self.signal_mock.SIGHUP: handler}, 'manual')
+        dispatcher_mock().install.assert_called_once_with()
+        dispatcher_mock().dispatch_pending.assert_called_once_with()
+
+    def test_open_signal_dispatch_thread_blocks_first(self):
+        handler = Mock()
+        self.signal_mock.SIG_IGN = 1
+        self.daemoncontext.signal_map = {
+            self.signal_mock.SIGTSTP: None,
+            self.signal_mock.SIGTERM: handler}
+        self.daemoncontext.signal_dispatch = 'thread'
+        self.daemoncontext.stats_page = Mock()
+        steps = [name for name, step in self.daemoncontext._open_steps()]
+        self.assertEqual(steps[0], 'block_signals')
+        self.daemoncontext._block_signals()
+        self.signal_mock.pthread_sigmask.assert_called_once_with(
+            self.signal_mock.SIG_BLOCK, [self.signal_mock.SIGTERM])
+
+    def test_dispatch_pending_without_dispatcher(self):
+        self.assertEqual(self.daemoncontext.dispatch_pending(), [])
+
+    def test_open_no_startup_hook(self):
+        self.os_mock.fork = MagicMock(side_effect=[0, 0])
+        self.daemoncontext.signal_map = {}
+
+        with patch('pep3143daemon.daemon.StartupReport') as report_mock:
+            self.daemoncontext.open()
+
+        self.assertFalse(report_mock.called)
+        self.assertIsNone(self.daemoncontext.startup_report)
+
 
 class TestDaemonHelperUnit(TestCase):
     def setUp(self):
@@ -356,6 +847,14 @@ class TestDaemonHelperUnit(TestCase):
         syspatcher = patch('pep3143daemon.daemon.sys', autospeck=False)
         self.sys_mock = syspatcher.start()
 
+        close_range_supportedpatcher = patch('pep3143daemon.daemon.close_range_supported', autospeck=True)
+        self.close_range_supported_mock = close_range_supportedpatcher.start()
+        self.close_range_supported_mock.return_value = False
+
+        open_filenospatcher = patch('pep3143daemon.daemon.open_filenos', autospeck=True)
+        self.open_filenos_mock = open_filenospatcher.start()
+        self.open_filenos_mock.return_value = None
+
         self.addCleanup(patch.stopall)
 
         self.mockdaemoncontext = Mock()
@@ -380,6 +879,62 @@ class TestDaemonHelperUnit(TestCase):
         pep3143daemon.daemon.close_filenos(set((1, 2, 4, 9)))
         self.assertEqual(self.os_mock.close.call_count, 4092)
 
+    def test_close_filenos_close_range(self):
+        self.resource_mock.getrlimit.return_value = (12, 12)
+        self.close_range_supported_mock.return_value = True
+        with patch('pep3143daemon.daemon.close_range') as close_range_mock:
+            close_range_mock.return_value = True
+            pep3143daemon.daemon.close_filenos(set((1, 2, 4, 9)))
+        close_range_mock.assert_has_calls(
+            [call(0, 1), call(3, 4), call(5, 9), call(10, 12)])
+        self.assertEqual(close_range_mock.call_count, 4)
+        self.assertFalse(self.os_mock.closerange.called)
+        self.assertFalse(self.os_mock.close.called)
+
+    def test_close_filenos_close_range_fallback(self):
+        self.resource_mock.getrlimit.return_value = (12, 12)
+        self.close_range_supported_mock.return_value = True
+        with patch('pep3143daemon.daemon.close_range') as close_range_mock:
+            close_range_mock.side_effect = [True, False]
+            pep3143daemon.daemon.close_filenos(set((1, 4, 5, 6, 7, 8, 9, 10, 11)))
+        self.os_mock.closerange.assert_called_once_with(2, 4)
+
+    def test_close_filenos_open_filenos(self):
+        self.resource_mock.getrlimit.return_value = (12, 12)
+        self.open_filenos_mock.return_value = [0, 1, 2, 3, 4, 100000]
+        pep3143daemon.daemon.close_filenos(set((1, 2, 4, 9)))
+        self.os_mock.assert_has_calls(
+            [call.close(0), call.close(3), call.close(100000)])
+        self.assertEqual(self.os_mock.close.call_count, 3)
+
+    def test_close_filenos_ignore_EBADF(self):
+        self.resource_mock.getrlimit.return_value = (12, 12)
+        self.open_filenos_mock.return_value = [3]
+        self.os_mock.close.side_effect = OSError(errno.EBADF, 'bad fd')
+        pep3143daemon.daemon.close_filenos(set())
+
+    def test_close_filenos_error(self):
+        self.resource_mock.getrlimit.return_value = (12, 12)
+        self.open_filenos_mock.return_value = [3]
+        self.os_mock.close.side_effect = OSError(errno.EIO, 'io error')
+        self.assertRaises(
+            pep3143daemon.daemon.DaemonError,
+            pep3143daemon.daemon.close_filenos, set())
+
+# Test fileno_ranges()
+
+    def test_fileno_ranges(self):
+        result = pep3143daemon.daemon.fileno_ranges(set((0, 1, 2, 5, 20)), 10)
+        self.assertEqual(result, [(3, 5), (6, 10)])
+
+    def test_fileno_ranges_no_preserve(self):
+        result = pep3143daemon.daemon.fileno_ranges(set(), 10)
+        self.assertEqual(result, [(0, 10)])
+
+    def test_fileno_ranges_all_preserved(self):
+        result = pep3143daemon.daemon.fileno_ranges(set((0, 1, 2)), 3)
+        self.assertEqual(result, [])
+
 # Test default_signal_map()
 
     def test_default_signal_map(self):
@@ -480,3 +1035,171 @@ class TestDaemonHelperUnit(TestCase):
         file2.fileno.return_value = 321
         pep3143daemon.daemon.redirect_stream(file1, file2)
         self.os_mock.assert_has_calls([call.dup2(321, 123)])
+
+    def test_reopen_stream(self):
+        file1 = Mock()
+        file1.fileno.return_value = 123
+        file2 = Mock()
+        file2.name = '/var/log/test.log'
+        file2.fileno.return_value = 321
+        pep3143daemon.daemon.reopen_stream(file1, file2)
+        self.os_mock.assert_has_calls(
+            [call.open('/var/log/test.log',
+                       self.os_mock.O_WRONLY | self.os_mock.O_APPEND |
+                       self.os_mock.O_CREAT, 0o644),
+             call.dup2(self.os_mock.open(), 321),
+             call.dup2(self.os_mock.open(), 123),
+             call.close(self.os_mock.open())])
+        file2.flush.assert_called_once_with()
+
+    def test_reopen_stream_method(self):
+        class Target(object):
+            reopen = Mock()
+        pep3143daemon.daemon.reopen_stream(Mock(), Target())
+        Target.reopen.assert_called_once_with()
+        self.assertFalse(self.os_mock.open.called)
+
+    def test_reopen_stream_unnamed(self):
+        file2 = Mock()
+        file2.name = '<stdout>'
+        pep3143daemon.daemon.reopen_stream(Mock(), file2)
+        self.assertFalse(self.os_mock.open.called)
+
+    def test_reopen_stream_error(self):
+        file2 = Mock()
+        file2.name = '/var/log/test.log'
+        self.os_mock.open.side_effect = OSError(13, 'permission denied')
+        self.assertRaises(
+            pep3143daemon.DaemonError,
+            pep3143daemon.daemon.reopen_stream, Mock(), file2)
+
+    def test_redirect_stream_attach(self):
+        class Target(object):
+            attach = Mock(return_value=321)
+        file1 = Mock()
+        file1.fileno.return_value = 123
+        pep3143daemon.daemon.redirect_stream(file1, Target())
+        Target.attach.assert_called_once_with(file1)
+        self.os_mock.assert_has_calls([call.dup2(321, 123)])
+
+
+class TestWaitReadyUnit(TestCase):
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.addCleanup(os.close, self.read_fd)
+        syspatcher = patch('pep3143daemon.daemon.sys', autospeck=False)
+        self.sys_mock = syspatcher.start()
+        self.addCleanup(patch.stopall)
+
+    def test_wait_ready_ready(self):
+        os.write(self.write_fd, b'R')
+        self.assertEqual(pep3143daemon.daemon.wait_ready(self.read_fd, 5), 0)
+        os.close(self.write_fd)
+
+    def test_wait_ready_fail(self):
+        os.write(self.write_fd, b'Fno such user\n')
+        self.assertEqual(pep3143daemon.daemon.wait_ready(self.read_fd, 5), 1)
+        self.sys_mock.stderr.write.assert_called_once_with('no such user\n')
+        os.close(self.write_fd)
+
+    def test_wait_ready_eof(self):
+        os.close(self.write_fd)
+        self.assertEqual(pep3143daemon.daemon.wait_ready(self.read_fd), 1)
+        self.sys_mock.stderr.write.assert_called_once_with(
+            'Daemon exited before it was ready\n')
+
+    def test_wait_ready_timeout(self):
+        self.assertEqual(pep3143daemon.daemon.wait_ready(self.read_fd, 0.01), 1)
+        self.sys_mock.stderr.write.assert_called_once_with(
+            'Daemon not ready after 0.01 seconds\n')
+        os.close(self.write_fd)
+
+
+class TestDaemonFilenosUnit(TestCase):
+    def setUp(self):
+        ospatcher = patch('pep3143daemon.daemon.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+
+        syscallpatcher = patch.dict(
+            'pep3143daemon.daemon._LIBC_SYSCALL', clear=True)
+        syscallpatcher.start()
+        self.addCleanup(syscallpatcher.stop)
+
+        self.addCleanup(patch.stopall)
+
+# Test open_filenos()
+
+    def test_open_filenos_proc(self):
+        self.os_mock.listdir.return_value = ['10', '0', '2', '1']
+        result = pep3143daemon.daemon.open_filenos()
+        self.assertEqual(result, [0, 1, 2, 10])
+        self.os_mock.listdir.assert_called_once_with('/proc/self/fd')
+
+    def test_open_filenos_dev_fd(self):
+        self.os_mock.listdir.side_effect = [OSError(errno.ENOENT, 'missing'), ['0', '1']]
+        result = pep3143daemon.daemon.open_filenos()
+        self.assertEqual(result, [0, 1])
+        self.os_mock.listdir.assert_has_calls([call('/proc/self/fd'), call('/dev/fd')])
+
+    def test_open_filenos_none(self):
+        self.os_mock.listdir.side_effect = OSError(errno.ENOENT, 'missing')
+        self.assertIsNone(pep3143daemon.daemon.open_filenos())
+
+# Test close_range_supported() and close_range()
+
+    def test_libc_syscall_cached(self):
+        ctypes_mock = MagicMock()
+        with patch('pep3143daemon.daemon.ctypes', ctypes_mock), \
+                patch('pep3143daemon.daemon.sys') as sys_mock:
+            sys_mock.platform = 'linux'
+            syscall = pep3143daemon.daemon._libc_syscall()
+            self.assertIs(pep3143daemon.daemon._libc_syscall(), syscall)
+        ctypes_mock.CDLL.assert_called_once_with(None, use_errno=True)
+
+    def test_close_range_supported_no_ctypes(self):
+        with patch('pep3143daemon.daemon.ctypes', None):
+            self.assertFalse(pep3143daemon.daemon.close_range_supported())
+
+    def test_close_range_supported_enosys(self):
+        ctypes_mock = MagicMock()
+        ctypes_mock.CDLL.return_value.syscall.return_value = -1
+        with patch('pep3143daemon.daemon.ctypes', ctypes_mock), \
+                patch('pep3143daemon.daemon.sys') as sys_mock:
+            sys_mock.platform = 'linux'
+            self.assertFalse(pep3143daemon.daemon.close_range_supported())
+
+    def test_close_range(self):
+        ctypes_mock = MagicMock()
+        ctypes_mock.CDLL.return_value.syscall.return_value = 0
+        with patch('pep3143daemon.daemon.ctypes', ctypes_mock), \
+                patch('pep3143daemon.daemon.sys') as sys_mock:
+            sys_mock.platform = 'linux'
+            self.assertTrue(pep3143daemon.daemon.close_range(3, 10))
+        ctypes_mock.c_uint.assert_has_calls([call(3), call(9), call(0)])
+
+    def test_close_range_errors(self):
+        ctypes_mock = MagicMock()
+        ctypes_mock.CDLL.return_value.syscall.return_value = -1
+        with patch('pep3143daemon.daemon.ctypes', ctypes_mock), \
+                patch('pep3143daemon.daemon.sys') as sys_mock:
+            sys_mock.platform = 'linux'
+            ctypes_mock.get_errno.return_value = errno.ENOSYS
+            self.assertFalse(pep3143daemon.daemon.close_range(3, 10))
+            ctypes_mock.get_errno.return_value = errno.EINVAL
+            self.assertFalse(pep3143daemon.daemon.close_range(3, 10))
+            ctypes_mock.get_errno.return_value = errno.EPERM
+            self.assertRaises(pep3143daemon.daemon.DaemonError,
+                              pep3143daemon.daemon.close_range, 3, 10)
+        pep3143daemon.daemon._LIBC_SYSCALL.clear()
+        with patch('pep3143daemon.daemon.ctypes', None):
+            self.assertFalse(pep3143daemon.daemon.close_range(3, 10))
+
+    def test_close_range_supported(self):
+        ctypes_mock = MagicMock()
+        ctypes_mock.CDLL.return_value.syscall.return_value = 0
+        with patch('pep3143daemon.daemon.ctypes', ctypes_mock), \
+                patch('pep3143daemon.daemon.sys') as sys_mock:
+            sys_mock.platform = 'linux'
+            self.assertTrue(pep3143daemon.daemon.close_range_supported())
+        ctypes_mock.CDLL.return_value.syscall.assert_called_once_with(
+            436, ctypes_mock.c_uint(), ctypes_mock.c_uint(), ctypes_mock.c_uint())
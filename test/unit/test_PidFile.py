@@ -1,7 +1,9 @@
 __author__ = 'schlitzer'
 
 from unittest import TestCase
-from unittest.mock import Mock, call, patch
+from unittest.mock import Mock, call, mock_open, patch
+import errno
+import os
 import pep3143daemon.pidfile
 
 
@@ -23,11 +25,15 @@ class TestPidFileUnit(TestCase):
         self.addCleanup(patch.stopall)
 
         self.mockpidfile = Mock()
+        self.mockpidfile._handed_over = False
+        self.mockpidfile._adopted = False
 
     def test___init__(self):
         pep3143daemon.pidfile.PidFile.__init__(self.mockpidfile, 'test.pid')
         self.assertIsNone(self.mockpidfile.pidfile)
         self.assertEqual(self.mockpidfile._pidfile, 'test.pid')
+        self.assertFalse(self.mockpidfile._handed_over)
+        self.assertFalse(self.mockpidfile._adopted)
 
     def test_acquire(self):
         self.mockpidfile._pidfile = 'test.pid'
@@ -47,10 +53,7 @@ class TestPidFileUnit(TestCase):
             call()
         ]
         )
-        self.mockpidfile.pidfile.seek.assert_called_with(0)
-        self.mockpidfile.pidfile.truncate.assert_called_with()
-        self.mockpidfile.pidfile.write.assert_called_with(str(self.os_mock.getpid()) + '\n')
-        self.mockpidfile.pidfile.flush.assert_called_with()
+        self.mockpidfile.write_pid.assert_called_with()
 
         self.atexit_mock.register.assert_called_with(self.mockpidfile.release)
 
@@ -69,3 +72,158 @@ class TestPidFileUnit(TestCase):
         pep3143daemon.pidfile.PidFile.release(self.mockpidfile)
         self.mockpidfile.pidfile.close.assert_called_with()
         self.os_mock.remove.assert_called_with(self.mockpidfile._pidfile)
+
+    def test_release_handed_over(self):
+        self.mockpidfile._pidfile = 'test.pid'
+        self.mockpidfile._handed_over = True
+        pep3143daemon.pidfile.PidFile.release(self.mockpidfile)
+        self.mockpidfile.pidfile.close.assert_called_with()
+        self.assertFalse(self.os_mock.remove.called)
+
+    def test_handover(self):
+        pep3143daemon.pidfile.PidFile.handover(self.mockpidfile)
+        self.assertTrue(self.mockpidfile._handed_over)
+
+    def test_adopt(self):
+        self.mockpidfile._pidfile = 'test.pid'
+        pep3143daemon.pidfile.PidFile.adopt(self.mockpidfile, 5)
+        self.os_mock.fdopen.assert_called_with(5, 'a')
+        self.assertEqual(self.mockpidfile.pidfile, self.os_mock.fdopen())
+        self.assertFalse(self.mockpidfile.write_pid.called)
+        self.assertTrue(self.mockpidfile._adopted)
+        self.atexit_mock.register.assert_called_with(self.mockpidfile.release)
+
+    def test_release_adopted(self):
+        self.mockpidfile._pidfile = 'test.pid'
+        self.mockpidfile._adopted = True
+        pep3143daemon.pidfile.PidFile.release(self.mockpidfile)
+        self.mockpidfile.pidfile.close.assert_called_with()
+        self.assertFalse(self.os_mock.remove.called)
+
+    def test_take_over(self):
+        pep3143daemon.pidfile.PidFile.take_over(self.mockpidfile)
+        self.assertFalse(self.mockpidfile.write_pid.called)
+        self.mockpidfile._adopted = True
+        pep3143daemon.pidfile.PidFile.take_over(self.mockpidfile)
+        self.mockpidfile.write_pid.assert_called_once_with()
+        self.assertFalse(self.mockpidfile._adopted)
+
+    def test_write_pid(self):
+        pep3143daemon.pidfile.PidFile.write_pid(self.mockpidfile)
+        self.mockpidfile.pidfile.seek.assert_called_with(0)
+        self.mockpidfile.pidfile.truncate.assert_called_with()
+        self.mockpidfile.pidfile.write.assert_called_with('12345\n')
+        self.mockpidfile.pidfile.flush.assert_called_with()
+
+    def test_adopt_flock_fail(self):
+        self.mockpidfile._pidfile = 'test.pid'
+        self.fcntl_mock.flock.side_effect = IOError()
+        self.assertRaises(SystemExit, pep3143daemon.pidfile.PidFile.adopt, self.mockpidfile, 5)
+
+    def test_fileno(self):
+        self.mockpidfile.pidfile.closed = False
+        self.mockpidfile.pidfile.fileno.return_value = 5
+        self.assertEqual(pep3143daemon.pidfile.PidFile.fileno(self.mockpidfile), 5)
+
+    def test_fileno_not_acquired(self):
+        self.mockpidfile.pidfile = None
+        self.assertIsNone(pep3143daemon.pidfile.PidFile.fileno(self.mockpidfile))
+
+    def test_read_pid(self):
+        self.mockpidfile._pidfile = 'test.pid'
+        self.open_mock.return_value.__enter__.return_value.read.return_value = '4711\n'
+        self.assertEqual(pep3143daemon.pidfile.PidFile.read_pid(self.mockpidfile), 4711)
+        self.open_mock.assert_called_with('test.pid')
+
+    def test_read_pid_empty(self):
+        self.open_mock.return_value.__enter__.return_value.read.return_value = ''
+        self.assertIsNone(pep3143daemon.pidfile.PidFile.read_pid(self.mockpidfile))
+
+    def test_read_pid_missing(self):
+        self.open_mock.side_effect = IOError(errno.ENOENT, 'missing')
+        self.assertIsNone(pep3143daemon.pidfile.PidFile.read_pid(self.mockpidfile))
+
+    def test_is_locked_proc_locks(self):
+        self.mockpidfile._pidfile = 'test.pid'
+        with patch('pep3143daemon.pidfile.flock_held') as flock_held_mock:
+            flock_held_mock.return_value = True
+            self.assertTrue(pep3143daemon.pidfile.PidFile.is_locked(self.mockpidfile))
+        flock_held_mock.assert_called_once_with(
+            self.os_mock.stat().st_dev, self.os_mock.stat().st_ino)
+        self.assertFalse(self.fcntl_mock.flock.called)
+
+    def test_is_locked_missing(self):
+        self.os_mock.stat.side_effect = OSError(errno.ENOENT, 'missing')
+        self.assertFalse(pep3143daemon.pidfile.PidFile.is_locked(self.mockpidfile))
+
+    def test_is_locked_probe(self):
+        with patch('pep3143daemon.pidfile.flock_held') as flock_held_mock:
+            flock_held_mock.side_effect = IOError(errno.ENOENT, 'no /proc')
+            self.fcntl_mock.flock.side_effect = IOError(errno.EWOULDBLOCK, 'locked')
+            self.assertTrue(pep3143daemon.pidfile.PidFile.is_locked(self.mockpidfile))
+            self.fcntl_mock.flock.side_effect = None
+            self.assertFalse(pep3143daemon.pidfile.PidFile.is_locked(self.mockpidfile))
+        self.open_mock.return_value.close.assert_called_with()
+
+    def test_wait_for_exit_not_running(self):
+        self.mockpidfile.read_pid.return_value = None
+        self.assertTrue(pep3143daemon.pidfile.PidFile.wait_for_exit(self.mockpidfile))
+
+    def test_wait_for_exit_pidfd(self):
+        self.mockpidfile.read_pid.return_value = 4711
+        self.mockpidfile.is_locked.return_value = True
+        with patch('pep3143daemon.pidfile.open_pidfd') as open_pidfd_mock, \
+                patch('pep3143daemon.pidfile.wait_pidfd') as wait_pidfd_mock:
+            open_pidfd_mock.return_value = 9
+            wait_pidfd_mock.return_value = True
+            self.assertTrue(pep3143daemon.pidfile.PidFile.wait_for_exit(self.mockpidfile, 5))
+        open_pidfd_mock.assert_called_once_with(4711)
+        self.assertEqual(wait_pidfd_mock.call_args[0][0], 9)
+        self.os_mock.close.assert_called_once_with(9)
+
+    def test_wait_for_exit_poll_timeout(self):
+        self.mockpidfile.read_pid.return_value = 4711
+        self.mockpidfile.is_locked.return_value = True
+        with patch('pep3143daemon.pidfile.open_pidfd') as open_pidfd_mock, \
+                patch('pep3143daemon.pidfile.time') as time_mock:
+            open_pidfd_mock.return_value = None
+            self.assertFalse(pep3143daemon.pidfile.PidFile.wait_for_exit(self.mockpidfile, 0))
+
+    def test_wait_for_exit_poll(self):
+        self.mockpidfile.read_pid.return_value = 4711
+        self.mockpidfile.is_locked.side_effect = [True, True, True, False]
+        with patch('pep3143daemon.pidfile.open_pidfd') as open_pidfd_mock, \
+                patch('pep3143daemon.pidfile.time') as time_mock:
+            open_pidfd_mock.return_value = None
+            self.assertTrue(pep3143daemon.pidfile.PidFile.wait_for_exit(self.mockpidfile))
+        self.assertEqual(time_mock.sleep.call_count, 2)
+
+
+class TestPidFileHelperUnit(TestCase):
+    def test_flock_held(self):
+        locks = (
+            '1: FLOCK  ADVISORY  WRITE 4711 fe:01:1234 0 EOF\n'
+            '1: -> FLOCK  ADVISORY  WRITE 4712 fe:01:5678 0 EOF\n'
+            '2: POSIX  ADVISORY  WRITE 4713 fe:01:9999 0 EOF\n')
+        with patch('builtins.open', mock_open(read_data=locks)), \
+                patch('pep3143daemon.pidfile.os') as os_mock:
+            os_mock.major.return_value = 0xfe
+            os_mock.minor.return_value = 1
+            self.assertTrue(pep3143daemon.pidfile.flock_held(0, 1234))
+            self.assertFalse(pep3143daemon.pidfile.flock_held(0, 5678))
+            self.assertFalse(pep3143daemon.pidfile.flock_held(0, 9999))
+
+    def test_wait_pidfd(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.assertFalse(pep3143daemon.pidfile.wait_pidfd(
+            read_fd, pep3143daemon.pidfile.monotonic() + 0.01))
+        os.close(write_fd)
+        self.assertTrue(pep3143daemon.pidfile.wait_pidfd(read_fd, None))
+
+    def test_open_pidfd_unsupported(self):
+        with patch('pep3143daemon.pidfile.os') as os_mock:
+            os_mock.pidfd_open.side_effect = OSError(errno.ENOSYS, 'not implemented')
+            self.assertIsNone(pep3143daemon.pidfile.open_pidfd(4711))
+            del os_mock.pidfd_open
+            self.assertIsNone(pep3143daemon.pidfile.open_pidfd(4711))
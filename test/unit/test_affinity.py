@@ -0,0 +1,102 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import shutil
+import tempfile
+
+import pep3143daemon.affinity
+
+
+class TestTopologyUnit(TestCase):
+    def setUp(self):
+        allowed_cpuspatcher = patch('pep3143daemon.affinity.allowed_cpus', autospeck=True)
+        self.allowed_cpus_mock = allowed_cpuspatcher.start()
+        self.allowed_cpus_mock.return_value = list(range(8))
+        self.addCleanup(patch.stopall)
+
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def add_node(self, name, cpulist):
+        os.mkdir(os.path.join(self.root, name))
+        with open(os.path.join(self.root, name, 'cpulist'), 'w') as handle:
+            handle.write(cpulist + '\n')
+
+    def test_read(self):
+        self.add_node('node0', '0-3')
+        self.add_node('node1', '4-7')
+        self.add_node('possible', '0-1')
+        topology = pep3143daemon.affinity.Topology.read(self.root)
+        self.assertEqual(topology.nodes, {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]})
+
+    def test_read_restricted(self):
+        self.allowed_cpus_mock.return_value = [1, 2]
+        self.add_node('node0', '0-1')
+        self.add_node('node1', '2-3')
+        self.add_node('node2', '4-5')
+        topology = pep3143daemon.affinity.Topology.read(self.root)
+        self.assertEqual(topology.nodes, {0: [1], 1: [2]})
+
+    def test_read_fallback(self):
+        topology = pep3143daemon.affinity.Topology.read(
+            os.path.join(self.root, 'missing'))
+        self.assertEqual(topology.nodes, {0: list(range(8))})
+
+    def test_resolve(self):
+        topology = pep3143daemon.affinity.Topology({0: [0, 1], 1: [2, 3]})
+        self.assertEqual(topology.resolve('all'), [0, 1, 2, 3])
+        self.assertEqual(topology.resolve('node:1'), [2, 3])
+        self.assertEqual(topology.resolve('node:0-1'), [0, 1, 2, 3])
+        self.assertEqual(topology.resolve([3, 1, 1]), [1, 3])
+
+    def test_restrict(self):
+        topology = pep3143daemon.affinity.Topology({0: [0, 1], 1: [2, 3]})
+        self.assertEqual(topology.restrict([1, 2, 3]).nodes, {0: [1], 1: [2, 3]})
+        self.assertEqual(topology.restrict([8]).nodes, {0: [8]})
+
+    def test_resolve_errors(self):
+        topology = pep3143daemon.affinity.Topology({0: [0, 1]})
+        self.assertRaises(ValueError, topology.resolve, 'node:2')
+        self.assertRaises(ValueError, topology.resolve, 'fastest')
+        self.assertRaises(ValueError, topology.resolve, [])
+
+    def test_worker_slices_core_per_worker(self):
+        topology = pep3143daemon.affinity.Topology(
+            {0: [0, 1, 2, 3, 4], 1: [5, 6]})
+        self.assertEqual(
+            topology.worker_slices('core-per-worker', 2),
+            [[0, 1], [5, 6], [2, 3, 4]])
+        self.assertEqual(
+            topology.worker_slices('core-per-worker'),
+            [[0], [5], [1], [6], [2], [3], [4]])
+
+    def test_worker_slices_node_local(self):
+        topology = pep3143daemon.affinity.Topology({0: [0, 1], 1: [2, 3]})
+        self.assertEqual(topology.worker_slices('node-local'),
+                         [[0, 1], [2, 3]])
+
+    def test_worker_slices_errors(self):
+        topology = pep3143daemon.affinity.Topology({0: [0, 1]})
+        self.assertRaises(ValueError, topology.worker_slices, 'fastest')
+        self.assertRaises(ValueError, topology.worker_slices,
+                          'core-per-worker', 0)
+
+
+class TestAffinityHelperUnit(TestCase):
+    def test_parse_cpulist(self):
+        self.assertEqual(pep3143daemon.affinity.parse_cpulist('0-2,8,10-11\n'),
+                         [0, 1, 2, 8, 10, 11])
+        self.assertEqual(pep3143daemon.affinity.parse_cpulist('\n'), [])
+        self.assertRaises(ValueError, pep3143daemon.affinity.parse_cpulist, 'x')
+
+    def test_set_affinity(self):
+        with patch('pep3143daemon.affinity.os') as os_mock:
+            pep3143daemon.affinity.set_affinity([1, 2])
+        os_mock.sched_setaffinity.assert_called_once_with(0, [1, 2])
+
+    def test_set_affinity_unsupported(self):
+        with patch('pep3143daemon.affinity.os') as os_mock:
+            del os_mock.sched_setaffinity
+            self.assertRaises(OSError, pep3143daemon.affinity.set_affinity, [1])
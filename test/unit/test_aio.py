@@ -0,0 +1,131 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import asyncio
+import os
+import signal
+
+import pep3143daemon.aio
+
+
+class TestAsyncDaemonContextUnit(TestCase):
+    def setUp(self):
+        openpatcher = patch('pep3143daemon.aio.DaemonContext.open', autospeck=True)
+        self.open_mock = openpatcher.start()
+
+        self.addCleanup(patch.stopall)
+        self.addCleanup(signal.signal, signal.SIGUSR1, signal.getsignal(signal.SIGUSR1))
+        self.addCleanup(signal.signal, signal.SIGTERM, signal.getsignal(signal.SIGTERM))
+
+        self.daemon = pep3143daemon.aio.AsyncDaemonContext(
+            detach_process=False, shutdown_timeout=1, signal_map={})
+
+    def test_run(self):
+        async def main():
+            return 42
+        self.assertEqual(self.daemon.run(main()), 42)
+        self.open_mock.assert_called_once_with()
+        self.assertTrue(self.daemon.loop.is_closed())
+
+    def test_run_closes(self):
+        async def main():
+            raise RuntimeError('failed')
+        with patch.object(self.daemon, 'close') as close_mock:
+            close_mock.side_effect = lambda: self.assertTrue(
+                self.daemon.loop.is_closed())
+            self.assertRaises(RuntimeError, self.daemon.run, main())
+        close_mock.assert_called_once_with()
+
+    def test_run_open_fails(self):
+        self.open_mock.side_effect = pep3143daemon.daemon.DaemonError('failed')
+
+        async def main():
+            return 42
+        self.assertRaises(pep3143daemon.daemon.DaemonError, self.daemon.run, main())
+        self.assertIsNone(self.daemon.loop)
+
+    def test_run_terminate(self):
+        self.daemon.signal_map = {signal.SIGTERM: 'terminate'}
+        cancelled = []
+
+        async def background():
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def main():
+            asyncio.get_event_loop().create_task(background())
+            await asyncio.sleep(0)
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(60)
+
+        signal.signal(signal.SIGTERM, self.daemon.terminate)
+        with patch.object(self.daemon, '_install_signal_handlers') as \
+                install_mock:
+            self.assertIsNone(self.daemon.run(main()))
+        self.assertEqual(cancelled, [True])
+        self.assertEqual(signal.getsignal(signal.SIGTERM), self.daemon.terminate)
+        self.assertFalse(install_mock.called)
+
+    def test_run_coroutine_signal_handler(self):
+        received = []
+
+        async def handler(signal_number, stack_frame):
+            received.append(len(self.daemon._signal_tasks))
+
+        self.daemon.signal_map = {signal.SIGUSR1: handler}
+
+        async def main():
+            os.kill(os.getpid(), signal.SIGUSR1)
+            while not received:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0)
+            return received
+
+        self.assertEqual(self.daemon.run(main()), [1])
+        self.assertEqual(self.daemon._signal_tasks, set())
+
+    def test_terminate_without_loop(self):
+        self.assertRaises(SystemExit, self.daemon.terminate, signal.SIGTERM, None)
+
+    def test_terminate_without_loop_shutdown(self):
+        self.daemon.shutdown = Mock()
+        self.daemon.terminate(signal.SIGTERM, None)
+        self.daemon.shutdown.request.assert_called_once_with(signal.SIGTERM)
+
+    def test_terminate_with_loop(self):
+        self.daemon.notifier = Mock()
+        self.daemon.stats_page = Mock()
+        self.daemon.shutdown = Mock()
+        self.daemon._main_task = Mock()
+        self.daemon.terminate(signal.SIGTERM, None)
+        self.daemon.notifier.stopping.assert_called_once_with()
+        self.daemon.stats_page.set_state.assert_called_once_with('draining')
+        self.daemon.shutdown.request.assert_called_once_with(signal.SIGTERM)
+        self.daemon._main_task.cancel.assert_called_once_with()
+
+    def test___init__old_python(self):
+        with patch('pep3143daemon.aio.asyncio', spec=['new_event_loop']):
+            self.assertRaises(pep3143daemon.daemon.DaemonError,
+                              pep3143daemon.aio.AsyncDaemonContext)
+
+    def test_new_event_loop_uvloop_missing(self):
+        self.daemon.use_uvloop = True
+        with patch.dict('sys.modules', {'uvloop': None}):
+            self.assertRaises(pep3143daemon.daemon.DaemonError, self.daemon.new_event_loop)
+
+    def test_new_event_loop_uvloop(self):
+        self.daemon.use_uvloop = None
+        uvloop = Mock()
+        with patch.dict('sys.modules', {'uvloop': uvloop}):
+            self.assertEqual(self.daemon.new_event_loop(), uvloop.new_event_loop())
+
+    def test_new_event_loop_auto_without_uvloop(self):
+        self.daemon.use_uvloop = None
+        with patch.dict('sys.modules', {'uvloop': None}):
+            loop = self.daemon.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertIsInstance(loop, asyncio.AbstractEventLoop)
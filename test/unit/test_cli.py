@@ -0,0 +1,264 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, call, patch
+import argparse
+import errno
+import signal
+
+from pep3143daemon import DaemonError
+import pep3143daemon.cli
+
+
+class TestCliUnit(TestCase):
+    def setUp(self):
+        pidfilepatcher = patch('pep3143daemon.cli.PidFile', autospeck=True)
+        self.pidfile_mock = pidfilepatcher.start()
+        self.pidfile = self.pidfile_mock.return_value
+        self.pidfile.read_pid.return_value = 4711
+        self.pidfile.is_locked.return_value = True
+        self.pidfile.wait_for_exit.return_value = True
+
+        daemonpatcher = patch('pep3143daemon.cli.DaemonContext', autospeck=True)
+        self.daemon_mock = daemonpatcher.start()
+
+        ospatcher = patch('pep3143daemon.cli.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+        self.os_mock.path.abspath.side_effect = lambda path: '/abs/' + path
+
+        syspatcher = patch('pep3143daemon.cli.sys', autospeck=True)
+        self.sys_mock = syspatcher.start()
+
+        self.addCleanup(patch.stopall)
+
+    def options(self, *argv):
+        return pep3143daemon.cli.parser().parse_args(
+            ['--pidfile', 'test.pid'] + list(argv))
+
+    def test_parser_defaults(self):
+        options = self.options('start', 'app:main', '--port', '80')
+        self.assertEqual(options.command, 'start')
+        self.assertEqual(options.target, 'app:main')
+        self.assertEqual(options.args, ['--port', '80'])
+        self.assertEqual(options.working_directory, '/')
+        self.assertEqual(options.umask, 0)
+        self.assertEqual(options.reload_signal, signal.SIGHUP)
+        self.assertFalse(options.foreground)
+
+    def test_parser_types(self):
+        options = self.options(
+            '--umask', '022', '--uid', '1000', '--gid', '100',
+            '--reload-signal', 'usr1', 'reload')
+        self.assertEqual(options.umask, 0o22)
+        self.assertEqual(options.uid, 1000)
+        self.assertEqual(options.gid, 100)
+        self.assertEqual(options.reload_signal, signal.SIGUSR1)
+
+    def test_signal_number_unknown(self):
+        self.assertRaises(
+            argparse.ArgumentTypeError,
+            pep3143daemon.cli.signal_number, 'NOPE')
+
+    def test_start(self):
+        target = Mock()
+        with patch('pep3143daemon.cli.load_target') as load_target_mock:
+            load_target_mock.return_value = target
+            self.pidfile.is_locked.return_value = False
+            options = self.options('--foreground', 'start', 'app:main', '--', '-v')
+            self.assertEqual(pep3143daemon.cli.start(options), 0)
+        load_target_mock.assert_called_once_with('app:main')
+        self.pidfile_mock.assert_called_once_with('/abs/test.pid')
+        kwargs = self.daemon_mock.call_args[1]
+        self.assertEqual(kwargs['pidfile'], self.pidfile)
+        self.assertFalse(kwargs['detach_process'])
+        self.assertTrue(kwargs['wait_ready'])
+        self.assertEqual(kwargs['ready_timeout'], 60.0)
+        self.assertIsNone(kwargs['stats_page'])
+        self.assertEqual(kwargs['signal_map'][signal.SIGHUP], 'reopen_streams')
+        self.assertEqual(kwargs['signal_map'][signal.SIGTERM], 'terminate')
+        daemon = self.daemon_mock.return_value
+        daemon.open.assert_called_once_with()
+        daemon.ready.assert_called_once_with()
+        target.assert_called_once_with()
+        self.sys_mock.argv.__setitem__.assert_called_once_with(
+            slice(None, None), ['app:main', '-v'])
+
+    def test_start_stats_page(self):
+        with patch('pep3143daemon.cli.load_target'), \
+                patch('pep3143daemon.cli.StatsPage') as stats_page_mock:
+            self.pidfile.is_locked.return_value = False
+            options = self.options('--stats-page', 'app.stats', 'start',
+                                   'app:main')
+            self.assertEqual(pep3143daemon.cli.start(options), 0)
+        stats_page_mock.assert_called_once_with('/abs/app.stats')
+        self.assertEqual(self.daemon_mock.call_args[1]['stats_page'],
+                         stats_page_mock.return_value)
+
+    def test_start_manual_ready(self):
+        target = Mock()
+        with patch('pep3143daemon.cli.load_target') as load_target_mock:
+            load_target_mock.return_value = target
+            self.pidfile.is_locked.return_value = False
+            options = self.options('--manual-ready', 'start', 'app:main')
+            self.assertEqual(pep3143daemon.cli.start(options), 0)
+        daemon = self.daemon_mock.return_value
+        target.assert_called_once_with(daemon)
+        self.assertFalse(daemon.ready.called)
+
+    def test_start_manual_ready_fail(self):
+        target = Mock(side_effect=RuntimeError('cannot bind'))
+        with patch('pep3143daemon.cli.load_target') as load_target_mock:
+            load_target_mock.return_value = target
+            self.pidfile.is_locked.return_value = False
+            options = self.options('--manual-ready', 'start', 'app:main')
+            self.assertRaises(RuntimeError, pep3143daemon.cli.start, options)
+        self.daemon_mock.return_value.fail.assert_called_once_with('cannot bind')
+
+    def test_start_manual_ready_module(self):
+        self.pidfile.is_locked.return_value = False
+        options = self.options('--manual-ready', 'start', 'app')
+        self.assertRaises(DaemonError, pep3143daemon.cli.start, options)
+
+    def test_start_reload_signal(self):
+        with patch('pep3143daemon.cli.load_target'):
+            self.pidfile.is_locked.return_value = False
+            options = self.options('--reload-signal', 'USR1', 'start',
+                                   'app:main')
+            self.assertEqual(pep3143daemon.cli.start(options), 0)
+        signal_map = self.daemon_mock.call_args[1]['signal_map']
+        self.assertEqual(signal_map[signal.SIGUSR1], 'reopen_streams')
+        self.assertNotIn(signal.SIGHUP, signal_map)
+
+    def test_start_reload_sigterm(self):
+        self.pidfile.is_locked.return_value = False
+        options = self.options('--reload-signal', 'TERM', 'start', 'app:main')
+        self.assertRaises(DaemonError, pep3143daemon.cli.start, options)
+
+    def test_start_running(self):
+        self.assertEqual(pep3143daemon.cli.start(self.options('start', 'app:main')), 0)
+        self.assertFalse(self.daemon_mock.called)
+
+    def test_start_no_target(self):
+        self.assertRaises(
+            DaemonError, pep3143daemon.cli.start, self.options('start'))
+
+    def test_stop(self):
+        self.assertEqual(pep3143daemon.cli.stop(self.options('stop')), 0)
+        self.os_mock.kill.assert_called_once_with(4711, signal.SIGTERM)
+        self.pidfile.wait_for_exit.assert_called_once_with(10.0)
+        self.assertFalse(self.os_mock.remove.called)
+
+    def test_stop_not_running(self):
+        self.pidfile.is_locked.return_value = False
+        self.assertEqual(pep3143daemon.cli.stop(self.options('stop')), 0)
+        self.assertFalse(self.os_mock.kill.called)
+
+    def test_stop_exited(self):
+        self.os_mock.kill.side_effect = OSError(errno.ESRCH, 'no such process')
+        self.assertEqual(pep3143daemon.cli.stop(self.options('stop')), 0)
+        self.assertFalse(self.pidfile.wait_for_exit.called)
+
+    def test_stop_kill(self):
+        self.pidfile.wait_for_exit.side_effect = [False, True]
+        options = self.options('--stop-timeout', '2', 'stop')
+        self.assertEqual(pep3143daemon.cli.stop(options), 0)
+        self.os_mock.kill.assert_has_calls(
+            [call(4711, signal.SIGTERM), call(4711, signal.SIGKILL)])
+        self.pidfile.wait_for_exit.assert_has_calls([call(2.0), call(2.0)])
+        self.os_mock.remove.assert_called_once_with('/abs/test.pid')
+
+    def test_stop_kill_timeout(self):
+        self.pidfile.wait_for_exit.return_value = False
+        self.assertRaises(
+            DaemonError, pep3143daemon.cli.stop, self.options('stop'))
+
+    def test_reload(self):
+        options = self.options('--reload-signal', 'SIGUSR2', 'reload')
+        self.assertEqual(pep3143daemon.cli.reload(options), 0)
+        self.os_mock.kill.assert_called_once_with(4711, signal.SIGUSR2)
+
+    def test_reload_not_running(self):
+        self.pidfile.is_locked.return_value = False
+        self.assertRaises(
+            DaemonError, pep3143daemon.cli.reload, self.options('reload'))
+
+    def test_status(self):
+        options = self.options('status')
+        self.assertEqual(pep3143daemon.cli.status(options),
+                         pep3143daemon.cli.STATUS_RUNNING)
+        self.pidfile.is_locked.return_value = False
+        self.os_mock.path.exists.return_value = True
+        self.assertEqual(pep3143daemon.cli.status(options),
+                         pep3143daemon.cli.STATUS_DEAD)
+        self.os_mock.path.exists.return_value = False
+        self.assertEqual(pep3143daemon.cli.status(options),
+                         pep3143daemon.cli.STATUS_STOPPED)
+
+    def test_stats(self):
+        with patch('pep3143daemon.cli.read_stats') as read_stats_mock:
+            read_stats_mock.return_value = {'state': 'running', 'pid': 4711}
+            self.assertEqual(pep3143daemon.cli.stats(
+                self.options('--stats-page', 'app.stats', 'stats')), 0)
+        read_stats_mock.assert_called_once_with('/abs/app.stats')
+        self.sys_mock.stdout.write.assert_called_once_with(
+            '{\n  "pid": 4711,\n  "state": "running"\n}\n')
+        self.assertRaises(DaemonError, pep3143daemon.cli.stats,
+                          self.options('stats'))
+
+    def test_main_restart(self):
+        with patch('pep3143daemon.cli.stop') as stop_mock, \
+                patch('pep3143daemon.cli.start') as start_mock:
+            stop_mock.return_value = 0
+            start_mock.return_value = 0
+            result = pep3143daemon.cli.main(
+                ['--pidfile', 'test.pid', 'restart', 'app:main'])
+        self.assertEqual(result, 0)
+        stop_mock.assert_called_once_with(start_mock.call_args[0][0])
+
+    def test_main_stats_without_pidfile(self):
+        with patch('pep3143daemon.cli.read_stats') as read_stats_mock:
+            read_stats_mock.return_value = {}
+            result = pep3143daemon.cli.main(
+                ['--stats-page', 'app.stats', 'stats'])
+        self.assertEqual(result, 0)
+        self.assertFalse(self.pidfile_mock.called)
+
+    def test_main_no_pidfile(self):
+        result = pep3143daemon.cli.main(['status'])
+        self.assertEqual(result, 1)
+        self.sys_mock.stderr.write.assert_called_once_with(
+            'status requires --pidfile\n')
+
+    def test_main_error(self):
+        self.pidfile.is_locked.return_value = False
+        result = pep3143daemon.cli.main(['--pidfile', 'test.pid', 'reload'])
+        self.assertEqual(result, 1)
+        self.sys_mock.stderr.write.assert_called_once_with('Not running\n')
+
+
+class TestLoadTargetUnit(TestCase):
+    def test_callable(self):
+        target = pep3143daemon.cli.load_target('os.path:join')
+        self.assertEqual(target('a', 'b'), 'a/b')
+
+    def test_callable_missing(self):
+        self.assertRaises(
+            DaemonError, pep3143daemon.cli.load_target, 'os.path:nope')
+        self.assertRaises(
+            DaemonError, pep3143daemon.cli.load_target, 'nosuchmodule:main')
+        self.assertRaises(
+            DaemonError, pep3143daemon.cli.load_target, 'os:sep')
+
+    def test_module(self):
+        with patch('pep3143daemon.cli.runpy') as runpy_mock:
+            pep3143daemon.cli.load_target('json.tool')()
+        runpy_mock.run_module.assert_called_once_with(
+            'json.tool', run_name='__main__', alter_sys=True)
+
+    def test_module_missing(self):
+        self.assertRaises(
+            DaemonError, pep3143daemon.cli.load_target, 'nosuchmodule')
+
+    def test_script_missing(self):
+        self.assertRaises(
+            DaemonError, pep3143daemon.cli.load_target, 'nosuch.py')
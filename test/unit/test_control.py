@@ -0,0 +1,119 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import json
+import os
+import shutil
+import socket
+import stat
+import tempfile
+
+from pep3143daemon import DaemonError
+import pep3143daemon.control
+
+
+class TestControlSocketUnit(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'control.sock')
+        self.daemon = Mock()
+        self.daemon.executor_stats.return_value = {'io': {'queued': 0}}
+        self.daemon.startup_report = None
+        self.control = pep3143daemon.control.ControlSocket(
+            self.path, commands={'echo': lambda daemon, args: args})
+        self.addCleanup(self.control.close)
+
+    def request(self, *lines):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(5)
+        client.connect(self.path)
+        stream = client.makefile('rwb')
+        result = []
+        for line in lines:
+            stream.write(line.encode('utf-8') + b'\n')
+            stream.flush()
+            result.append(json.loads(stream.readline().decode('utf-8')))
+        stream.close()
+        client.close()
+        return result
+
+    def test_bind(self):
+        with open(self.path, 'w'):
+            pass
+        self.control.bind()
+        self.assertTrue(stat.S_ISSOCK(os.stat(self.path).st_mode))
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(self.control.fileno(), self.control.sock.fileno())
+
+    def test_bind_chown(self):
+        with patch('pep3143daemon.control.os.chown') as chown_mock:
+            self.control.bind(os.getuid() + 1, None)
+        chown_mock.assert_called_once_with(self.path, os.getuid() + 1, -1)
+
+    def test_bind_error(self):
+        self.control.path = os.path.join(self.directory, 'missing', 'sock')
+        self.assertRaises(DaemonError, self.control.bind)
+        self.assertIsNone(self.control.sock)
+
+    def test_serve(self):
+        self.control.bind()
+        self.control.start(self.daemon)
+        self.daemon.fork_registry.register.assert_called_once_with(
+            after_in_child=self.control._after_fork)
+        help_, echo, stats, unknown = self.request(
+            'help', 'echo a b', 'stats', 'nope')
+        self.assertIn('drain', help_['result'])
+        self.assertEqual(echo, {'ok': True, 'result': ['a', 'b']})
+        self.assertEqual(stats['result']['pid'], os.getpid())
+        self.assertEqual(stats['result']['executors'], {'io': {'queued': 0}})
+        self.assertGreater(stats['result']['fds'], 0)
+        self.assertGreater(stats['result']['threads'], 1)
+        self.assertFalse(unknown['ok'])
+        self.control.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.daemon.fork_registry.unregister.assert_called_once_with(
+            self.control._after_fork)
+
+    def test_close_replaced(self):
+        self.control.bind()
+        os.unlink(self.path)
+        with open(self.path, 'w'):
+            pass
+        self.control.close()
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_handle_error(self):
+        self.control.commands['fail'] = Mock(side_effect=ValueError('broken'))
+        with patch('pep3143daemon.control.traceback'):
+            response = json.loads(self.control.handle('fail'))
+        self.assertEqual(response, {'ok': False, 'error': 'broken'})
+
+    def test_signals(self):
+        self.control._daemon = self.daemon
+        self.daemon._signal_handler_map = {1: Mock(), 15: Mock()}
+        with patch('pep3143daemon.control.os.kill') as kill_mock:
+            self.assertEqual(json.loads(self.control.handle('reload'))['result'], 1)
+            self.assertEqual(json.loads(self.control.handle('drain'))['result'], 15)
+        kill_mock.assert_any_call(os.getpid(), self.control.reload_signal)
+        kill_mock.assert_any_call(os.getpid(), self.control.drain_signal)
+
+    def test_signals_without_handler(self):
+        self.control._daemon = pep3143daemon.daemon.DaemonContext(
+            detach_process=False, notify=False)
+        with patch('pep3143daemon.control.os.kill') as kill_mock:
+            response = json.loads(self.control.handle('reload'))
+            self.assertEqual(response, {
+                'ok': False,
+                'error': 'Signal 1 has no handler in the signal_map'})
+            self.assertTrue(json.loads(self.control.handle('drain'))['ok'])
+        kill_mock.assert_called_once_with(os.getpid(), self.control.drain_signal)
+        self.control._daemon = None
+        self.assertFalse(json.loads(self.control.handle('drain'))['ok'])
+
+    def test_after_fork(self):
+        self.control.bind()
+        self.control._after_fork()
+        self.assertIsNone(self.control.sock)
+        self.assertTrue(os.path.exists(self.path))
@@ -0,0 +1,81 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import threading
+
+from pep3143daemon import DaemonError
+import pep3143daemon.executors
+
+
+class TestManagedExecutorUnit(TestCase):
+    def setUp(self):
+        self.pool = pep3143daemon.executors.ManagedExecutor('io', max_workers=1)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_init_error(self):
+        self.assertRaises(DaemonError, pep3143daemon.executors.ManagedExecutor,
+                          'io', kind='fiber')
+
+    def test_init_without_futures(self):
+        with patch('pep3143daemon.executors.concurrent', None):
+            self.assertRaises(DaemonError,
+                              pep3143daemon.executors.ManagedExecutor, 'io')
+
+    def test_lazy(self):
+        self.assertIsNone(self.pool._executor)
+        self.assertEqual(self.pool.submit(sum, [1, 2]).result(), 3)
+        self.assertIsNotNone(self.pool._executor)
+
+    def test_recreated_after_fork(self):
+        executor = self.pool.executor
+        with patch('pep3143daemon.executors.os') as os_mock:
+            os_mock.getpid.return_value = -1
+            self.assertIsNot(self.pool.executor, executor)
+        executor.shutdown()
+
+    def test_stats(self):
+        release = threading.Event()
+        first = self.pool.submit(release.wait)
+        second = self.pool.submit(int, 'x')
+        stats = self.pool.stats()
+        self.assertEqual(stats['queued'] + stats['running'], 2)
+        release.set()
+        first.result()
+        self.assertRaises(ValueError, second.result)
+        stats = self.pool.stats()
+        self.assertEqual(stats['submitted'], 2)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['running'], 0)
+        self.assertGreaterEqual(stats['latency']['max'], stats['latency']['mean'])
+        self.assertGreaterEqual(stats['wait']['max'], 0.0)
+
+    def test_resize(self):
+        executor = self.pool.executor
+        self.pool.resize(4)
+        self.assertEqual(self.pool.max_workers, 4)
+        self.assertIsNot(self.pool.executor, executor)
+        self.assertEqual(self.pool.executor._max_workers, 4)
+        self.assertRaises(RuntimeError, executor.submit, int)
+
+    def test_shutdown(self):
+        self.pool.executor
+        self.pool.shutdown(wait=True)
+        self.assertRaises(DaemonError, self.pool.submit, int)
+
+    def test_shutdown_cancel(self):
+        executor = self.pool._executor = Mock()
+        self.pool._pid = pep3143daemon.executors.os.getpid()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        executor.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+
+
+class TestExecutorSpecUnit(TestCase):
+    def test_executor_spec(self):
+        self.assertEqual(pep3143daemon.executors.executor_spec(4),
+                         {'max_workers': 4})
+        self.assertEqual(
+            pep3143daemon.executors.executor_spec({'kind': 'process'}),
+            {'kind': 'process'})
@@ -0,0 +1,72 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, call, patch
+
+import pep3143daemon.forkhooks
+
+
+class TestForkRegistryUnit(TestCase):
+    def setUp(self):
+        ospatcher = patch('pep3143daemon.forkhooks.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+        del self.os_mock.register_at_fork
+
+        self.addCleanup(patch.stopall)
+
+        self.registry = pep3143daemon.forkhooks.ForkRegistry()
+        self.hooks = Mock()
+        self.registry.register(before=self.hooks.before1,
+                               after_in_parent=self.hooks.parent1,
+                               after_in_child=self.hooks.child1)
+        self.registry.register(before=self.hooks.before2,
+                               after_in_child=self.hooks.child2)
+
+    def test_install(self):
+        registry = pep3143daemon.forkhooks.ForkRegistry()
+        self.os_mock.register_at_fork = Mock()
+        self.assertTrue(registry.install())
+        self.assertTrue(registry.install())
+        self.os_mock.register_at_fork.assert_called_once_with(
+            before=registry.run_before,
+            after_in_parent=registry.run_after_in_parent,
+            after_in_child=registry.run_after_in_child)
+
+    def test_install_unsupported(self):
+        self.assertFalse(self.registry.install())
+
+    def test_fork_parent(self):
+        fork = Mock(return_value=42)
+        self.assertEqual(self.registry.fork(fork), 42)
+        self.assertEqual(self.hooks.mock_calls,
+                         [call.before2(), call.before1(), call.parent1()])
+
+    def test_fork_child(self):
+        self.os_mock.fork.return_value = 0
+        self.assertEqual(self.registry.fork(), 0)
+        self.assertEqual(self.hooks.mock_calls, [
+            call.before2(), call.before1(), call.child1(), call.child2()])
+
+    def test_fork_error(self):
+        fork = Mock(side_effect=OSError('no memory'))
+        self.assertRaises(OSError, self.registry.fork, fork)
+        self.assertEqual(self.hooks.mock_calls,
+                         [call.before2(), call.before1(), call.parent1()])
+
+    def test_fork_installed(self):
+        self.registry.installed = True
+        fork = Mock(return_value=42)
+        self.assertEqual(self.registry.fork(fork), 42)
+        self.assertEqual(self.hooks.mock_calls, [])
+
+    def test_callback_error(self):
+        self.hooks.child1.side_effect = ValueError('broken')
+        with patch('pep3143daemon.forkhooks.traceback') as traceback_mock:
+            self.registry.run_after_in_child()
+        traceback_mock.print_exc.assert_called_once_with()
+        self.hooks.child2.assert_called_once_with()
+
+    def test_unregister(self):
+        self.registry.unregister(self.hooks.before1)
+        self.registry.run_before()
+        self.assertEqual(self.hooks.mock_calls, [call.before2()])
@@ -0,0 +1,72 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import pep3143daemon.instrument
+
+
+class TestStartupReportUnit(TestCase):
+    def setUp(self):
+        ospatcher = patch('pep3143daemon.instrument.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+        self.os_mock.getpid.return_value = 100
+
+        resourcepatcher = patch('pep3143daemon.instrument.resource', autospeck=True)
+        self.resource_mock = resourcepatcher.start()
+        self.resource_mock.getrusage.side_effect = self.rusage
+
+        monotonicpatcher = patch('pep3143daemon.instrument.monotonic', autospeck=True)
+        self.monotonic_mock = monotonicpatcher.start()
+        self.monotonic_mock.side_effect = [1.0, 1.5, 2.0, 4.0]
+
+        self.addCleanup(patch.stopall)
+
+        self.usage = 0
+
+    def rusage(self, who):
+        self.usage += 10
+        usage = Mock()
+        for field in pep3143daemon.instrument.RUSAGE_FIELDS:
+            setattr(usage, field, self.usage)
+        return usage
+
+    def test_run(self):
+        hook = Mock()
+        report = pep3143daemon.instrument.StartupReport(hook)
+        result = report.run('environment', lambda: 'done')
+        self.assertEqual(result, 'done')
+        event = report.phase('environment')
+        self.assertEqual(event.duration, 0.5)
+        self.assertEqual(event.pid, 100)
+        self.assertFalse(event.forked)
+        self.assertEqual(event.rusage['ru_utime'], 10)
+        hook.assert_called_once_with(event)
+
+    def test_run_fork(self):
+        report = pep3143daemon.instrument.StartupReport()
+        self.os_mock.getpid.side_effect = [100, 200]
+        report.run('first_fork', Mock())
+        event = report.phase('first_fork')
+        self.assertTrue(event.forked)
+        self.assertEqual(event.parent_pid, 100)
+        self.assertEqual(event.pid, 200)
+        self.assertEqual(event.rusage['ru_utime'], 20)
+
+    def test_run_error(self):
+        hook = Mock()
+        report = pep3143daemon.instrument.StartupReport(hook)
+        error = ValueError('failed')
+        self.assertRaises(ValueError, report.run, 'pidfile', Mock(side_effect=error))
+        self.assertIs(report.phase('pidfile').error, error)
+        self.assertEqual(hook.call_count, 1)
+
+    def test_duration(self):
+        report = pep3143daemon.instrument.StartupReport()
+        self.assertEqual(report.duration, 0.0)
+        report.run('environment', Mock())
+        report.run('signals', Mock())
+        self.assertEqual(report.duration, 3.0)
+        self.assertEqual(
+            [event['phase'] for event in report.as_dict()['events']],
+            ['environment', 'signals'])
+        self.assertIsNone(report.phase('pidfile'))
@@ -0,0 +1,113 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import os
+import shutil
+import tempfile
+
+from pep3143daemon import DaemonError
+import pep3143daemon.logfile
+
+
+class TestLogFileUnit(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, 'test.log')
+
+    def logfile(self, **kwargs):
+        log = pep3143daemon.logfile.LogFile(self.path, **kwargs)
+        self.addCleanup(os.close, log.fileno())
+        self.addCleanup(log.stop)
+        return log
+
+    def read(self, path):
+        with open(path, 'rb') as log:
+            return log.read()
+
+    def stream(self):
+        stream = Mock()
+        stream.fileno.return_value = os.open(os.devnull, os.O_WRONLY)
+        self.addCleanup(os.close, stream.fileno.return_value)
+        return stream
+
+    def test_init(self):
+        log = self.logfile()
+        os.write(log.fileno(), b'line\n')
+        self.assertEqual(self.read(self.path), b'line\n')
+        self.assertFalse(os.get_inheritable(log.fileno()))
+
+    def test_init_error(self):
+        self.assertRaises(
+            DaemonError, pep3143daemon.logfile.LogFile,
+            os.path.join(self.directory, 'missing', 'test.log'))
+
+    def test_attach(self):
+        log = self.logfile()
+        stream = self.stream()
+        self.assertEqual(log.attach(stream), log.fileno())
+        self.assertIsNone(log._thread)
+
+    def test_reopen(self):
+        log = self.logfile()
+        fileno = log.fileno()
+        stream = self.stream()
+        log.attach(stream)
+        os.rename(self.path, self.path + '.old')
+        log.reopen()
+        self.assertEqual(log.fileno(), fileno)
+        os.write(fileno, b'log\n')
+        os.write(stream.fileno(), b'stream\n')
+        self.assertEqual(self.read(self.path), b'log\nstream\n')
+        self.assertEqual(self.read(self.path + '.old'), b'')
+
+    def test_rotate(self):
+        log = self.logfile(backup_count=2)
+        for line in b'1\n', b'2\n', b'3\n':
+            os.write(log.fileno(), line)
+            log.rotate()
+        self.assertEqual(self.read(self.path), b'')
+        self.assertEqual(self.read(self.path + '.1'), b'3\n')
+        self.assertEqual(self.read(self.path + '.2'), b'2\n')
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        self.assertEqual(log.rotations, 3)
+
+    def test_rotate_no_backups(self):
+        log = self.logfile(backup_count=0)
+        os.write(log.fileno(), b'1\n')
+        log.rotate()
+        self.assertEqual(os.listdir(self.directory), ['test.log'])
+        self.assertEqual(self.read(self.path), b'')
+
+    def test_rotate_error(self):
+        log = self.logfile()
+        os.remove(self.path)
+        self.assertRaises(DaemonError, log.rotate)
+
+    def test_rotation_due_size(self):
+        log = self.logfile(max_bytes=4)
+        self.assertFalse(log.rotation_due())
+        os.write(log.fileno(), b'1234')
+        self.assertTrue(log.rotation_due())
+
+    def test_rotation_due_interval(self):
+        log = self.logfile(rotate_interval=60)
+        log._opened = 1000.0
+        with patch('pep3143daemon.logfile.monotonic') as monotonic_mock:
+            monotonic_mock.return_value = 1059.0
+            self.assertFalse(log.rotation_due())
+            monotonic_mock.return_value = 1060.0
+            self.assertTrue(log.rotation_due())
+
+    def test_rotate_thread(self):
+        log = self.logfile(max_bytes=4, check_interval=0.01)
+        log.attach(self.stream())
+        os.write(log.fileno(), b'1234')
+        for _ in range(500):
+            if log.rotations:
+                break
+            log._stop.wait(0.01)
+        log.stop()
+        self.assertEqual(log.rotations, 1)
+        self.assertEqual(self.read(self.path + '.1'), b'1234')
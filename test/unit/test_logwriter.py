@@ -0,0 +1,174 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import os
+import shutil
+import tempfile
+import threading
+
+from pep3143daemon import DaemonError
+import pep3143daemon.logfile
+import pep3143daemon.logwriter
+
+
+class TestLogWriterUnit(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, 'test.log')
+        atexitpatcher = patch('pep3143daemon.logwriter.atexit', autospeck=True)
+        self.atexit_mock = atexitpatcher.start()
+        self.addCleanup(patch.stopall)
+
+    def read_log(self):
+        with open(self.path, 'rb') as log:
+            return log.read()
+
+    def attach(self, log):
+        stream = Mock()
+        stream.fileno.return_value = os.open(os.devnull, os.O_WRONLY)
+        self.addCleanup(os.close, stream.fileno.return_value)
+        fileno = log.attach(stream)
+        self.addCleanup(log.close)
+        return stream, fileno
+
+    def test_init_path(self):
+        log = pep3143daemon.logwriter.LogWriter(self.path)
+        self.addCleanup(log._target.close)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(log.fileno(), log._target.fileno())
+
+    def test_init_fileno(self):
+        log = pep3143daemon.logwriter.LogWriter(42)
+        self.assertEqual(log.fileno(), 42)
+
+    def test_init_errors(self):
+        self.assertRaises(
+            DaemonError, pep3143daemon.logwriter.LogWriter, 42, overflow='nope')
+        self.assertRaises(
+            DaemonError, pep3143daemon.logwriter.LogWriter,
+            os.path.join(self.directory, 'missing', 'test.log'))
+
+    def test_write_and_close(self):
+        log = pep3143daemon.logwriter.LogWriter(self.path)
+        stream, fileno = self.attach(log)
+        self.assertEqual(log.attach(stream), fileno)
+        self.assertGreater(fileno, 2)
+        self.atexit_mock.register.assert_called_once_with(log.close)
+        os.write(fileno, b'hello ')
+        os.write(fileno, b'world\n')
+        log.close()
+        self.assertEqual(self.read_log(), b'hello world\n')
+        self.assertEqual(log.written, 12)
+        self.assertEqual(log.pending, 0)
+        self.assertEqual(stream.flush.call_count, 2)
+        os.write(stream.fileno(), b'late\n')
+        self.assertEqual(self.read_log(), b'hello world\nlate\n')
+        self.assertFalse(log._writer.is_alive())
+
+    def test_batches(self):
+        log = pep3143daemon.logwriter.LogWriter(self.path, batch_size=4)
+        log._buffer.extend([b'ab', b'cd', b'ef'])
+        log._buffered = 6
+        log._eof = True
+        with patch.object(log, '_write') as write_mock:
+            log._write_loop()
+        self.assertEqual(
+            [args[0][0] for args in write_mock.call_args_list],
+            [b'abcd', b'ef'])
+        self.assertEqual(log.pending, 0)
+
+    def test_overflow_count(self):
+        log = pep3143daemon.logwriter.LogWriter(
+            self.path, capacity=4, overflow='count')
+        read_fd, write_fd = os.pipe()
+        log._read_fd = read_fd
+        log._buffer.append(b'abc')
+        log._buffered = 3
+        os.write(write_fd, b'lost')
+        os.close(write_fd)
+        log._read_loop()
+        self.assertEqual(log.dropped, 4)
+        log._write_loop()
+        self.assertEqual(
+            self.read_log(),
+            b'abc[pep3143daemon: 4 bytes of log output dropped]\n')
+
+    def test_overflow_drop(self):
+        log = pep3143daemon.logwriter.LogWriter(
+            self.path, capacity=4, overflow='drop')
+        read_fd, write_fd = os.pipe()
+        log._read_fd = read_fd
+        log._buffer.append(b'abc')
+        log._buffered = 3
+        os.write(write_fd, b'lost')
+        os.close(write_fd)
+        log._read_loop()
+        log._write_loop()
+        self.assertEqual(log.dropped, 4)
+        self.assertEqual(self.read_log(), b'abc')
+
+    def test_overflow_block(self):
+        log = pep3143daemon.logwriter.LogWriter(self.path, capacity=4)
+        read_fd, write_fd = os.pipe()
+        log._read_fd = read_fd
+        log._buffer.append(b'abcd')
+        log._buffered = 4
+        os.write(write_fd, b'efgh')
+        os.close(write_fd)
+        reader = threading.Thread(target=log._read_loop)
+        reader.start()
+        reader.join(0.1)
+        self.assertTrue(reader.is_alive())
+        with log._cond:
+            log._buffer.popleft()
+            log._buffered = 0
+            log._cond.notify_all()
+        reader.join(5)
+        self.assertFalse(reader.is_alive())
+        self.assertEqual(list(log._buffer), [b'efgh'])
+        self.assertEqual(log.dropped, 0)
+
+    def test_reopen(self):
+        log = pep3143daemon.logwriter.LogWriter(self.path)
+        self.addCleanup(log._target.close)
+        os.rename(self.path, self.path + '.old')
+        log.reopen()
+        os.write(log.fileno(), b'new\n')
+        self.assertEqual(self.read_log(), b'new\n')
+
+    def test_reopen_target(self):
+        target = pep3143daemon.logfile.LogFile(self.path)
+        self.addCleanup(os.close, target.fileno())
+        log = pep3143daemon.logwriter.LogWriter(target)
+        with patch.object(pep3143daemon.logfile.LogFile, 'reopen') as reopen_mock:
+            log.reopen()
+        reopen_mock.assert_called_once_with()
+
+    def test_write_error(self):
+        log = pep3143daemon.logwriter.LogWriter(self.path)
+        with patch('pep3143daemon.logwriter.os') as os_mock:
+            os_mock.write.side_effect = OSError(28, 'no space left')
+            log._write(b'data')
+        self.assertEqual(log.errors, 1)
+
+
+class TestAboveStdioUnit(TestCase):
+    def setUp(self):
+        ospatcher = patch('pep3143daemon.logwriter.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+        fcntlpatcher = patch('pep3143daemon.logwriter.fcntl', autospeck=True)
+        self.fcntl_mock = fcntlpatcher.start()
+        self.fcntl_mock.fcntl.return_value = 5
+        self.addCleanup(patch.stopall)
+
+    def test_above_stdio(self):
+        self.assertEqual(pep3143daemon.logwriter.above_stdio(7), 7)
+        self.assertFalse(self.fcntl_mock.fcntl.called)
+
+    def test_above_stdio_moved(self):
+        self.assertEqual(pep3143daemon.logwriter.above_stdio(1), 5)
+        self.fcntl_mock.fcntl.assert_called_once_with(
+            1, self.fcntl_mock.F_DUPFD_CLOEXEC, 3)
+        self.os_mock.close.assert_called_once_with(1)
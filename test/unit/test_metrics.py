@@ -0,0 +1,108 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import os
+import shutil
+import socket
+import tempfile
+
+from pep3143daemon import DaemonError
+from pep3143daemon.instrument import StartupEvent
+import pep3143daemon.metrics
+
+
+class TestMetricsExporterUnit(TestCase):
+    def setUp(self):
+        self.daemon = Mock()
+        self.daemon.signal_counts = {15: 1}
+        self.daemon.handover = None
+        self.daemon.startup_report = None
+        self.daemon.executors = {}
+        self.exporter = pep3143daemon.metrics.MetricsExporter(('127.0.0.1', 0))
+        self.addCleanup(self.exporter.close)
+
+    def scrape(self, request=b'GET /metrics HTTP/1.0\r\n\r\n'):
+        client = socket.create_connection(self.exporter.sock.getsockname(), 5)
+        client.sendall(request)
+        response = b''
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            response += data
+        client.close()
+        return response.decode('utf-8')
+
+    def test_serve(self):
+        self.exporter.bind()
+        self.exporter.add_collector(lambda: [
+            ('daemon_workers', 'gauge', 'Workers.', [({'pool': 'web'}, 4)])])
+        self.exporter.start(self.daemon)
+        response = self.scrape()
+        self.assertTrue(response.startswith('HTTP/1.0 200 OK\r\n'))
+        self.assertIn('\nprocess_cpu_seconds_total ', response)
+        self.assertIn('\ndaemon_signals_total{signal="15"} 1\n', response)
+        self.assertIn('\ndaemon_workers{pool="web"} 4\n', response)
+        self.assertIn('HTTP/1.0 405', self.scrape(b'POST / HTTP/1.0\r\n\r\n'))
+        self.daemon.fork_registry.register.assert_called_once_with(
+            after_in_child=self.exporter._after_fork)
+        self.exporter.close()
+        self.daemon.fork_registry.unregister.assert_called_once_with(
+            self.exporter._after_fork)
+
+    def test_after_fork(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.exporter.address = os.path.join(directory, 'metrics.sock')
+        self.exporter.bind()
+        self.exporter._after_fork()
+        self.assertIsNone(self.exporter.sock)
+        self.assertTrue(os.path.exists(self.exporter.address))
+
+    def test_bind_error(self):
+        self.exporter.address = '/nonexistent/metrics.sock'
+        self.assertRaises(DaemonError, self.exporter.bind)
+
+
+class TestMetricsHelperUnit(TestCase):
+    def test_process_metrics(self):
+        families = dict((family[0], family[3]) for family in
+                        pep3143daemon.metrics.process_metrics())
+        self.assertGreater(families['process_cpu_seconds_total'][0][1], 0)
+        self.assertGreater(families['process_max_fds'][0][1], 0)
+        self.assertEqual(len(families['process_context_switches_total']), 2)
+        if os.path.exists('/proc/self/status'):
+            self.assertGreater(families['process_resident_memory_bytes'][0][1], 0)
+            self.assertGreater(families['process_open_fds'][0][1], 0)
+
+    def test_process_metrics_no_proc(self):
+        with patch('pep3143daemon.metrics.PROC_STAT', '/nonexistent'), \
+                patch('pep3143daemon.metrics.PROC_STATUS', '/nonexistent'):
+            families = dict((family[0], family[3]) for family in
+                            pep3143daemon.metrics.process_metrics())
+        self.assertNotIn('process_resident_memory_bytes', families)
+        self.assertIn('process_cpu_seconds_total', families)
+
+    def test_daemon_metrics(self):
+        daemon = Mock()
+        daemon.signal_counts = {15: 2, 1: 1}
+        daemon.handover.generation = 3
+        daemon.startup_report = [StartupEvent('first_fork', 1.0, 1.5, 2, 1, {})]
+        daemon.executors = {'io': Mock()}
+        daemon.executor_stats.return_value = {'io': {
+            'queued': 4, 'completed': 5, 'failed': 1, 'cancelled': 0}}
+        text = pep3143daemon.metrics.render(
+            pep3143daemon.metrics.daemon_metrics(daemon))
+        self.assertIn('daemon_signals_total{signal="1"} 1\n'
+                      'daemon_signals_total{signal="15"} 2\n', text)
+        self.assertIn('daemon_generation 3\n', text)
+        self.assertIn('daemon_startup_phase_seconds{phase="first_fork"} 0.5\n', text)
+        self.assertIn('daemon_executor_queued_tasks{executor="io"} 4\n', text)
+        self.assertIn('daemon_executor_tasks_total{executor="io",result="failed"} 1\n', text)
+
+    def test_render(self):
+        text = pep3143daemon.metrics.render([
+            ('up', 'gauge', 'Up.', [({}, 1), ({'name': 'a"b'}, 0.5)])])
+        self.assertEqual(text, '# HELP up Up.\n# TYPE up gauge\nup 1\n'
+                               r'up{name="a\"b"} 0.5' '\n')
@@ -0,0 +1,291 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, call, patch
+import errno
+import signal
+
+from pep3143daemon import DaemonError
+import pep3143daemon.prefork
+import pep3143daemon.shutdown
+
+
+class LowLevelExit(SystemExit):
+    pass
+
+
+class TestPreforkPoolUnit(TestCase):
+    def setUp(self):
+        ospatcher = patch('pep3143daemon.prefork.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+
+        signalpatcher = patch('pep3143daemon.prefork.signal', autospeck=True)
+        self.signal_mock = signalpatcher.start()
+
+        listen_socketpatcher = patch('pep3143daemon.prefork.listen_socket', autospeck=True)
+        self.listen_socket_mock = listen_socketpatcher.start()
+
+        monotonicpatcher = patch('pep3143daemon.prefork.monotonic', autospeck=True)
+        self.monotonic_mock = monotonicpatcher.start()
+        self.monotonic_mock.return_value = 100.0
+
+        self.addCleanup(patch.stopall)
+
+        self.daemon = Mock()
+        self.daemon.files_preserve = [7]
+        self.daemon.listen_sockets = {}
+        self.daemon.fork_registry.fork.side_effect = lambda fork: fork()
+        self.worker = Mock()
+        self.pool = pep3143daemon.prefork.PreforkPool(
+            self.daemon, self.worker, workers=2,
+            listen=[('127.0.0.1', 8080), '/tmp/test.sock'])
+
+    def test___init__default_workers(self):
+        with patch('pep3143daemon.prefork.multiprocessing') as multiprocessing_mock:
+            multiprocessing_mock.cpu_count.return_value = 8
+            pool = pep3143daemon.prefork.PreforkPool(self.daemon, self.worker)
+        self.assertEqual(pool.workers, 8)
+        self.assertEqual(pool.listen, [])
+
+    def test_bind(self):
+        sock1 = Mock()
+        sock2 = Mock()
+        self.listen_socket_mock.side_effect = [sock1, sock2]
+        result = self.pool.bind()
+        self.assertEqual(result, [sock1, sock2])
+        self.listen_socket_mock.assert_has_calls(
+            [call(('127.0.0.1', 8080), 128), call('/tmp/test.sock', 128)])
+        self.assertEqual(self.daemon.files_preserve, [7, sock1, sock2])
+        self.assertEqual(self.daemon.listen_sockets, {'prefork': [sock1, sock2]})
+        self.assertEqual(self.pool.bind(), [sock1, sock2])
+        self.assertEqual(self.listen_socket_mock.call_count, 2)
+
+    def test_bind_socket_activation(self):
+        sock1 = Mock()
+        sock2 = Mock()
+        self.daemon.listen_sockets = {'http': [sock1], 'https': [sock2]}
+        self.pool.listen = []
+        result = self.pool.bind()
+        self.assertEqual(sorted(result, key=id), sorted([sock1, sock2], key=id))
+        self.assertFalse(self.listen_socket_mock.called)
+        self.assertEqual(self.daemon.files_preserve, [7])
+
+    def test_bind_handed_over(self):
+        sock1 = Mock()
+        self.daemon.listen_sockets = {'prefork': [sock1], 'other': [Mock()]}
+        self.assertEqual(self.pool.bind(), [sock1])
+        self.assertFalse(self.listen_socket_mock.called)
+
+    def test_bind_fail(self):
+        self.listen_socket_mock.side_effect = OSError(errno.EADDRINUSE, 'in use')
+        self.assertRaises(pep3143daemon.daemon.DaemonError, self.pool.bind)
+
+    def test_spawn_worker_parent(self):
+        self.os_mock.fork.return_value = 4711
+        self.assertEqual(self.pool.spawn_worker(), 4711)
+        self.assertEqual(self.pool.children, {4711: 100.0})
+
+    def test_spawn_worker_child(self):
+        self.os_mock.fork.return_value = 0
+        self.os_mock._exit.side_effect = LowLevelExit
+        self.pool.sockets = [Mock()]
+        self.pool._wakeup = (3, 4)
+        self.assertRaises(LowLevelExit, self.pool.spawn_worker)
+        self.worker.assert_called_once_with(self.pool.sockets)
+        self.os_mock.close.assert_has_calls([call(3), call(4)])
+        self.os_mock._exit.assert_called_once_with(0)
+
+    def test_spawn_worker_child_error(self):
+        self.os_mock.fork.return_value = 0
+        self.os_mock._exit.side_effect = LowLevelExit
+        self.pool._wakeup = (3, 4)
+        self.worker.side_effect = ValueError('broken')
+        with patch('pep3143daemon.prefork.traceback'):
+            self.assertRaises(LowLevelExit, self.pool.spawn_worker)
+        self.os_mock._exit.assert_called_once_with(1)
+
+    def test_spawn_worker_slots(self):
+        self.os_mock.fork.side_effect = [11, 12, 13]
+        self.pool.spawn_worker()
+        self.pool.spawn_worker()
+        self.assertEqual(self.pool.slots, {11: 0, 12: 1})
+        self.pool.children.pop(11)
+        self.pool.spawn_worker()
+        self.assertEqual(self.pool.slots, {12: 1, 13: 0})
+
+    def test_spawn_worker_stats_page(self):
+        self.os_mock.fork.side_effect = [11, 12]
+        self.os_mock.waitpid.side_effect = [(11, 0), (0, 0)]
+        self.pool.spawn_worker()
+        self.pool.spawn_worker()
+        self.pool.reap()
+        self.daemon.stats_page.set_worker.assert_has_calls([
+            call(0, 11, 'running'), call(1, 12, 'running'),
+            call(0, 11, 'exited')])
+        self.daemon.stats_page = None
+        self.os_mock.fork.side_effect = [13]
+        self.pool.spawn_worker()
+
+    def test_spawn_worker_child_slot(self):
+        self.os_mock.fork.return_value = 0
+        self.os_mock._exit.side_effect = LowLevelExit
+        self.pool._wakeup = (3, 4)
+        self.pool.children = {11: 0.0}
+        self.pool.slots = {11: 0}
+        self.worker.side_effect = lambda sockets: self.assertEqual(
+            self.pool.worker_slot, 1)
+        self.assertRaises(LowLevelExit, self.pool.spawn_worker)
+        self.os_mock._exit.assert_called_once_with(0)
+
+    def test_spawn_worker_child_cpus(self):
+        self.os_mock.fork.return_value = 0
+        self.os_mock._exit.side_effect = LowLevelExit
+        self.pool._wakeup = (3, 4)
+        self.pool.cpu_policy = 'core-per-worker'
+        self.pool.cpu_slices = [[0, 1], [2, 3]]
+        self.pool.children = {11: 0}
+        self.pool.slots = {11: 0}
+        with patch('pep3143daemon.prefork.affinity.set_affinity') as set_affinity_mock:
+            self.assertRaises(LowLevelExit, self.pool.spawn_worker)
+        set_affinity_mock.assert_called_once_with([2, 3])
+        self.os_mock._exit.assert_called_once_with(0)
+
+    def test_worker_cpus(self):
+        self.assertIsNone(self.pool.worker_cpus(0))
+        self.pool.cpu_policy = 'node-local'
+        with patch('pep3143daemon.prefork.affinity.Topology') as topology_mock:
+            restricted = topology_mock.read.return_value.restrict.return_value
+            restricted.worker_slices.return_value = [[0], [1]]
+            self.assertEqual(self.pool.worker_cpus(0), [0])
+            self.assertEqual(self.pool.worker_cpus(3), [1])
+        restricted.worker_slices.assert_called_once_with('node-local', 1)
+
+    def test_worker_cpus_cached_topology(self):
+        self.pool.cpu_policy = 'node-local'
+        self.pool.topology = pep3143daemon.affinity.Topology(
+            {0: [0, 1], 1: [2, 3]})
+        with patch('pep3143daemon.prefork.affinity.Topology.read') as read_mock, \
+                patch('pep3143daemon.prefork.affinity.allowed_cpus') as allowed_mock:
+            allowed_mock.return_value = [1, 2, 3]
+            self.assertEqual(self.pool.worker_cpus(0), [1])
+            self.assertEqual(self.pool.worker_cpus(1), [2, 3])
+        self.assertFalse(read_mock.called)
+
+    def test_start_reads_topology_before_open(self):
+        self.pool.cpu_policy = 'node-local'
+        self.daemon.open.side_effect = lambda: self.assertEqual(
+            self.pool.topology, self.daemon.read_topology.return_value)
+        with patch.object(self.pool, 'manage', side_effect=SystemExit), \
+                patch.object(self.pool, 'stop'), patch.object(self.pool, 'bind'):
+            self.assertRaises(SystemExit, self.pool.start)
+        self.daemon.open.assert_called_once_with()
+
+    def test_worker_cpus_error(self):
+        self.pool.cpu_policy = 'fastest'
+        with patch('pep3143daemon.prefork.affinity.Topology') as topology_mock:
+            topology_mock.read.return_value.restrict.return_value.worker_slices.side_effect = \
+                ValueError('nope')
+            self.assertRaises(DaemonError, self.pool.worker_cpus, 0)
+
+    def test_spawn_worker_child_preload(self):
+        self.os_mock.fork.return_value = 0
+        self.os_mock._exit.side_effect = LowLevelExit
+        self.pool._wakeup = (3, 4)
+        self.pool.preload = Mock()
+        self.worker.side_effect = lambda sockets: \
+            self.pool.preload.after_fork.assert_called_once_with()
+        self.assertRaises(LowLevelExit, self.pool.spawn_worker)
+        self.os_mock._exit.assert_called_once_with(0)
+
+    def test_memory_usage(self):
+        self.os_mock.getpid.return_value = 10
+        self.pool.children = {12: 0, 11: 0}
+        with patch('pep3143daemon.prefork.memory_usage') as memory_usage_mock:
+            memory_usage_mock.side_effect = [{'rss': 1}, OSError('gone'), {'rss': 2}]
+            self.assertEqual(self.pool.memory_usage(),
+                             {10: {'rss': 1}, 12: {'rss': 2}})
+        memory_usage_mock.assert_has_calls([call(10), call(11), call(12)])
+
+    def test_manage_grow(self):
+        self.os_mock.fork.side_effect = [11, 12]
+        self.pool.manage()
+        self.assertEqual(sorted(self.pool.children), [11, 12])
+
+    def test_manage_shrink(self):
+        self.pool.children = {11: 0, 12: 0, 13: 0}
+        self.pool.manage()
+        self.os_mock.kill.assert_called_once_with(13, self.signal_mock.SIGTERM)
+        self.assertEqual(sorted(self.pool.children), [11, 12])
+
+    def test_manage_respawn_delay(self):
+        self.pool._spawn_after = 101.0
+        self.pool.manage()
+        self.assertFalse(self.os_mock.fork.called)
+
+    def test_reap(self):
+        self.pool.children = {11: 0.0, 12: 99.5}
+        self.os_mock.waitpid.side_effect = [(11, 0), (12, 256), (0, 0)]
+        self.assertEqual(self.pool.reap(), [(11, 0), (12, 256)])
+        self.assertEqual(self.pool.children, {})
+        self.assertEqual(self.pool._spawn_after, 101.0)
+        self.assertEqual(self.pool.exits, 2)
+
+    def test_collect_metrics(self):
+        self.pool.children = {11: 0.0}
+        self.pool.exits = 3
+        self.assertEqual(self.pool.collect_metrics(), [
+            ('daemon_workers', 'gauge', 'Running worker processes.',
+             [({'pool': 'prefork'}, 1)]),
+            ('daemon_worker_exits_total', 'counter',
+             'Workers that exited, and were respawned.',
+             [({'pool': 'prefork'}, 3)])])
+
+    def test_reap_no_children(self):
+        self.os_mock.waitpid.side_effect = OSError(errno.ECHILD, 'no child')
+        self.assertEqual(self.pool.reap(), [])
+
+    def test__wait_scale(self):
+        self.pool._wakeup = (3, 4)
+        self.os_mock.read.return_value = bytearray(
+            [signal.SIGTTIN, signal.SIGTTIN, signal.SIGTTOU])
+        self.signal_mock.SIGTTIN = signal.SIGTTIN
+        self.signal_mock.SIGTTOU = signal.SIGTTOU
+        with patch('pep3143daemon.prefork.select') as select_mock:
+            select_mock.select.return_value = ([3], [], [])
+            self.pool._wait(None)
+        self.assertEqual(self.pool.workers, 3)
+
+    def test_supervise_shutdown(self):
+        self.daemon.shutdown = pep3143daemon.shutdown.ShutdownCoordinator()
+        timeouts = []
+
+        def wait(timeout):
+            timeouts.append(timeout)
+            if len(timeouts) == 2:
+                self.daemon.shutdown.request(signal.SIGTERM)
+
+        with patch.object(self.pool, 'reap') as reap_mock, \
+                patch.object(self.pool, 'manage'), \
+                patch.object(self.pool, '_wait', side_effect=wait):
+            self.pool.supervise()
+        self.assertEqual(reap_mock.call_count, 2)
+        self.assertEqual(timeouts, [0.2, 0.2])
+
+    def test_start_shutdown_stops_workers(self):
+        self.daemon.shutdown = pep3143daemon.shutdown.ShutdownCoordinator()
+        self.daemon.shutdown.request(signal.SIGTERM)
+        with patch.object(self.pool, 'manage'), \
+                patch.object(self.pool, 'stop') as stop_mock, \
+                patch.object(self.pool, 'bind'):
+            self.pool.start()
+        self.daemon.ready.assert_called_once_with()
+        stop_mock.assert_called_once_with()
+
+    def test_stop(self):
+        self.pool.children = {11: 0.0}
+        self.monotonic_mock.side_effect = [0.0, 20.0]
+        self.os_mock.waitpid.return_value = (11, 9)
+        self.pool.stop()
+        self.os_mock.kill.assert_has_calls(
+            [call(11, self.signal_mock.SIGTERM), call(11, self.signal_mock.SIGKILL)])
+        self.assertEqual(self.pool.children, {})
@@ -0,0 +1,147 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, mock_open, patch
+
+from pep3143daemon import DaemonError
+import pep3143daemon.preload
+
+
+SMAPS_ROLLUP = """\
+00400000-7ffc8a5f5000 ---p 00000000 00:00 0                      [rollup]
+Rss:                8000 kB
+Pss:                3000 kB
+Shared_Clean:       4000 kB
+Shared_Dirty:       1000 kB
+Private_Clean:       500 kB
+Private_Dirty:      2500 kB
+Referenced:         7000 kB
+Swap:                  0 kB
+THPeligible:    0
+"""
+
+
+class TestPreloadUnit(TestCase):
+    def setUp(self):
+        gcpatcher = patch('pep3143daemon.preload.gc', autospeck=True)
+        self.gc_mock = gcpatcher.start()
+
+        importlibpatcher = patch('pep3143daemon.preload.importlib', autospeck=True)
+        self.importlib_mock = importlibpatcher.start()
+
+        self.addCleanup(patch.stopall)
+
+        self.warmup = Mock()
+        self.preload = pep3143daemon.preload.Preload(
+            modules=['json', 'myapp'], warmup=[self.warmup],
+            gc_threshold=(50000, 20, 20))
+
+    def test_run(self):
+        self.warmup.side_effect = lambda: self.assertEqual(
+            self.importlib_mock.import_module.call_count, 2)
+        self.preload.run()
+        self.importlib_mock.import_module.assert_any_call('json')
+        self.importlib_mock.import_module.assert_any_call('myapp')
+        self.assertEqual(sorted(self.preload.loaded), ['json', 'myapp'])
+        self.warmup.assert_called_once_with()
+        self.gc_mock.collect.assert_called_once_with()
+        self.gc_mock.freeze.assert_called_once_with()
+
+    def test_run_no_freeze(self):
+        self.preload.freeze = False
+        self.preload.run()
+        self.assertFalse(self.gc_mock.collect.called)
+        self.assertFalse(self.gc_mock.freeze.called)
+
+    def test_run_import_error(self):
+        self.importlib_mock.import_module.side_effect = ImportError('missing')
+        self.assertRaises(DaemonError, self.preload.run)
+        self.assertFalse(self.warmup.called)
+
+    def test_after_fork(self):
+        self.preload.after_fork()
+        self.gc_mock.set_threshold.assert_called_once_with(50000, 20, 20)
+
+    def test_after_fork_no_threshold(self):
+        self.preload.gc_threshold = None
+        self.preload.after_fork()
+        self.assertFalse(self.gc_mock.set_threshold.called)
+
+
+class TestMemoryUsageUnit(TestCase):
+    def test_memory_usage(self):
+        with patch('pep3143daemon.preload.os.path.exists', return_value=True), \
+                patch('pep3143daemon.preload.open', mock_open(read_data=SMAPS_ROLLUP),
+                      create=True) as open_mock:
+            result = pep3143daemon.preload.memory_usage(42)
+        open_mock.assert_called_once_with('/proc/42/smaps_rollup')
+        self.assertEqual(result, {
+            'rss': 8000 * 1024, 'pss': 3000 * 1024, 'shared': 5000 * 1024,
+            'private': 3000 * 1024, 'swap': 0})
+
+    def test_memory_usage_smaps(self):
+        with patch('pep3143daemon.preload.os.path.exists', return_value=False), \
+                patch('pep3143daemon.preload.open', mock_open(read_data=SMAPS_ROLLUP),
+                      create=True) as open_mock:
+            pep3143daemon.preload.memory_usage(42)
+        open_mock.assert_called_once_with('/proc/42/smaps')
+
+    def test_memory_usage_self(self):
+        result = pep3143daemon.preload.memory_usage()
+        self.assertGreater(result['rss'], 0)
+
+
+class TestPreloadManifestUnit(TestCase):
+    def setUp(self):
+        importlibpatcher = patch('pep3143daemon.preload.importlib', autospeck=True)
+        self.importlib_mock = importlibpatcher.start()
+
+        codecspatcher = patch('pep3143daemon.preload.codecs', autospeck=True)
+        self.codecs_mock = codecspatcher.start()
+
+        timepatcher = patch('pep3143daemon.preload.time', autospeck=True)
+        self.time_mock = timepatcher.start()
+
+        meta_pathpatcher = patch('pep3143daemon.preload.sys.meta_path', [])
+        self.meta_path = meta_pathpatcher.start()
+
+        self.addCleanup(patch.stopall)
+
+        self.manifest = pep3143daemon.preload.PreloadManifest(
+            modules=['json'], encodings=['idna'], files=['/etc/ca.crt'])
+
+    def test_apply(self):
+        with patch('pep3143daemon.preload.open', mock_open(read_data=b'cert'),
+                   create=True) as open_mock:
+            self.manifest.apply()
+        self.importlib_mock.import_module.assert_called_once_with('json')
+        self.codecs_mock.lookup.assert_called_once_with('idna')
+        open_mock.assert_called_once_with('/etc/ca.crt', 'rb')
+        self.assertEqual(self.manifest.read('/etc/ca.crt'), b'cert')
+        self.time_mock.tzset.assert_called_once_with()
+        self.assertEqual(self.meta_path, [])
+
+    def test_apply_errors(self):
+        self.importlib_mock.import_module.side_effect = ImportError('missing')
+        self.assertRaises(DaemonError, self.manifest.apply)
+        self.importlib_mock.import_module.side_effect = None
+        self.codecs_mock.lookup.side_effect = LookupError('unknown')
+        self.assertRaises(DaemonError, self.manifest.apply)
+        self.codecs_mock.lookup.side_effect = None
+        with patch('pep3143daemon.preload.open', side_effect=IOError('denied'),
+                   create=True):
+            self.assertRaises(DaemonError, self.manifest.apply)
+
+    def test_apply_diagnose(self):
+        self.manifest.diagnose = True
+        self.importlib_mock.import_module.side_effect = ImportError('missing')
+        with patch('pep3143daemon.preload.open', side_effect=IOError('denied'),
+                   create=True):
+            self.manifest.apply()
+            self.manifest.apply()
+        self.assertEqual(self.manifest.missed, [
+            ('module', 'json'), ('file', '/etc/ca.crt'),
+            ('module', 'json'), ('file', '/etc/ca.crt')])
+        self.assertEqual(len(self.meta_path), 1)
+        self.assertIsNone(self.meta_path[0].find_spec('lazy.module'))
+        self.assertEqual(self.manifest.missed[-1], ('module', 'lazy.module'))
@@ -0,0 +1,105 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import shutil
+import tempfile
+import threading
+
+import pep3143daemon.profiler
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        stop.wait(0.001)
+
+
+class TestSamplingProfilerUnit(TestCase):
+    def setUp(self):
+        self.stderrpatcher = patch('pep3143daemon.profiler.sys.stderr')
+        self.stderr_mock = self.stderrpatcher.start()
+        self.addCleanup(patch.stopall)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.profiler = pep3143daemon.profiler.SamplingProfiler(
+            rate=500, directory=self.directory, max_overhead=0.5)
+        # cleanups run last in first out: the profiler writes its
+        # summary while stderr is still patched
+        self.addCleanup(self.profiler.close)
+
+    def test_sample(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stop,),
+                                  name='busy')
+        worker.start()
+        self.addCleanup(worker.join)
+        self.addCleanup(stop.set)
+        self.profiler.sample(skip=threading.current_thread().ident)
+        self.assertEqual(self.profiler.sample_count, 1)
+        stacks = list(self.profiler.samples)
+        self.assertEqual(len(stacks), 1)
+        self.assertTrue(stacks[0].startswith('busy;'))
+        self.assertIn(';busy_loop (test_profiler.py:', stacks[0])
+
+    def test_collapsed(self):
+        self.profiler.samples = {'main;b (x.py:2)': 1, 'main;a (x.py:1)': 3}
+        self.assertEqual(self.profiler.collapsed(),
+                         'main;a (x.py:1) 3\nmain;b (x.py:2) 1\n')
+
+    def test_toggle(self):
+        self.profiler.toggle(12, None)
+        self.assertTrue(self.profiler.running)
+        self.profiler._stop.wait(0.05)
+        self.profiler.toggle(12, None)
+        self.profiler._thread.join(5)
+        self.assertFalse(self.profiler.running)
+        summary = self.profiler.summary()
+        self.assertGreater(summary['samples'], 0)
+        self.assertLessEqual(summary['overhead'], 1.0)
+        self.assertEqual(os.path.dirname(summary['path']), self.directory)
+        with open(summary['path']) as profile:
+            lines = profile.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit()
+                            for line in lines))
+        self.assertTrue(any(line.startswith('MainThread;')
+                            for line in lines))
+        self.stderr_mock.write.assert_called_once_with(
+            'profiler: {0}\n'.format(summary))
+
+    def test_max_duration(self):
+        self.profiler.max_duration = 0
+        self.profiler.start()
+        self.profiler._thread.join(5)
+        self.assertFalse(self.profiler.running)
+        self.assertEqual(self.profiler.sample_count, 1)
+        self.assertIsNotNone(self.profiler.path)
+
+    def test_overhead_bound(self):
+        waits = []
+        self.profiler.max_overhead = 0.01
+        self.profiler.rate = 1000
+        with patch('pep3143daemon.profiler.monotonic') as monotonic_mock, \
+                patch.object(self.profiler, 'write'):
+            monotonic_mock.side_effect = [10.0, 10.5, 11.0]
+            self.profiler.started = 0.0
+            self.profiler._stop.wait = lambda timeout: waits.append(timeout) or True
+            self.profiler._run()
+        self.assertEqual(waits, [49.5])
+        self.assertEqual(self.profiler.sample_time, 0.5)
+
+    def test_write_error(self):
+        self.profiler.directory = os.path.join(self.directory, 'missing')
+        with patch('pep3143daemon.profiler.traceback') as traceback_mock:
+            self.profiler.max_duration = 0
+            self.profiler.start()
+            self.profiler._thread.join(5)
+        traceback_mock.print_exc.assert_called_once_with()
+        self.assertIsNone(self.profiler.path)
+
+    def test_forked_child(self):
+        self.profiler.start()
+        with patch('pep3143daemon.profiler.os.getpid', return_value=-1):
+            self.assertFalse(self.profiler.running)
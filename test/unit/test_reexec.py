@@ -0,0 +1,103 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import call, patch
+
+import pep3143daemon.reexec
+
+
+class LowLevelExit(SystemExit):
+    pass
+
+
+class TestHandoverUnit(TestCase):
+    def setUp(self):
+        ospatcher = patch('pep3143daemon.reexec.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+        self.addCleanup(patch.stopall)
+
+    def test_from_environment(self):
+        self.os_mock.environ = {
+            'PEP3143_PIDFILE_FD': '5',
+            'PEP3143_READY_FD': '6',
+            'PEP3143_GENERATION': '2',
+            'PATH': '/bin'}
+        handover = pep3143daemon.reexec.Handover.from_environment()
+        self.assertEqual(handover.pidfile_fd, 5)
+        self.assertEqual(handover.ready_fd, 6)
+        self.assertEqual(handover.generation, 2)
+        self.assertEqual(self.os_mock.environ, {'PATH': '/bin'})
+
+    def test_from_environment_no_pidfile(self):
+        self.os_mock.environ = {'PEP3143_READY_FD': '3', 'PEP3143_GENERATION': '1'}
+        handover = pep3143daemon.reexec.Handover.from_environment(False)
+        self.assertIsNone(handover.pidfile_fd)
+        self.assertEqual(handover.ready_fd, 3)
+        self.assertEqual(len(self.os_mock.environ), 2)
+
+    def test_from_environment_not_reexecuted(self):
+        self.os_mock.environ = {}
+        self.assertIsNone(pep3143daemon.reexec.Handover.from_environment())
+
+
+class TestSpawnUnit(TestCase):
+    def setUp(self):
+        ospatcher = patch('pep3143daemon.reexec.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+        self.os_mock.environ = {'PATH': '/bin', 'LISTEN_FDS': '9'}
+        self.os_mock.getpid.return_value = 4711
+        self.os_mock._exit.side_effect = LowLevelExit
+
+        fcntlpatcher = patch('pep3143daemon.reexec.fcntl', autospeck=True)
+        self.fcntl_mock = fcntlpatcher.start()
+        self.fcntl_mock.fcntl.side_effect = lambda fileno, cmd, base: fileno + 100
+
+        self.addCleanup(patch.stopall)
+
+    def test_command(self):
+        with patch('pep3143daemon.reexec.sys') as sys_mock:
+            sys_mock.executable = '/usr/bin/python3'
+            sys_mock.orig_argv = ['python3', '-m', 'service', '--debug']
+            self.assertEqual(
+                pep3143daemon.reexec.command(),
+                ['/usr/bin/python3', '-m', 'service', '--debug'])
+            sys_mock.orig_argv = None
+            sys_mock.argv = ['service.py', '--debug']
+            self.assertEqual(
+                pep3143daemon.reexec.command(),
+                ['/usr/bin/python3', 'service.py', '--debug'])
+
+    def test_spawn_parent(self):
+        self.os_mock.fork.return_value = 1234
+        result = pep3143daemon.reexec.spawn({'http': [7]}, 8, 9, 1, '/srv', ['python'])
+        self.assertEqual(result, 1234)
+        self.assertFalse(self.os_mock.execve.called)
+
+    def test_spawn_child(self):
+        self.os_mock.fork.return_value = 0
+        self.assertRaises(
+            LowLevelExit, pep3143daemon.reexec.spawn,
+            {'https': [12], 'http': [7, 10]}, 8, 9, 2, '/srv', ['python', 'service.py'])
+        self.os_mock.dup2.assert_has_calls(
+            [call(107, 3), call(110, 4), call(112, 5), call(108, 6), call(109, 7)])
+        self.os_mock.chdir.assert_called_once_with('/srv')
+        self.os_mock.execve.assert_called_once_with(
+            'python', ['python', 'service.py'],
+            {'PATH': '/bin',
+             'LISTEN_PID': '4711',
+             'LISTEN_FDS': '3',
+             'LISTEN_FDNAMES': 'http:http:https',
+             'PEP3143_PIDFILE_FD': '6',
+             'PEP3143_READY_FD': '7',
+             'PEP3143_GENERATION': '2'})
+        self.os_mock._exit.assert_called_once_with(127)
+
+    def test_spawn_child_no_sockets_no_pidfile(self):
+        self.os_mock.fork.return_value = 0
+        self.assertRaises(
+            LowLevelExit, pep3143daemon.reexec.spawn,
+            {}, None, 9, 1, '/srv', ['python'])
+        self.os_mock.dup2.assert_called_once_with(109, 3)
+        self.os_mock.execve.assert_called_once_with(
+            'python', ['python'],
+            {'PATH': '/bin', 'PEP3143_READY_FD': '3', 'PEP3143_GENERATION': '1'})
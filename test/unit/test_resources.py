@@ -0,0 +1,140 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, call, mock_open, patch
+import resource
+
+from pep3143daemon import DaemonError
+import pep3143daemon.resources
+
+
+class TestResourceProfileUnit(TestCase):
+    def setUp(self):
+        self.profile = pep3143daemon.resources.ResourceProfile(
+            rlimits={'NOFILE': 'hard', 'RLIMIT_NPROC': 100,
+                     resource.RLIMIT_MEMLOCK: (1, 2)},
+            nice=5, ionice=('idle', 0), oom_score_adj=-500,
+            sched_policy='batch')
+        names = ['set_rlimit', 'set_nice', 'set_ionice', 'set_oom_score_adj',
+                 'set_sched_policy']
+        self.mocks = {}
+        for name in names:
+            patcher = patch('pep3143daemon.resources.' + name, autospeck=True)
+            self.mocks[name] = patcher.start()
+        self.addCleanup(patch.stopall)
+
+    def test_init(self):
+        self.assertEqual(self.profile.rlimits, {
+            resource.RLIMIT_NOFILE: 'hard',
+            resource.RLIMIT_NPROC: 100,
+            resource.RLIMIT_MEMLOCK: (1, 2)})
+
+    def test_init_errors(self):
+        profile = pep3143daemon.resources.ResourceProfile
+        self.assertRaises(DaemonError, profile, rlimits={'NOPE': 1})
+        self.assertRaises(DaemonError, profile, ionice=('fast', 0))
+        self.assertRaises(DaemonError, profile, sched_policy='fast')
+
+    def test_apply(self):
+        self.profile.apply()
+        self.assertEqual(
+            sorted(self.mocks['set_rlimit'].call_args_list),
+            sorted([call(resource.RLIMIT_NOFILE, 'hard'),
+                    call(resource.RLIMIT_MEMLOCK, (1, 2))]))
+        self.mocks['set_nice'].assert_called_once_with(5)
+        self.mocks['set_ionice'].assert_called_once_with('idle', 0)
+        self.mocks['set_oom_score_adj'].assert_called_once_with(-500)
+        self.mocks['set_sched_policy'].assert_called_once_with('batch', 0)
+
+    def test_apply_empty(self):
+        pep3143daemon.resources.ResourceProfile().apply()
+        for mock in self.mocks.values():
+            self.assertFalse(mock.called)
+
+    def test_apply_after_fork(self):
+        self.profile.apply_after_fork()
+        self.mocks['set_rlimit'].assert_called_once_with(
+            resource.RLIMIT_NPROC, 100)
+        self.assertFalse(self.mocks['set_nice'].called)
+
+
+class TestResourceHelperUnit(TestCase):
+    def setUp(self):
+        resourcepatcher = patch('pep3143daemon.resources.resource', autospeck=True)
+        self.resource_mock = resourcepatcher.start()
+        self.resource_mock.error = OSError
+        self.resource_mock.getrlimit.return_value = (1024, 4096)
+
+        ospatcher = patch('pep3143daemon.resources.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+
+        self.addCleanup(patch.stopall)
+
+    def test_rlimit_number(self):
+        self.assertEqual(pep3143daemon.resources.rlimit_number('nofile'),
+                         self.resource_mock.RLIMIT_NOFILE)
+        self.assertEqual(pep3143daemon.resources.rlimit_number('RLIMIT_AS'),
+                         self.resource_mock.RLIMIT_AS)
+        self.assertEqual(pep3143daemon.resources.rlimit_number(7), 7)
+
+    def test_set_rlimit(self):
+        pep3143daemon.resources.set_rlimit(7, 'hard')
+        pep3143daemon.resources.set_rlimit(7, 10)
+        pep3143daemon.resources.set_rlimit(7, [10, 20])
+        self.resource_mock.setrlimit.assert_has_calls(
+            [call(7, (4096, 4096)), call(7, (10, 10)), call(7, (10, 20))])
+
+    def test_set_rlimit_error(self):
+        self.resource_mock.setrlimit.side_effect = ValueError('too high')
+        self.assertRaises(
+            DaemonError, pep3143daemon.resources.set_rlimit, 7, 10)
+
+    def test_set_nice(self):
+        pep3143daemon.resources.set_nice(5)
+        self.os_mock.setpriority.assert_called_once_with(
+            self.os_mock.PRIO_PROCESS, 0, 5)
+
+    def test_set_nice_error(self):
+        self.os_mock.setpriority.side_effect = OSError(13, 'permission denied')
+        self.assertRaises(DaemonError, pep3143daemon.resources.set_nice, -5)
+
+    def test_set_ionice(self):
+        with patch('pep3143daemon.resources.platform') as platform_mock, \
+                patch('pep3143daemon.resources.ctypes') as ctypes_mock:
+            platform_mock.machine.return_value = 'x86_64'
+            ctypes_mock.CDLL.return_value.syscall.return_value = 0
+            pep3143daemon.resources.set_ionice('best-effort', 4)
+            ctypes_mock.CDLL.return_value.syscall.assert_called_once_with(
+                251, 1, 0, 2 << 13 | 4)
+            ctypes_mock.CDLL.return_value.syscall.return_value = -1
+            ctypes_mock.get_errno.return_value = 1
+            self.assertRaises(
+                DaemonError, pep3143daemon.resources.set_ionice, 'realtime', 0)
+
+    def test_set_ionice_unsupported(self):
+        with patch('pep3143daemon.resources.platform') as platform_mock:
+            platform_mock.machine.return_value = 'pdp11'
+            self.assertRaises(
+                DaemonError, pep3143daemon.resources.set_ionice, 'idle', 0)
+
+    def test_set_oom_score_adj(self):
+        with patch('builtins.open', mock_open()) as open_mock:
+            pep3143daemon.resources.set_oom_score_adj(-500)
+        open_mock.assert_called_once_with('/proc/self/oom_score_adj', 'w')
+        open_mock().write.assert_called_once_with('-500\n')
+
+    def test_set_oom_score_adj_error(self):
+        with patch('builtins.open', mock_open()) as open_mock:
+            open_mock.side_effect = IOError(13, 'permission denied')
+            self.assertRaises(
+                DaemonError, pep3143daemon.resources.set_oom_score_adj, -500)
+
+    def test_set_sched_policy(self):
+        pep3143daemon.resources.set_sched_policy('fifo', 10)
+        self.os_mock.sched_setscheduler.assert_called_once_with(
+            0, self.os_mock.SCHED_FIFO, self.os_mock.sched_param(10))
+
+    def test_set_sched_policy_error(self):
+        self.os_mock.sched_setscheduler.side_effect = OSError(1, 'not permitted')
+        self.assertRaises(
+            DaemonError, pep3143daemon.resources.set_sched_policy, 'rr', 1)
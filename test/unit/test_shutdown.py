@@ -0,0 +1,113 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, call, patch
+import threading
+
+import pep3143daemon.shutdown
+
+
+class TestShutdownCoordinatorUnit(TestCase):
+    def setUp(self):
+        monotonicpatcher = patch('pep3143daemon.shutdown.monotonic', autospeck=True)
+        self.monotonic_mock = monotonicpatcher.start()
+        self.monotonic_mock.return_value = 100.0
+
+        self.addCleanup(patch.stopall)
+
+        self.shutdown = pep3143daemon.shutdown.ShutdownCoordinator(
+            drain_timeout=20)
+
+    def test_request(self):
+        self.assertFalse(self.shutdown.wait(0))
+        self.shutdown.request(15)
+        self.assertTrue(self.shutdown.wait(0))
+        self.assertEqual(self.shutdown.signal_number, 15)
+        self.assertRaises(SystemExit, self.shutdown.request, 15)
+
+    def test_wait_polls(self):
+        timer = threading.Timer(0.05, self.shutdown.request, (15,))
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertTrue(self.shutdown.wait())
+        self.assertTrue(self.shutdown.requested)
+
+    def test_wait_timeout(self):
+        self.monotonic_mock.side_effect = [100.0, 100.0, 100.5]
+        with patch('pep3143daemon.shutdown.time') as time_mock:
+            self.assertFalse(self.shutdown.wait(0.25))
+        time_mock.sleep.assert_called_once_with(0.1)
+
+    def test_stop_listeners(self):
+        sock1 = Mock()
+        sock2 = Mock()
+        stopped = []
+        self.shutdown.add_listener(sock1)
+        self.shutdown.add_listener(lambda: stopped.append(True))
+        self.shutdown.stop_listeners([sock2])
+        sock1.close.assert_called_once_with()
+        sock2.close.assert_called_once_with()
+        self.assertEqual(stopped, [True])
+
+    def test_drain(self):
+        drain1 = Mock(side_effect=lambda timeout: self.monotonic_mock.configure_mock(
+            return_value=105.0))
+        drain2 = Mock(return_value=None)
+        self.shutdown.add_drain(drain1)
+        self.shutdown.add_drain(drain2)
+        self.shutdown.drain()
+        drain1.assert_called_once_with(20.0)
+        drain2.assert_called_once_with(15.0)
+        self.assertFalse(self.shutdown.expired)
+
+    def test_drain_expired(self):
+        drain = Mock(side_effect=lambda timeout: self.monotonic_mock.configure_mock(
+            return_value=130.0))
+        self.shutdown.add_drain(drain)
+        self.shutdown.drain()
+        self.assertTrue(self.shutdown.expired)
+
+    def test_drain_gave_up(self):
+        self.shutdown.add_drain(Mock(return_value=False))
+        self.shutdown.drain()
+        self.assertTrue(self.shutdown.expired)
+
+    def test_drain_error(self):
+        drain = Mock(side_effect=ValueError('broken'))
+        after = Mock()
+        self.shutdown.add_drain(drain)
+        self.shutdown.add_drain(after)
+        with patch('pep3143daemon.shutdown.traceback') as traceback_mock:
+            self.shutdown.drain()
+        traceback_mock.print_exc.assert_called_once_with()
+        after.assert_called_once_with(20.0)
+
+    def test_stop_executors(self):
+        executor = Mock()
+        self.shutdown.add_executor(executor)
+        self.shutdown.stop_executors()
+        executor.shutdown.assert_called_once_with(True)
+        self.assertFalse(self.shutdown.expired)
+
+    def test_stop_executors_expired(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        executor = Mock()
+        executor.shutdown.side_effect = lambda wait: release.wait()
+        self.shutdown.drain_timeout = 0.01
+        self.monotonic_mock.side_effect = lambda: 100.0
+        self.shutdown.add_executor(executor)
+        self.shutdown.stop_executors()
+        self.assertTrue(self.shutdown.expired)
+
+    def test_escalate(self):
+        executor = Mock()
+        hard_stop = Mock()
+        self.shutdown.add_executor(executor)
+        self.shutdown.add_hard_stop(hard_stop)
+        self.shutdown.escalate()
+        self.assertFalse(hard_stop.called)
+        self.shutdown.expired = True
+        self.shutdown.escalate()
+        executor.shutdown.assert_called_once_with(False, cancel_futures=True)
+        hard_stop.assert_called_once_with()
@@ -0,0 +1,85 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock
+import os
+import select
+import signal
+import threading
+
+import pep3143daemon.signals
+
+
+class TestSignalDispatcherUnit(TestCase):
+    def setUp(self):
+        for signal_number in (signal.SIGUSR1, signal.SIGUSR2):
+            self.addCleanup(signal.signal, signal_number, signal.getsignal(signal_number))
+        self.received = []
+        self.handlers = {
+            signal.SIGUSR1: self.handler,
+            signal.SIGUSR2: self.handler}
+
+    def handler(self, signal_number, stack_frame):
+        self.received.append((signal_number, threading.current_thread().name))
+
+    def test_unknown_mode(self):
+        self.assertRaises(
+            ValueError, pep3143daemon.signals.SignalDispatcher, {}, 'signalfd')
+
+    def test_manual(self):
+        dispatcher = pep3143daemon.signals.SignalDispatcher(self.handlers)
+        dispatcher.install()
+        self.addCleanup(dispatcher.close)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        self.assertEqual(self.received, [])
+        self.assertEqual(dispatcher.pending, [signal.SIGUSR2, signal.SIGUSR1])
+        self.assertEqual(dispatcher.dispatch_pending(), [signal.SIGUSR2, signal.SIGUSR1])
+        self.assertEqual(
+            self.received,
+            [(signal.SIGUSR2, 'MainThread'), (signal.SIGUSR1, 'MainThread')])
+        self.assertEqual(dispatcher.dispatch_pending(), [])
+
+    def test_manual_close(self):
+        dispatcher = pep3143daemon.signals.SignalDispatcher(self.handlers)
+        dispatcher.install()
+        dispatcher.close()
+        self.assertEqual(signal.getsignal(signal.SIGUSR1), signal.SIG_DFL)
+        self.assertRaises(ValueError, dispatcher.fileno)
+
+    def test_selector(self):
+        dispatcher = pep3143daemon.signals.SignalDispatcher(self.handlers, 'selector')
+        dispatcher.install()
+        self.addCleanup(dispatcher.close)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        readable = select.select([dispatcher.fileno()], [], [], 5)[0]
+        self.assertEqual(readable, [dispatcher.fileno()])
+        self.assertEqual(dispatcher.dispatch_pending(), [signal.SIGUSR1])
+        self.assertEqual(self.received, [(signal.SIGUSR1, 'MainThread')])
+        self.assertEqual(select.select([dispatcher.fileno()], [], [], 0)[0], [])
+
+    def test_thread(self):
+        done = threading.Event()
+
+        def handler(signal_number, stack_frame):
+            self.handler(signal_number, stack_frame)
+            done.set()
+
+        dispatcher = pep3143daemon.signals.SignalDispatcher(
+            {signal.SIGUSR1: handler}, 'thread')
+        dispatcher.install()
+        self.addCleanup(dispatcher.close)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(self.received, [(signal.SIGUSR1, 'signal dispatcher')])
+
+    def test_thread_system_exit(self):
+        dispatcher = pep3143daemon.signals.SignalDispatcher(
+            {signal.SIGUSR1: Mock(side_effect=SystemExit('terminating'))}, 'thread')
+        dispatcher.install()
+        self.addCleanup(dispatcher.close)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.assertTrue(dispatcher.exit_requested.wait(5))
+        self.assertRaises(SystemExit, dispatcher.dispatch_pending)
@@ -0,0 +1,139 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import os
+import shutil
+import stat
+import tempfile
+
+from pep3143daemon import DaemonError
+import pep3143daemon.statspage
+
+
+class TestStatsPageUnit(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'app.stats')
+        self.page = pep3143daemon.statspage.StatsPage(
+            self.path, workers=4, heartbeat_interval=None)
+        self.addCleanup(self.page.close)
+        self.daemon = Mock()
+        self.daemon.handover = None
+
+    def test_layout(self):
+        self.assertEqual(pep3143daemon.statspage.HEADER.size, 56)
+        self.assertEqual(pep3143daemon.statspage.OFFSET_WORKERS % 8, 0)
+        self.assertEqual(pep3143daemon.statspage.page_size(4),
+                         56 + 65 * 8 + 4 * 24)
+
+    def test_create(self):
+        self.page.create()
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o644)
+        self.assertEqual(os.path.getsize(self.path),
+                         pep3143daemon.statspage.page_size(4))
+        stats = pep3143daemon.statspage.read_stats(self.path)
+        self.assertEqual(stats['state'], 'starting')
+        self.assertEqual(stats['pid'], os.getpid())
+        self.assertEqual(stats['requests'], 0)
+        self.assertEqual(stats['signals'], {})
+        self.assertEqual(stats['workers'], [])
+        self.assertEqual(os.listdir(self.directory), ['app.stats'])
+
+    def test_create_chown(self):
+        with patch('pep3143daemon.statspage.os.fchown') as fchown_mock:
+            self.page.create(os.getuid() + 1, None)
+        self.assertEqual(fchown_mock.call_count, 1)
+        self.assertEqual(fchown_mock.call_args[0][1:], (os.getuid() + 1, -1))
+
+    def test_create_error(self):
+        self.page.path = os.path.join(self.directory, 'missing', 'app.stats')
+        self.assertRaises(DaemonError, self.page.create)
+        self.assertIsNone(self.page.map)
+
+    def test_create_replaces_file(self):
+        self.page.create()
+        old = os.stat(self.path).st_ino
+        successor = pep3143daemon.statspage.StatsPage(self.path, workers=4)
+        successor.create()
+        self.addCleanup(successor.close)
+        self.assertNotEqual(os.stat(self.path).st_ino, old)
+        self.page.add_requests(5)
+        self.assertEqual(
+            pep3143daemon.statspage.read_stats(self.path)['requests'], 0)
+        self.page.close()
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_counters(self):
+        self.page.create()
+        self.page.set_state('running')
+        self.page.add_requests()
+        self.page.add_requests(2)
+        self.page.signal_seen(1)
+        self.page.signal_seen(1)
+        self.page.signal_seen(15)
+        self.page.signal_seen(99)
+        self.page.set_worker(0, 101, 'running')
+        self.page.set_worker(2, 103, 'exited')
+        self.page.set_worker(9, 109, 'running')
+        self.page.add_requests(4, slot=0)
+        self.page.add_requests(4, slot=9)
+        stats = pep3143daemon.statspage.read_stats(self.path)
+        self.assertEqual(stats['state'], 'running')
+        self.assertEqual(stats['requests'], 7)
+        self.assertEqual(stats['signals'], {1: 2, 15: 1})
+        self.assertEqual(
+            [(w['slot'], w['pid'], w['state'], w['requests'])
+             for w in stats['workers']],
+            [(0, 101, 'running', 4), (2, 103, 'exited', 0)])
+
+    def test_start(self):
+        self.page.create()
+        self.daemon.handover = Mock(generation=3)
+        with patch('pep3143daemon.statspage.os.getpid', return_value=4242):
+            self.page.start(self.daemon)
+        stats = pep3143daemon.statspage.read_stats(self.path)
+        self.assertEqual(stats['pid'], 4242)
+        self.assertEqual(stats['generation'], 3)
+        self.assertIsNone(self.page._thread)
+
+    def test_heartbeat_thread(self):
+        self.page.heartbeat_interval = 0.01
+        self.page.create()
+        self.page.start(self.daemon)
+        first = pep3143daemon.statspage.read_stats(self.path)['heartbeat']
+        self.page._stop.wait(0.1)
+        self.assertGreater(
+            pep3143daemon.statspage.read_stats(self.path)['heartbeat'], first)
+        self.page.close()
+        self.assertIsNone(self.page._thread)
+
+    def test_close(self):
+        self.page.create()
+        reader = pep3143daemon.statspage.StatsReader(self.path)
+        self.addCleanup(reader.close)
+        self.page.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(reader.read()['state'], 'stopped')
+        self.page.close()
+
+    def test_reader_reopen(self):
+        self.page.create()
+        reader = pep3143daemon.statspage.StatsReader(self.path)
+        self.addCleanup(reader.close)
+        successor = pep3143daemon.statspage.StatsPage(self.path, workers=2)
+        successor.create()
+        self.addCleanup(successor.close)
+        successor.set_state('running')
+        self.assertEqual(reader.read()['state'], 'starting')
+        reader.reopen()
+        self.assertEqual(reader.read()['state'], 'running')
+
+    def test_reader_errors(self):
+        self.assertRaises(DaemonError, pep3143daemon.statspage.read_stats,
+                          self.path)
+        with open(self.path, 'wb') as stats:
+            stats.write(b'x' * 100)
+        self.assertRaises(DaemonError, pep3143daemon.statspage.read_stats,
+                          self.path)
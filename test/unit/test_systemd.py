@@ -0,0 +1,166 @@
+__author__ = 'schlitzer'
+
+from unittest import TestCase
+from unittest.mock import Mock, call, patch
+import errno
+import os
+import shutil
+import socket
+import tempfile
+
+import pep3143daemon.daemon
+import pep3143daemon.systemd
+
+
+class TestListenFdsUnit(TestCase):
+    def setUp(self):
+        ospatcher = patch('pep3143daemon.systemd.os', autospeck=True)
+        self.os_mock = ospatcher.start()
+        self.os_mock.getpid.return_value = 4711
+        self.os_mock.environ = {
+            'LISTEN_PID': '4711',
+            'LISTEN_FDS': '3',
+            'LISTEN_FDNAMES': 'http:https'}
+
+        fcntlpatcher = patch('pep3143daemon.systemd.fcntl', autospeck=True)
+        self.fcntl_mock = fcntlpatcher.start()
+        self.fcntl_mock.fcntl.return_value = 0
+        self.fcntl_mock.FD_CLOEXEC = 1
+
+        socketpatcher = patch('pep3143daemon.systemd.socket', autospeck=True)
+        self.socket_mock = socketpatcher.start()
+        self.socket_mock.error = OSError
+
+        self.addCleanup(patch.stopall)
+
+    def test_listen_fds(self):
+        result = pep3143daemon.systemd.listen_fds()
+        self.assertEqual(result, {'http': [3], 'https': [4], 'unknown': [5]})
+        self.assertEqual(self.os_mock.environ, {})
+        self.fcntl_mock.fcntl.assert_has_calls(
+            [call(3, self.fcntl_mock.F_GETFD),
+             call(3, self.fcntl_mock.F_SETFD, 1)])
+
+    def test_listen_fds_keep_environment(self):
+        pep3143daemon.systemd.listen_fds(unset_environment=False)
+        self.assertEqual(self.os_mock.environ['LISTEN_FDS'], '3')
+
+    def test_unset_listen_environment(self):
+        self.os_mock.environ['PATH'] = '/bin'
+        pep3143daemon.systemd.unset_listen_environment()
+        self.assertEqual(self.os_mock.environ, {'PATH': '/bin'})
+
+    def test_listen_fds_other_pid(self):
+        self.os_mock.getpid.return_value = 1234
+        self.assertEqual(pep3143daemon.systemd.listen_fds(), {})
+        self.assertEqual(self.os_mock.environ, {})
+
+    def test_listen_fds_not_activated(self):
+        self.os_mock.environ = {}
+        self.assertEqual(pep3143daemon.systemd.listen_fds(), {})
+        self.assertFalse(self.fcntl_mock.fcntl.called)
+
+    def test_listen_sockets(self):
+        sock = Mock()
+        self.socket_mock.socket.side_effect = [sock, OSError(errno.ENOTSOCK, 'fifo')]
+        result = pep3143daemon.systemd.listen_sockets({'http': [3], 'fifo': [4]})
+        self.assertEqual(result, {'http': [sock]})
+        self.socket_mock.socket.assert_has_calls([call(fileno=3), call(fileno=4)])
+
+
+class TestNotifierUnit(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.address = os.path.join(self.directory, 'notify')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.server.bind(self.address)
+        self.server.settimeout(5)
+        self.addCleanup(self.server.close)
+        self.notifier = pep3143daemon.systemd.Notifier(self.address)
+        self.addCleanup(self.notifier.socket.close)
+
+    def receive(self):
+        return self.server.recv(4096).decode('utf-8')
+
+    def test_ready(self):
+        self.notifier.ready()
+        self.assertEqual(self.receive(), 'READY=1')
+
+    def test_ready_status(self):
+        self.notifier.ready('serving')
+        self.assertEqual(self.receive(), 'READY=1\nSTATUS=serving')
+
+    def test_status(self):
+        self.notifier.status('loading')
+        self.assertEqual(self.receive(), 'STATUS=loading')
+
+    def test_reloading(self):
+        self.notifier.reloading()
+        lines = self.receive().split('\n')
+        self.assertEqual(lines[0], 'RELOADING=1')
+        self.assertTrue(lines[1].startswith('MONOTONIC_USEC='))
+
+    def test_stopping(self):
+        self.notifier.stopping()
+        self.assertEqual(self.receive(), 'STOPPING=1')
+
+    def test_mainpid(self):
+        self.notifier.mainpid()
+        self.assertEqual(self.receive(), 'MAINPID={0}'.format(os.getpid()))
+        self.notifier.mainpid(4711)
+        self.assertEqual(self.receive(), 'MAINPID=4711')
+
+    def test_fileno(self):
+        self.assertEqual(self.notifier.fileno(), self.notifier.socket.fileno())
+
+    def test_watchdog(self):
+        self.notifier.watchdog_usec = 20000
+        self.notifier.start_watchdog()
+        self.assertEqual(self.receive(), 'WATCHDOG=1')
+        self.assertEqual(self.receive(), 'WATCHDOG=1')
+        self.notifier.stop_watchdog()
+        self.assertIsNone(self.notifier._watchdog)
+
+    def test_watchdog_disabled(self):
+        self.notifier.start_watchdog()
+        self.assertIsNone(self.notifier._watchdog)
+
+    def test_connect_fail(self):
+        self.assertRaises(
+            OSError, pep3143daemon.systemd.Notifier,
+            os.path.join(self.directory, 'missing'))
+
+    def test_from_environment(self):
+        environ = {
+            'NOTIFY_SOCKET': self.address,
+            'WATCHDOG_USEC': '30000000',
+            'WATCHDOG_PID': str(os.getpid())}
+        with patch.dict(os.environ, environ):
+            notifier = pep3143daemon.systemd.Notifier.from_environment()
+        self.addCleanup(notifier.socket.close)
+        self.assertEqual(notifier.address, self.address)
+        self.assertEqual(notifier.watchdog_usec, 30000000)
+
+    def test_from_environment_watchdog_other_pid(self):
+        environ = {
+            'NOTIFY_SOCKET': self.address,
+            'WATCHDOG_USEC': '30000000',
+            'WATCHDOG_PID': str(os.getpid() + 1)}
+        with patch.dict(os.environ, environ):
+            notifier = pep3143daemon.systemd.Notifier.from_environment(
+                unset_environment=True)
+            self.assertNotIn('NOTIFY_SOCKET', os.environ)
+        self.addCleanup(notifier.socket.close)
+        self.assertIsNone(notifier.watchdog_usec)
+
+    def test_from_environment_stale_socket(self):
+        environ = {'NOTIFY_SOCKET': os.path.join(self.directory, 'missing')}
+        with patch.dict(os.environ, environ):
+            self.assertIsNone(pep3143daemon.systemd.Notifier.from_environment())
+            daemon = pep3143daemon.daemon.DaemonContext(detach_process=False)
+        self.assertIsNone(daemon.notifier)
+
+    def test_from_environment_unset(self):
+        with patch.dict(os.environ, clear=True):
+            self.assertIsNone(pep3143daemon.systemd.Notifier.from_environment())